@@ -1,8 +1,14 @@
+import bisect
+import os
+import sys
 from collections import OrderedDict
 from datetime import time, datetime
+from functools import partial
 from random import random
 
 import numpy as np
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from bokeh.charts import Bar
 from bokeh.charts import Scatter
 from bokeh.layouts import row, column
@@ -12,10 +18,13 @@ from bokeh.models.axes import LinearAxis
 from bokeh.models.layouts import WidgetBox
 from bokeh.plotting import curdoc, figure
 from pandas import DataFrame
-from pymongo import MongoClient
 
 from bokeh.models.widgets import CheckboxGroup, Button
 
+# the modules shared by the dashboards are located in the top level directory of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import concurrency, database, downsampling, intervals, polling, queries
+
 #"#202020"
 COLORS = ["#505050", "#FF0000", "#FFD700", "#808000", "#7CFC00", "#2E8B57", "#00CED1", "#000080", "#9932CC", 
 			"#D2691E", "#a6cee3", "#1f78b4", "#b2df8a", "#33a02c", "#fb9a99", "#e31a1c", "#fdbf6f", "#ff7f00", "#cab2d6",
@@ -58,327 +67,569 @@ def legendFormat(task_types):
 	legendMarkup += "</div>"
 	return legendMarkup
 
+# Codes for the status of an event in the decoded columns
+STARTED = 1
+OK      = -1
+
 '''
-Retrieves a list of all runs with start time, number of messages and run id.
-Returns and ordered dictionary that allows to access the run information by run id but maintains the chronological order (newest first) of the runs.
-This is used to populate the run select dropdown menu.
+Converts the event documents of a run into typed columns in a single pass over the documents.
+The documents are consumed directly from the cursor (no list of documents is built), 
+only the fields in event_fields have to be present.
+Returns the columns and the watermark (timestamp and ObjectId of the last event, None if there are no events).
+The columns are a dictionary of numpy arrays with one entry per event:
+	timestamp: the time of the event
+	status   : STARTED, OK or 0 for other events
+	id       : the invocation id as string (to match start and stop events)
+	task     : the short task type name (e.g., map for genome::map:1.0)
+	values   : one column per entry in attributes, NaN where the value is NA
+	missing  : one column per entry in attributes, True where the value is NA
 '''
-def query_runs():
-
-	global datasource
+def decode_events(documents):
 
-	pipeline = [
-		{"$match": { "data.host_name": "runs"}},
-		{"$group": {"_id"           : "$session.id",
-					"numLogEntries" : {"$sum": 1},
-					"tstart"        : {"$first": "$session.tstart"},
-					}},
-		{"$sort": {"tstart": -1}}
-	]
-
-	documents = list(datasource.aggregate(pipeline))
-	run_map   = OrderedDict()
+	global attributes
 
-	for run in documents:
+	timestamps = []
+	status     = []
+	ids        = []
+	tasks      = []
+	values     = []
+	watermark  = None
+
+	for doc in documents:
+
+		data = doc["data"]
+
+		timestamps.append(doc["timestamp"])
+		status.append(STARTED if data["status"] == "started" else OK if data["status"] == "ok" else 0)
+		ids.append(str(data["id"]))
+		tasks.append(data["lam_name"].split("::")[1].split(":")[0])
+		values.extend(doc.get(attr, "NA") for attr in attributes)
+		watermark = (doc["timestamp"], doc["_id"])
+
+	# Convert the attribute values at once, mapping NA to NaN
+	values  = np.array(values, dtype=object).reshape((len(timestamps), len(attributes)))
+	missing = values == "NA"
+	values[missing] = "nan"
+
+	return {
+		"timestamp" : np.array(timestamps, dtype=float),
+		"status"    : np.array(status, dtype=int),
+		"id"        : np.array(ids, dtype=str),
+		"task"      : np.array(tasks, dtype=object),
+		"values"    : values.astype(float),
+		"missing"   : missing,
+	}, watermark
 
-		run_map[run['_id']] = dict(numLogEntries=run['numLogEntries'], tstart=run['tstart'])
+'''
+Creates the state of a run that is kept between two polls.
+The watermark (timestamp and ObjectId of the last processed event) allows to fetch only the events that arrived since the last poll,
+the remaining entries allow to continue the computation of the plot data where the last poll stopped.
+'''
+def new_run_state(run_id):
+	return {
+		"run_id"          : run_id,
+		# (timestamp, ObjectId) of the last event that has been processed, None if no event has been processed yet
+		"watermark"       : None,
+		# The timestamp of the first event, all time stamps are shifted by it
+		"tmin"            : None,
+		# The last time an event has been observed
+		"last_time"       : -1,
+		# The ids of the currently running tasks
+		"current_running" : set(),
+		# The task stack (number of running tasks per task type) and the boxes that can be extended (see shared/concurrency.py)
+		"sweep"           : concurrency.new_sweep(),
+		# The last value of every attribute that was not NA (used to replace NA's at the beginning of the next poll)
+		"last_values"     : np.zeros(len(attributes)),
+		# The task types of the run and their colors
+		"task_types"      : {},
+		# Information about the run for the info boxes
+		"general_info"    : {"tasks": run_map[run_id]["numLogEntries"]/2, "start_time" : 0, "elapsed_time": 0},
+		# The attributes and the number of running tasks of all events processed so far at several resolutions (see shared/downsampling.py)
+		"pyramid"         : downsampling.new_pyramid(LOD_BASE_WIDTH, LOD_LEVELS),
+		"profile"         : downsampling.new_pyramid(LOD_BASE_WIDTH, LOD_LEVELS),
+		# The boxes of all events processed so far (the contents of the session data source)
+		"session_data"    : {"left" : [], "right" : [], "bottom" : [], "top" : [], "colors" : [], "tasktype" : [], "running_tasks" : []},
+		# The time intervals of the invocations, to look up the invocations of a box (see shared/intervals.py)
+		"invocations"     : intervals.new_index(),
+	}
 
-	return run_map
+'''
+Copies the columns of the cached data of a run, such that streaming to a data source does not modify the cache.
+'''
+def copy_columns(columns):
+	return dict((name, list(values)) for name, values in columns.iteritems())
 
-def query_events(run_id):
+'''
+Retrieves the events of a run that arrived since the last poll and converts them to data points for the plots.
+The given run state (see new_run_state) is updated, such that the next call continues where this one stopped.
+Returns only the data points for the new events (None if there are no new events), the caller appends them to the data sources.
+'''
+def query_events(state):
 	
-	global datasource
+	global raw_events
 	global attributes
 	global attributes_ord
 
-	global task_types
+	task_types   = state["task_types"]
+	general_info = state["general_info"]
+
+	# Query for run events that are newer than the watermark, transferring only the fields that are needed for the plots,
+	# and convert them to columns while they are read from the cursor
+	pipeline = queries.run_events_pipeline(state["run_id"], state["watermark"], event_fields)
+	events, watermark = decode_events(raw_events.aggregate(pipeline))
+
+	if watermark is None:
+		return None
+
+	# Remember where to continue with the next poll
+	state["watermark"] = watermark
+
+	# All times are relative to the first event of the run
+	if state["tmin"] is None:
+		state["tmin"] = events["timestamp"][0]
+
+	tmin = state["tmin"]
+	general_info["start_time"] = tmin
+
+	# Determine how each event changes the number of running tasks
+	delta = concurrency.matched_deltas(events["status"] == STARTED, events["status"] == OK, events["id"], state["current_running"])
+
+	# Ignore stop events for which the corresponding start event has not been seen
+	keep  = (events["status"] != OK) | (delta == -1)
+	delta = delta[keep]
+	for column in events:
+		events[column] = events[column][keep]
+
+	if len(delta) == 0:
+		return None
+
+	general_info["tasks"] += np.count_nonzero(events["status"] == STARTED)
+
+	# Task types that have not been seen before get a new color, in the order of their first start event
+	for name in OrderedDict.fromkeys(events["task"][events["status"] == STARTED]):
+		if not name in task_types:
+			task_types[name] = {"color": Paired12[len(task_types.keys()) % 12]}
+
+	# Shift the time stamps by the start of the run
+	times = events["timestamp"] - tmin
+
+	# The number of running tasks after each event and the boxes of the task stack for the intervals between the events
+	running, boxes, session_patches = concurrency.sweep(state["sweep"], times, events["task"], delta)
+	state["last_time"] = events["timestamp"][-1]
+
+	# The start and end of every invocation
+	intervals.record(state["invocations"], times, events["id"], events["task"], delta)
+
+	# The boxes of the new events, boxes of previous polls are extended by patching their right edge
+	session_data = {
+		"left"          : boxes["left"].tolist(),
+		"right"         : boxes["right"].tolist(),
+		"bottom"        : boxes["bottom"].tolist(),
+		"top"           : boxes["top"].tolist(),
+		"colors"        : [task_types[name]["color"] for name in boxes["tasktype"]],
+		"tasktype"      : boxes["tasktype"].tolist(),
+		"running_tasks" : [str(count) for count in boxes["count"]],
+	}
+
+	# Two data points per event (number of running tasks before and after the event) 
+	# and one point to close the polygon (it is replaced by the first point of the next poll)
+	tarray = np.empty((2 * len(times) + 1, 2), float)
+	tarray[0:-1:2, 0] = times
+	tarray[0:-1:2, 1] = running - delta
+	tarray[1:-1:2, 0] = times
+	tarray[1:-1:2, 1] = running
+	tarray[-1]        = [times[-1], 0]
+
+	# The attribute values, NA's are replaced by the last value that was not NA (possibly from the previous poll)
+	values = fill_missing(events["values"], events["missing"], state["last_values"])
+	state["last_values"] = values[-1]
+
+	# All attributes are decoded, the checkboxes only determine which of them are visible
+	data = {}
+	for attr in attributes_ord:
+
+		# x-coordinates for every attribute seperately
+		data["timestamp_"+attr] = times.tolist()
+		data[attr]              = values[:,attributes.index(attr)].tolist()
+
+	# The data sources are extended with the new points, which requires lists
+	tdata = {}
+	tdata["time"]  = tarray[:,0].tolist()
+	tdata["tasks"] = tarray[:,1].tolist()
+
+	# Add the new points to the resolution pyramids of the run (without the point that closes the polygon)
+	downsampling.extend_pyramid(state["pyramid"], times, values[:, [attributes.index(attr) for attr in attributes_ord]])
+	downsampling.extend_pyramid(state["profile"], tarray[:-1, 0], tarray[:-1, 1:])
+
+	# Add the new boxes to the cached boxes of the run
+	for index, right in session_patches.iteritems():
+		state["session_data"]["right"][index] = right
+
+	for column in session_data:
+		state["session_data"][column].extend(session_data[column])
+
+	return data, tdata, session_data, session_patches
+
+'''
+Loads all events of a run into the data sources when switching to another run.
+The document subscribes to the poller of the run, which is shared by all documents that display the run.
+The poller queries the new events of the run in regular intervals and delivers them to update_run.
+It keeps the decoded data of the run, such that only a newly displayed run has to be queried completely.
+'''
+def load_run(run_id):
+
+	global source
+	global task_source
+	global session_source
+	global run_state
+	global run_key
+	global subscription
+	global view
 
+	global task_types
 	global general_info
 
-	global checkbox_group_p
+	# Stop receiving the events of the previously displayed run
+	if run_key is not None:
+		polling.unsubscribe(bokeh_session_id, run_key)
 
-	# The current order of tasks 
-	current_order = OrderedDict()
-	# The last time an event has been observed
-	last_time     = -1
-	# The data for the session 
-	session_data  = {"xss" : [], "yss" : [], "colors" : [], "tasktype" : [], "running_tasks" : []}
+	# Updates that were scheduled for a previous subscription are ignored
+	subscription += 1
 
-	# Pipline to query for run events
-	events_pipeline = [
-		{"$match": {"session.id": run_id}},
-		{"$sort": {"timestamp": 1}},
-	]
+	run_key   = ("load-analysis", run_id)
+	poller    = polling.subscribe(run_key, lambda: new_run_state(run_id), query_events,
+								  bokeh_session_id, document, partial(update_run, subscription), watch=run_id)
+	run_state = poller.state
 
-	# Query for events
-	l = list(datasource.aggregate(events_pipeline))
+	task_types   = run_state["task_types"]
+	general_info = run_state["general_info"]
 
-	# Number of attributes to parse
-	numAttr = len(attributes)
+	session_source.data = copy_columns(run_state["session_data"])
+	invocation_source.data = new_invocations()
 
-	# Array to collect all the points to draw for the attributes and for the tasks
-	darray = np.empty((0,numAttr), float)
-	tarray = np.empty((0,2), float)
+	# Show the whole run
+	view = None
+	show_view()
 
-	current_running = []
+'''
+Appends the events of the current run that arrived since the last poll to the data sources.
+Called by the poller of the run with the output of query_events.
+'''
+def update_run(run_subscription, new_data):
 
-	# Go through all events in l
-	for doc in l:
+	global source
+	global task_source
+	global session_source
 
-		name = doc["data"]["lam_name"].split("::")[1].split(":")[0]
+	if run_subscription != subscription:
+		return
 
-		# Create some new patches
-		if last_time >= 0:
+	data, tdata, session_data, session_patches = new_data
 
-			y = 0
+	# Boxes of previous polls that were extended by the new events
+	if len(session_patches) > 0:
+		session_source.patch({"right": session_patches.items()})
 
-			for task in current_order:
+	session_source.stream(session_data)
 
-				count = current_order[task]
+	# If the plots show a part of the run, the new data points are shown after the next zoom or pan
+	if view is None:
 
-				session_data["xss"].append([last_time, last_time, doc["timestamp"], doc["timestamp"]])
-				session_data["yss"].append([y, y+count, y+count, y])
-				session_data["colors"].append(task_types[task]["color"])
-				session_data["tasktype"].append(task)
-				session_data["running_tasks"].append(str(count))
+		# If the run got much longer than the resolution of the displayed data, show it at a coarser resolution
+		if downsampling.select_level(run_state["pyramid"], resolution(run_duration())) != view_level:
+			show_view()
+		else:
+			stream_points(data, tdata)
 
-				y += count
+	update_info()
 
-		# Create data point for current timestamp with number of runnig tasks until now
-		tarray = np.append(tarray, [[doc["timestamp"], len(current_running)]], axis=0)
+'''
+Appends the data points of new events to the data sources of the attributes and the number of running tasks,
+reduced to the resolution of the displayed data. Data points that are already displayed (see show_view) are skipped.
+'''
+def stream_points(data, tdata):
 
-		# If this is a starting event, add one new event to the list of running events
-		if doc["data"]["status"] == "started":
+	global shown_until
 
-			current_running.append(doc["data"]["id"])
-			general_info["tasks"] += 1
+	# The first new data points that are not displayed yet
+	first  = bisect.bisect_right(data["timestamp_" + attributes_ord[0]], shown_until)
+	tfirst = bisect.bisect_right(tdata["time"][:-1], shown_until)
 
-			if name in current_order:
-				# There is one more active task of this type (need to draw a bigger box)
-				current_order[name] += 1
-			else:
-				# If the task is currently not on the task stack, put it on top
-				current_order[name] = 1
+	if first < len(data["timestamp_" + attributes_ord[0]]):
+		source.stream(downsample(dict((column, values[first:]) for column, values in data.iteritems())))
 
-				# If the task has not been seen before, assign a new color
-				if not name in task_types:
-				#if not task_types.has_key(name):
+	if tfirst < len(tdata["time"]) - 1:
 
-					color = Paired12[len(task_types.keys()) % 12]
-					task_types[name] = {"color": color}
+		times, tasks = tdata["time"][tfirst:-1], tdata["tasks"][tfirst:-1]
 
-		# If this is a stop event and we have seen the corresponding start event before, we remove the id from the list of running tasks
-		elif doc["data"]["status"] == "ok":
+		if bucket_width > 0:
+			times, tasks = downsampling.min_max(times, np.array(tasks)[:, np.newaxis], bucket_width)
+			times, tasks = times[:, 0].tolist(), tasks[:, 0].tolist()
 
-			# If we have not seen the corresponding start event jet, continue with loop
-			if not doc["data"]["id"] in current_running:
-				continue
+		# The last point of the running tasks polygon only closes it, it is replaced by the first new point
+		last = len(task_source.data["time"]) - 1
+		if last >= 0:
+			task_source.patch({"time": [(last, times[0])], "tasks": [(last, tasks[0])]})
+			times, tasks = times[1:], tasks[1:]
 
-			current_running.remove(doc["data"]["id"])
+		task_source.stream({"time": times + tdata["time"][-1:], "tasks": tasks + tdata["tasks"][-1:]})
 
-			if current_order[name] == 1:
-				# The last task of this type is finished (need to remove it from the stack)
-				del(current_order[name])
+	shown_until = max(shown_until, data["timestamp_" + attributes_ord[0]][-1])
 
-			else:
-				# There are still some tasks of this type running
-				current_order[name] -= 1
+'''
+The time between the first and the last event of the displayed run.
+'''
+def run_duration():
+	return run_state["last_time"] - run_state["tmin"] if run_state["tmin"] is not None else 0
 
-		# Create data point for current timestamp with number of runnig tasks including new event
-		tarray = np.append(tarray, [[doc["timestamp"], len(current_running)]], axis=0)
+'''
+The width of the time intervals that are reduced to two data points, such that a time span fits into PLOT_WIDTH intervals.
+'''
+def resolution(span):
+	return float(span) / PLOT_WIDTH
 
-		# generate points for the loads at the three sample points
-		tmp    = [float(doc[attr]) if not doc[attr] == "NA" else -1 for attr in attributes]
-		darray = np.append(darray, [tmp], axis=0)
+'''
+Keeps the smallest and the largest value of every attribute per bucket_width interval (see shared/downsampling.py).
+Returns the data unchanged if it has no more points than the result would have.
+'''
+def downsample(data):
 
-		last_time = doc["timestamp"]
+	times = data["timestamp_" + attributes_ord[0]]
 
-	# Add the neccessary points to close the polygon if there are still some stop events that have not been seen
-	if len(current_running) > 0:
-		tarray = np.append(tarray, [[tarray[-1, 0], 0]], axis=0)
+	if bucket_width == 0:
+		return copy_columns(data)
 
-	tmin = min(darray[:,0])
-	general_info["start_time"] = tmin
+	xs, ys = downsampling.min_max(times, np.column_stack([data[attr] for attr in attributes_ord]), bucket_width)
 
-	for i in range(len(darray[:,0])):
-		darray[i,0] -= tmin
+	if len(xs) >= len(times):
+		return copy_columns(data)
 
-	for i in range(len(tarray[:,0])):
-		tarray[i,0] -= tmin
+	return points_to_columns(xs, ys)
 
-	for x in session_data["xss"]:
-		for i in range(len(x)):
-			x[i] -= tmin
+'''
+Converts the x-coordinates and values of the attributes (one column per attribute in attributes_ord) to the columns of the data source.
+'''
+def points_to_columns(xs, ys):
 
-	data = {}
-#	for attr in attributes[1:]:
-	for attr in attributes_ord:
+	columns = {}
+	for i, attr in enumerate(attributes_ord):
+		columns["timestamp_"+attr] = xs[:, i].tolist() if len(xs) > 0 else []
+		columns[attr]              = ys[:, i].tolist() if len(ys) > 0 else []
 
-#		if attributes.index(attr)-1 in checkbox_group_p.active:
-		if attributes_ord.index(attr) in checkbox_group_p.active:
+	return columns
 
-			# x-coordinates for every attribute seperately t
-#			data["timestamp_"+attr] = darray[:,0]
-#			data[attr]              = darray[:,attributes.index(attr)]
+'''
+Shows the data of the displayed run in the data sources of the attributes and the number of running tasks.
+The visible time window (view) is shown at the resolution of the plots, taken from the matching level of the resolution pyramids of the run,
+the rest of the run at the resolution that shows the whole run (such that the x-range of the plots does not change).
+Also one window width before and after the visible window is shown at the finer resolution, such that panning does not immediately require new data.
+'''
+def show_view():
 
-			tmpy = list(darray[:,attributes.index(attr)])
+	global view_level
+	global bucket_width
+	global shown_until
 
-			# Remove NA's (-1)
-			while True:
+	pyramid, profile = run_state["pyramid"], run_state["profile"]
+	duration = run_duration()
 
-				idx = 0
-				
-				try:
-					idx = tmpy.index(-1)
-				except:
-					break
-				
-				if idx == 0:
-					tmpy[idx] = 0
-				else:
-					tmpy[idx] = tmpy[idx-1]
+	view_level = downsampling.select_level(pyramid, resolution(duration))
 
-			data["timestamp_"+attr] = list(darray[:,0])
-			data[attr]              = tmpy
+	if view is None:
+		fine, start, end = view_level, 0, duration
+	else:
+		width = view[1] - view[0]
+		fine, start, end = downsampling.select_level(pyramid, resolution(width)), view[0] - width, view[1] + width
 
-		else:
+	source.data = points_to_columns(*downsampling.compose(pyramid, view_level, fine, start, end))
 
-			data["timestamp_"+attr] = darray[:,0]
-			data[attr]              = [0 for _ in range(darray.shape[1])]
+	# The polygon of the number of running tasks is closed by a point at the time of the last event, a run without events has no polygon
+	times, tasks = downsampling.compose(profile, view_level, fine, start, end)
+	if len(times) == 0:
+		task_source.data = {"time": [], "tasks": []}
+	else:
+		task_source.data = {"time": times[:, 0].tolist() + [duration], "tasks": tasks[:, 0].tolist() + [0]}
 
-	tdata = {}
-	tdata["time"]  = tarray[:,0]
-	tdata["tasks"] = tarray[:,1]
+	bucket_width = pyramid["widths"][view_level]
+	shown_until  = duration
 
-	return data, tdata, session_data
+'''
+Called when the x-range of the plots changes (zoom, pan or reset).
+The start and the end of the range change separately, the data for the new range is computed once in the next tick.
+'''
+def range_changed(attr, old, new):
 
-def select_run(run_id):
+	global view_update
 
-	global source
-	global task_source
-	global session_source
-	global current_run
+	if not view_update:
+		view_update = True
+		document.add_next_tick_callback(update_view)
 
-	global task_types
+'''
+Shows the data for the visible time window, if it is not already shown at the matching resolution.
+'''
+def update_view():
 
-	global general_info
+	global view
+	global view_update
 
-	if run_id == current_run:
-		return 
+	view_update = False
 
-	task_types    = {}
-	current_limit = None
-	current_run   = run_id
+	start, end = p.x_range.start, p.x_range.end
 
-	# Reset variables for new task
-	general_info["tasks"]        = run_map[run_id]["numLogEntries"]/2
-	general_info["elapsed_time"] = 0
+	if start is None or end is None or run_state is None or end <= start:
+		return
 
-	source.data, task_source.data, session_source.data = query_events(run_id)
+	duration = run_duration()
 
-	manualLegendBox.text = legendFormat(task_types)
+	# The whole run is visible
+	if start <= 0 and end >= duration:
+		new_view = None
 
-	# update general information info boxes
-	numMessages.text = infoBoxFormat("tasks", str(general_info["tasks"]))
-	runID.text       = infoBoxFormat("run", str(current_run))
-	startTime.text   = infoBoxFormat("start time [ms]", str(general_info["start_time"]))
+	# The window is inside the part that is already shown at the finer resolution (see show_view), and needs the same resolution
+	elif view is not None and view[0] - (view[1] - view[0]) <= start and end <= view[1] + (view[1] - view[0]) \
+			and downsampling.select_level(run_state["pyramid"], resolution(end - start)) == downsampling.select_level(run_state["pyramid"], resolution(view[1] - view[0])):
+		return
 
-# the database connection
-db = MongoClient().scientificworkflowlogs
-datasource = db.test
+	else:
+		new_view = (start, end)
 
-attributes    = ["timestamp", "min1", "min5", "min15", "duration", "procs_total", "procs_running", "procs_sleeping", "procs_waiting", "procs_vmsize", "procs_rss", "task_total", "task_running", "task_sleeping", "task_waiting", "ram_shared", "ram_buffer", "swap_total", "swap_free"]
-attributes_p1 = ["min1", "min5", "min15", "procs_running", "procs_waiting", "task_running", "task_waiting", "ram_shared", "swap_total", "swap_free"]
-attributes_p2 = ["procs_total", "procs_sleeping", "task_total", "task_sleeping", "ram_buffer"]
-attributes_p3 = ["procs_vmsize", "procs_rss"]
-attributes_p4 = ["duration"]
+	if new_view == view:
+		return
 
-# Order attributes by plot, such that the checkboxes appear in order
-attributes_ord = attributes_p1 + attributes_p2 + attributes_p3 + attributes_p4
+	view = new_view
+	show_view()
 
-#checkbox_group_p  = CheckboxGroup(labels=attributes[1:], active=[i for i in range(len(attributes[1:]))])
-checkbox_group_p  = CheckboxGroup(labels=attributes_ord, active=[i for i in range(len(attributes_ord))])
+'''
+Creates empty columns for the table of invocations.
+'''
+def new_invocations():
+	return {"id": [], "task": [], "start": [], "end": [], "duration": []}
 
-# Redraw plots, if a checkbox was set or unset
-def checkbox(attr, old, new):
+'''
+Lists the invocations of the selected box (selected by clicking it) in the table of invocations:
+the invocations of the task type of the box that were running during the time interval of the box, looked up in the interval index of the run.
+'''
+def show_invocations(attr, old, new):
 
-	global source
-	global task_source
-	global current_run
-	global checkbox_group_p
-	global attributes
-	global attributes_ord
-	global datasource
+	global invocation_source
 
-	events_pipeline = [
-		{"$match": {"session.id": current_run}},
-		{"$sort": {"timestamp": 1}},
-	]
+	selected = new["1d"]["indices"]
 
-	# Query for events
-	l = list(datasource.aggregate(events_pipeline))
+	if len(selected) == 0 or run_state is None:
+		invocation_source.data = new_invocations()
+		return
 
-	# Number of attributes to parse
-	numAttr = len(attributes)
+	box   = selected[0]
+	left  = session_source.data["left"][box]
+	right = session_source.data["right"][box]
+	name  = session_source.data["tasktype"][box]
 
-	# Array to collect all the points to draw for the attributes and for the tasks
-	darray = np.empty((0,numAttr), float)
-	tarray = np.empty((0,2), float)
+	found = intervals.overlapping(run_state["invocations"], left, right)
 
-	current_running = []
+	# Invocations that stopped at the start of the box or started at its end belong to the neighboring boxes
+	rows = [i for i in range(len(found["id"])) if found["task"][i] == name and found["start"][i] < right and (found["end"][i] is None or found["end"][i] > left)]
 
-	# Go through all events in l
-	for doc in l:
+	invocation_source.data = {
+		"id"      : [str(found["id"][i]) for i in rows],
+		"task"    : [found["task"][i] for i in rows],
+		"start"   : [found["start"][i] for i in rows],
+		"end"     : [found["end"][i] for i in rows],
+		"duration": [found["end"][i] - found["start"][i] if found["end"][i] is not None else None for i in rows],
+	}
 
-		# Create data point for current timestamp with number of runnig tasks until now
-		tarray = np.append(tarray, [[doc["timestamp"], len(current_running)]], axis=0)
+'''
+Updates the run dropdown menu, called by the poller of the run list.
+'''
+def update_runs(new_run_map):
 
-		# If this is a starting event, add one new event to the list of running events
-		if doc["data"]["status"] == "started":
+	global run_map
 
-			current_running.append(doc["data"]["id"])
-			general_info["tasks"] += 1
+	run_map = new_run_map
+	dropdown.menu = [(run_format(k, v['numLogEntries'], v['tstart']), add_prefix(k)) for k, v in run_map.iteritems() if v['tstart'] is not None]
 
-		# If this is a stop event and we have seen the corresponding start event before, we remove the id from the list of running tasks
-		elif doc["data"]["status"] == "ok":
+def select_run(run_id):
 
-			# If we have not seen the corresponding start event jet, continue with loop
-			if not doc["data"]["id"] in current_running:
-				continue
+	global current_run
 
-			current_running.remove(doc["data"]["id"])
+	if run_id == current_run:
+		return
 
-		# Create data point for current timestamp with number of runnig tasks including new event
-		tarray = np.append(tarray, [[doc["timestamp"], len(current_running)]], axis=0)
+	current_run = run_id
 
-		# generate points for the loads at the three sample points
-		tmp    = [float(doc[attr]) if not doc[attr] == "NA" else -1 for attr in attributes]
-		darray = np.append(darray, [tmp], axis=0)
+	load_run(run_id)
 
-	# Add the neccessary points to close the polygon if there are still some stop events that have not been seen
-	if len(current_running) > 0:
-		tarray = np.append(tarray, [[tarray[-1, 0], 0]], axis=0)
-	
-	data = {}
+	update_info()
 
-	for attr in attributes_ord:
+'''
+Updates the legend and the info boxes with the information about the current run.
+'''
+def update_info():
 
-		if attributes_ord.index(attr) in checkbox_group_p.active:
+	manualLegendBox.text = legendFormat(task_types)
 
-			data["timestamp_"+attr] = darray[:,0]
-			data[attr]              = darray[:,attributes.index(attr)]
+	# update general information info boxes
+	numMessages.text = infoBoxFormat("tasks", str(general_info["tasks"]))
+	runID.text       = infoBoxFormat("run", str(current_run))
+	startTime.text   = infoBoxFormat("start time [ms]", str(general_info["start_time"]))
 
-		else:
+# the collection with the log entries (the connection pool is shared by all documents, see shared/database.py)
+datasource = database.get_log_collection()
+# The events are read as raw BSON documents, that are decoded only when their fields are accessed by decode_events
+raw_events = datasource.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+
+attributes    = ["timestamp", "min1", "min5", "min15", "duration", "procs_total", "procs_running", "procs_sleeping", "procs_waiting", "procs_vmsize", "procs_rss", "task_total", "task_running", "task_sleeping", "task_waiting", "ram_shared", "ram_buffer", "swap_total", "swap_free"]
+attributes_p1 = ["min1", "min5", "min15", "procs_running", "procs_waiting", "task_running", "task_waiting", "ram_shared", "swap_total", "swap_free"]
+attributes_p2 = ["procs_total", "procs_sleeping", "task_total", "task_sleeping", "ram_buffer"]
+attributes_p3 = ["procs_vmsize", "procs_rss"]
+attributes_p4 = ["duration"]
+
+# Order attributes by plot, such that the checkboxes appear in order
+attributes_ord = attributes_p1 + attributes_p2 + attributes_p3 + attributes_p4
+
+# The fields of the log entries that are needed to compute the plot data.
+# All attributes are transferred (not only the ones with an active checkbox), because the data of a run is shared by all documents 
+# and toggling an attribute does not query the database.
+event_fields = ["data.status", "data.id", "data.lam_name"] + attributes
 
-			data["timestamp_"+attr] = darray[:,0]
-			data[attr]              = [0 for _ in range(darray.shape[1])]
+'''
+Replaces the missing (NA) attribute values by the last value in the same column that is not missing, for all attributes at once.
+Values that are missing at the beginning of a column are replaced by the initial value of that column (e.g., the last value of the previous poll).
+'''
+def fill_missing(values, missing, initial):
+
+	rows, columns = values.shape
+
+	# For each entry, the row of the last entry in the same column that is not missing (-1 if there is none)
+	last_valid = np.where(missing, -1, np.arange(rows)[:, np.newaxis])
+	last_valid = np.maximum.accumulate(last_valid, axis=0)
+
+	filled = values[np.maximum(last_valid, 0), np.arange(columns)]
 
-	source.data, task_source.data, x = query_events(current_run)
+	return np.where(last_valid < 0, initial, filled)
+
+#checkbox_group_p  = CheckboxGroup(labels=attributes[1:], active=[i for i in range(len(attributes[1:]))])
+checkbox_group_p  = CheckboxGroup(labels=attributes_ord, active=[i for i in range(len(attributes_ord))])
+
+# Show only the attributes whose checkbox is set (the data of all attributes is already in the data source)
+def checkbox(attr, old, new):
+
+	global renderers
+
+	for name in attributes_ord:
+		renderers[name].visible = attributes_ord.index(name) in checkbox_group_p.active
 
 checkbox_group_p.on_change("active", checkbox)
 
+# The document and its bokeh session id, used to subscribe to the pollers that deliver new data to the document
+document         = curdoc()
+bokeh_session_id = document.session_context.id
+subscription     = 0
+
 # get a list of all scientific workflow runs with id, number of log messages and start timestamp.
-run_map = query_runs()
+# the list is polled once for all documents (the poller is started when the server is loaded, see server_lifecycle.py), changes are delivered to update_runs
+key, create_state, fetch = queries.session_list_poller("load-analysis", datasource, queries.RUNS_HOST)
+run_map = polling.subscribe(key, create_state, fetch, bokeh_session_id, document, update_runs, watch=polling.ALL_SESSIONS).state["session_map"]
 
 # select the latest run by default
 current_run = run_map.keys()[0]
@@ -391,21 +642,47 @@ task_types = {}
 PLOT_WIDTH = 1400
 PLOT_HEIGHT = 600
 
-dict = {}
+# The resolution pyramids of a run (see shared/downsampling.py) reduce the data to buckets of LOD_BASE_WIDTH ms, 4 times that, 16 times that, etc.
+LOD_BASE_WIDTH = 100
+LOD_LEVELS     = 10
+
+init_columns = {}
 
 for attr in attributes[1:]:
 
-	dict["timestamp_"+attr] = []
-	dict[attr] = []
+	init_columns["timestamp_"+attr] = []
+	init_columns[attr] = []
 
 # The data sources for the main plot and the task boxes
-source      = ColumnDataSource(dict)
+source      = ColumnDataSource(init_columns)
 task_source = ColumnDataSource({"tasks" : [], "time" : []})
 
 # The data source for the plo displaying the active tasks over time
-session_source = ColumnDataSource({"xss": [], "yss": [], "colors": [], "tasktype": [], "running_tasks": []})
-
-source.data, task_source.data, session_source.data = query_events(current_run)
+# One box per task type and interval between two events, stored as flat numeric columns (left, right, bottom, top)
+session_source = ColumnDataSource({"left": [], "right": [], "bottom": [], "top": [], "colors": [], "tasktype": [], "running_tasks": []})
+# Clicking a box lists its invocations in the table of invocations
+session_source.on_change("selected", show_invocations)
+
+# The data source for the table of the invocations of the selected box
+invocation_source = ColumnDataSource(new_invocations())
+
+# The visible time window (start, end) in ms since the start of the run, None if the whole run is visible
+view = None
+# The level of the resolution pyramids that shows the whole run
+view_level = 0
+# Whether the data for a changed x-range is computed in the next tick
+view_update = False
+# The width of the time intervals that are reduced to two data points (minimum and maximum) per attribute, 0 to show all data points
+bucket_width = 0
+# The time of the last event whose data points are shown
+shown_until = 0
+
+# The state of the displayed run, shared with all documents that display the run
+run_state = None
+# The key of the poller of the displayed run
+run_key   = None
+
+load_run(current_run)
 
 # a dropdown menu to select a run for which data shall be visualized
 run_menu = [(run_format(k, v['numLogEntries'], v['tstart']), add_prefix(k)) for k, v in run_map.iteritems() if v['tstart'] is not None]  # use None for separator
@@ -427,6 +704,9 @@ p = figure(plot_height=PLOT_HEIGHT, plot_width=PLOT_WIDTH,
 		   x_axis_type="linear", y_axis_location="right", y_axis_type=None,
 		   webgl=True)
 p.x_range.range_padding = 0
+# Show the visible time window at the resolution of the plots (see update_view), the other plots share the x-range
+p.x_range.on_change("start", range_changed)
+p.x_range.on_change("end", range_changed)
 p.y_range.range_padding = 0
 p_yaxis                 = LinearAxis(ticker=AdaptiveTicker(min_interval=1.0))
 p.add_layout(p_yaxis, 'right')
@@ -492,24 +772,27 @@ p2.patch(x="time", y="tasks", color=COLORS[0], source=task_source, line_width=3,
 p3.patch(x="time", y="tasks", color=COLORS[0], source=task_source, line_width=0, alpha=1, legend="tasks", y_range_name="tasks")
 p4.patch(x="time", y="tasks", color=COLORS[0], source=task_source, line_width=0, alpha=1, legend="tasks", y_range_name="tasks")
 
+# The line renderer of every attribute, to show and hide them with the checkboxes
+renderers = {}
+
 # Draw everyhing for the first plot
 for attr in attributes[1:]:
 
 	if attr in attributes_p2 or attr in attributes_p3 or attr in attributes_p4:
 		continue
 
-	p.line(x="timestamp_"+attr, y=attr, line_color=COLORS[attributes.index(attr)], source=source, line_width=3, alpha=0.5, legend=attr)
+	renderers[attr] = p.line(x="timestamp_"+attr, y=attr, line_color=COLORS[attributes.index(attr)], source=source, line_width=3, alpha=0.5, legend=attr)
 
 # Draw everyhing for the second plot
 for attr in attributes_p2:
-	p2.line(x="timestamp_"+attr, y=attr, line_color=COLORS[attributes.index(attr)], source=source, line_width=3, alpha=0.5, legend=attr)
+	renderers[attr] = p2.line(x="timestamp_"+attr, y=attr, line_color=COLORS[attributes.index(attr)], source=source, line_width=3, alpha=0.5, legend=attr)
 
 # Draw everyhing for the third plot
 for attr in attributes_p3:
-	p3.line(x="timestamp_"+attr, y=attr, line_color=COLORS[attributes.index(attr)], source=source, line_width=3, alpha=05, legend=attr)
+	renderers[attr] = p3.line(x="timestamp_"+attr, y=attr, line_color=COLORS[attributes.index(attr)], source=source, line_width=3, alpha=05, legend=attr)
 
 for attr in attributes_p4:
-	p4.line(x="timestamp_"+attr, y=attr, line_color=COLORS[attributes.index(attr)], source=source, line_width=3, alpha=05, legend=attr)
+	renderers[attr] = p4.line(x="timestamp_"+attr, y=attr, line_color=COLORS[attributes.index(attr)], source=source, line_width=3, alpha=05, legend=attr)
 
 # Add legends to all of the plots
 p.legend.location  = "top_left"
@@ -519,7 +802,7 @@ p4.legend.location = "top_left"
 
 t = figure(plot_height=PLOT_HEIGHT, plot_width=PLOT_WIDTH,
 		   #tools="xpan,xwheel_zoom,xbox_zoom,reset,hover", ##### ,hover # toolbar_location="right", #this is ignored for some reason.
-		   tools="xpan,xwheel_zoom,xbox_zoom,reset, hover,save",
+		   tools="xpan,xwheel_zoom,xbox_zoom,reset, hover,tap,save",
 		   toolbar_location="above",
 		   x_axis_type="linear", y_axis_location="right", y_axis_type=None,
 		   x_range=p.x_range,
@@ -532,7 +815,7 @@ yaxis              = LinearAxis(ticker=AdaptiveTicker(min_interval=1.0))
 t.add_layout(yaxis, 'left')
 t.yaxis.axis_label = "Running Tasks"
 
-t.patches(xs="xss", ys="yss", color="colors", source=session_source, line_width=0, alpha=1)
+t.quad(left="left", right="right", bottom="bottom", top="top", color="colors", source=session_source, line_width=0, alpha=1)
 
 hover = t.select_one(HoverTool)
 hover.point_policy = "follow_mouse"
@@ -541,19 +824,26 @@ hover.tooltips = [
 	("#tasks", "@running_tasks"),
 ]
 
-# Function that clears all checkboxes and calls checkbox to redraw the plots
+# The invocations of the box that was clicked
+invocation_table = DataTable(source=invocation_source, width=PLOT_WIDTH, height=200, columns=[
+	TableColumn(field="id", title="invocation"),
+	TableColumn(field="task", title="task type"),
+	TableColumn(field="start", title="start [ms]"),
+	TableColumn(field="end", title="end [ms]"),
+	TableColumn(field="duration", title="duration [ms]"),
+])
+
+# Function that clears all checkboxes (which calls checkbox to hide the lines)
 def clear():
 	checkbox_group_p.active = []
-	checkbox("", "", "")
 
 # Button to clear all checkboxes
 clear_button = Button(label="clear all", width=20)
 clear_button.on_click(clear)
 
-# Function that sets all checkboxes and calls checkbox to redraw the plots
+# Function that sets all checkboxes (which calls checkbox to show the lines)
 def select_all():
 	checkbox_group_p.active = [i for i in range(len(attributes[1:]))]
-	checkbox("", "", "")
 
 # Button to select all checkboxes
 all_button = Button(label="select all", width=20)
@@ -564,10 +854,9 @@ layout = column(
 	row(WidgetBox(dropdown, width=410, height=100)),
 	row(runID, startTime),
 #	row(runID, numMessages),  
-	row(column(p,p2,p3,p4,t, manualLegendBox), column(checkbox_group_p, all_button, clear_button)),
+	row(column(p,p2,p3,p4,t, invocation_table, manualLegendBox), column(checkbox_group_p, all_button, clear_button)),
 )
 
 curdoc().add_root(layout)
 curdoc().title = "run Dashboard"
 
-curdoc().add_periodic_callback(lambda: select_run(current_run), 300)
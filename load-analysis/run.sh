@@ -1 +1 @@
-bokeh serve main.py --check-unused-sessions 1000 --unused-session-lifetime 1000 --host 192.168.24.74:5007 --port 5007
+bokeh serve ../load-analysis --check-unused-sessions 1000 --unused-session-lifetime 1000 --host 192.168.24.74:5007 --port 5007
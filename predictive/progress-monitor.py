@@ -9,6 +9,9 @@
 # The --host attribute whitelists http requests send to this IP address and port.
 #
 
+import os
+import sys
+
 import numpy as np
 
 import pymongo as mng
@@ -24,6 +27,9 @@ from bokeh.plotting import figure, curdoc
 from bokeh.models.widgets import Select
 from bokeh.io import output_file, show, vform
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import concurrency, queries
+
 # ============================================================================
 # configuration and global variables
 # ============================================================================
@@ -43,17 +49,11 @@ db = client.scientificworkflowlogs
 #   - Number of log entries  (int)
 #   - Session start timestamp (long)
 # Used for providing a selection box to scope the dashboard.
+# Read from the session catalog (see shared/catalog.py) instead of grouping the whole collection, the catalog is maintained by the dashboard servers.
 def get_sessions():
-    pipeline = [
-        { "$group": {"_id": "$session.id",
-            "tstart": {"$first": "$session.tstart"},
-            "numLogEntries": {"$sum": 1}
-        }},
-        { "$sort": {"tstart": -1}}
-    ]
     sessions = []
-    for session in db[mongoDbCollection].aggregate(pipeline):
-        sessions.append(session)
+    for session_id, session in queries.query_sessions(db[mongoDbCollection]).iteritems():
+        sessions.append(dict(_id=session_id, tstart=session["tstart"], numLogEntries=session["numLogEntries"]))
 
     return sessions
 
@@ -108,6 +108,7 @@ def get_invocation_lifecycle_events_per_task_type(session_id):
     pipeline = [
         { "$match": {"session.id": session_id}},
         { "$sort":  {"_id": 1}},       			    # order log entries by arrival time at database
+        { "$project": {"data.lam_name": 1, "data.status": 1}},  # transfer only the fields used by the group stage
         { "$group": {"_id": "$data.lam_name", 		# group by task type
             "data": {"$push": {"time": "$_id", "type": "$data.status"}},  # for each task type
         }},
@@ -120,16 +121,14 @@ def get_invocation_lifecycle_events_per_task_type(session_id):
     return events
 
 # Converts the output of get_invocation_lifecycle_events_per_task_type to time series comprehensible to bokeh plots
+# The counts are computed with the shared sweep (see shared/concurrency.py), stop events without a running invocation are ignored.
 def events_to_counts(lifecycle_events):
     for task_type in lifecycle_events:
-        time = [0]
-        count = [0]
-        for event in task_type['data']:
-            time.append(str(event['time']))
-            if(event['type'] == "ok"):
-                count.append(count[-1] - 1)
-            else:
-                count.append(count[-1] + 1)
+        types = [task_type['_id']] * len(task_type['data'])
+        delta = [concurrency.STOP if event['type'] == "ok" else concurrency.START for event in task_type['data']]
+        names, counts = concurrency.type_counts(types, np.array(delta, dtype=int), {})
+        time = [0] + [str(event['time']) for event in task_type['data']]
+        count = [0] + counts.sum(axis=1).tolist()
         print time
         print count
 # print(get_sessions())
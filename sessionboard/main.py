@@ -23,13 +23,27 @@
   during one update operation caused the renderer to crash without usable error messages. Firefox was getting slow
   very quickly and performance was not satisfactory for a few thousand messages.
   Moreover, it could happen that the server kept polling the database after the client went away, resulting in zombi activity.
+  Now, the database is polled once per session for all clients and the polling of a client ends with its session (see shared/polling.py).
+  If the database supports it, the polls are triggered by the inserts of new log entries instead of a timer (see shared/changes.py).
+  The boxes of all events of a poll are sent in one stream message (see stream_boxes), instead of one message per box.
+  Boxes of a task type whose stack position and count did not change are extended instead of adding a new box (see query_running_tasks_history_stacked).
+  Events are retrieved in the order in which they arrived in the database, events that arrive after newer events have been drawn
+  are merged into the events and the boxes after them are recomputed and patched (see reconcile).
+  In live tail mode, the document only keeps the boxes of a time window, older boxes are removed from the data source by the rollover of the stream messages
+  and replaced by a coarse series of the total number of running tasks, such that long running sessions do not fill the memory (see roll_window).
+  The poller of a session only keeps the events of the largest time window, the older events are reduced to the task stack after them (see trim_events).
+  Documents that display the whole session read its history from the database (see query_history).
 
 
  TODO: add a mapping from data series name to color (to be used in other visualizations, like time share and bottleneck)
 
 '''
+import bisect
+import os
+import sys
 from collections import OrderedDict
 from datetime import time, datetime
+from functools import partial
 
 import numpy as np
 from bokeh.layouts import row, column
@@ -39,197 +53,535 @@ from bokeh.models.axes import LinearAxis
 from bokeh.models.layouts import WidgetBox
 from bokeh.plotting import curdoc, figure
 from pandas import DataFrame
-from pymongo import MongoClient
 
-from bokeh.models.widgets import Select
+from bokeh.models.widgets import Select, Toggle
+
+# the modules shared by the dashboards are located in the top level directory of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import concurrency, database, downsampling, polling, queries
 
 # brewer palette "paired"
 Paired12 = ['#a6cee3', '#1f78b4', '#b2df8a', '#33a02c', '#fb9a99', '#e31a1c', '#fdbf6f', '#ff7f00', '#cab2d6',
 			'#6a3d9a', '#ffff99', '#b15928']
 
+"""
+Highlights the boxes of a task type by dimming all other boxes, called when the highlighted task type is selected.
+Only the alpha values of the boxes whose highlighting changes are sent to the client (one patch message),
+the rows of the boxes of a task type are looked up in the index of the boxes by task type (see index_boxes).
+"""
 def highlight_task(attr, old, new):
 
-	global hsource
-	global placeholder
 	global focus
 
-	patches = {
-		"xss": [],
-		"yss": [],
-		"colors": []
-	}
+	if new == focus:
+		return
 
-	focus = new
+	previous, focus = focus, new
 
-	if new == placeholder:
-		hsource.data = patches
-		return
+	# The rows of the boxes of the previous and the new task type
+	previous_rows = type_rows(previous)
+	focus_rows    = type_rows(focus)
 
-	for idx in range(len(source.data["tasktype"])):
-		if not source.data["tasktype"][idx] == new:
-			patches["xss"].append(source.data["xss"][idx])
-			patches["yss"].append(source.data["yss"][idx])
-			patches["colors"].append((idx, "#FFFFFF"))
+	if previous != placeholder and focus != placeholder:
+		# Only the boxes of the two task types change
+		patch = [(row, DIMMED_ALPHA) for row in previous_rows] + [(row, ALPHA) for row in focus_rows]
+	else:
+		# All boxes except the ones of the highlighted task type change
+		changed = np.ones(len(source.data["left"]), dtype=bool)
+		changed[previous_rows if focus == placeholder else focus_rows] = False
+		alpha = ALPHA if focus == placeholder else DIMMED_ALPHA
+		patch = [(row, alpha) for row in np.flatnonzero(changed).tolist()]
 
-	hsource.data = patches
+	if len(patch) > 0:
+		source.patch({"alpha": patch})
+
+	# The boxes that have not been sent yet
+	pending_boxes["alpha"] = [box_alpha(name) for name in pending_boxes["tasktype"]]
+
+"""
+The rows of the data source that contain boxes of a task type, the first row is the box rolled_off.
+The boxes that left the time window are kept in the index until the stream message that removes their rows has been sent (see send_boxes).
+"""
+def type_rows(name):
+	boxes = type_boxes.get(name, [])
+	return [index - rolled_off for index in boxes[bisect.bisect_left(boxes, rolled_off):bisect.bisect_left(boxes, rolled_off + len(source.data["left"]))]]
+
+"""
+The alpha value of a box of a task type, the boxes of other task types than the highlighted one are dimmed.
+"""
+def box_alpha(name):
+	return ALPHA if focus == placeholder or name == focus else DIMMED_ALPHA
+
+"""
+Adds boxes to the index of the boxes by task type, the indices of the boxes of a task type are kept in ascending order.
+:param start: the index of the first box
+:param names: the task type of each box
+"""
+def index_boxes(start, names):
+	for offset, name in enumerate(names):
+		type_boxes.setdefault(name, []).append(start + offset)
+
+"""
+Removes the boxes with an index smaller than start (before) or at least start (not before) from the index of the boxes by task type.
+"""
+def unindex_boxes(start, before):
+	for boxes in type_boxes.itervalues():
+		position = bisect.bisect_left(boxes, start)
+		if before:
+			del boxes[:position]
+		else:
+			del boxes[position:]
 
 # =====================================================================================================================
 # Business Logic Methods
 # =====================================================================================================================
 
 '''
-Retrieves a list of all sessions with start time, number of messages and session id.
-Returns and ordered dictionary that allows to access the session information by session id but maintains the chronological order (newest first) of the sessions.
-This is used to populate the session select dropdown menu.
+Creates empty columns for the boxes of the active tasks visualization.
 '''
-def query_sessions():
-	global datasource
-	pipeline = [
-		{"$group": {"_id": "$session.id",
-					"numLogEntries": {"$sum": 1},
-					"tstart": {"$first": "$session.tstart"},
-					}},
-		{"$sort": {"tstart": -1}}
-	]
-	documents = list(datasource.aggregate(pipeline))
-	session_map = OrderedDict()
-	for session in documents:
-		session_map[session['_id']] = dict(numLogEntries=session['numLogEntries'], tstart=session['tstart'])
-	return session_map
-
-''''
-	Draw the boxes for all tasks that were running between last_event_time and timestamp
-'''
-def draw(timestamp):
+def new_boxes():
+	return {"left": [], "right": [], "bottom": [], "top": [], "colors": [], "alpha": [], "tasktype": [], "running_tasks": []}
 
-	global source
-#	global hsource
-#	global placeholder
-#	global focus
-	
-	global general_info
-	global current_order
+'''
+Sends the queued boxes to the client, one stream message with at most STREAM_BUDGET boxes per tick (see send_boxes).
+The remaining boxes are sent in the next ticks, unless the document switched to another session in the meantime.
+'''
+def stream_boxes(boxes_subscription):
 
-	# If there are multiple events at the same time, don't draw, until all are collected in the task stack
-	if general_info["last_event_time"] == timestamp:
+	if boxes_subscription != subscription:
 		return
 
-	# Create an empty dictionary where we collect the new points
-	new_data = dict()
+	if send_boxes(STREAM_BUDGET):
+		document.add_next_tick_callback(partial(stream_boxes, boxes_subscription))
+
+'''
+Sends at most count queued boxes in one stream message, after one patch message that moves the right edges of the extended boxes that are already in the data source.
+The boxes are numbered in the order in which the sweep created them, the first row of the data source is the box rolled_off.
+In live tail mode, the boxes before keep_from are removed from the front of the data source by the rollover of the stream message (see roll_window).
+Returns whether boxes remain in the queue.
+'''
+def send_boxes(count):
+
+	global source
+	global rolled_off
+	global queued_from
 
-	# The y coordinate of the current task
-	y = 0
+	if len(pending_patches) > 0:
+		source.patch({"right": [(index - rolled_off, right) for index, right in pending_patches.iteritems() if index >= rolled_off]})
+		pending_patches.clear()
 
-	for task in current_order:
-		# Go through the task stack
+	if len(pending_boxes["left"]) == 0:
+		return False
 
-		count = current_order[task]
+	chunk = dict((column, values[:count]) for column, values in pending_boxes.iteritems())
+	for values in pending_boxes.itervalues():
+		del values[:count]
 
-		# Create the four corners of the box for the current task:
-		#
-		#   (last_event_time, y+count) --- (timestamp, y+count)
-		#          |                                  |
-		#   (last_event_time, y) --------------- (timestamp, y)
+	# Remove the rows of the boxes that left the time window with the rollover of the stream message
+	rows    = len(source.data["left"])
+	dropped = min(max(keep_from - rolled_off, 0), rows)
+	if dropped > 0:
+		source.stream(chunk, rows - dropped + len(chunk["left"]))
+	else:
+		source.stream(chunk)
 
-		new_data["xss"]           = [[datetime.fromtimestamp(general_info["last_event_time"]), datetime.fromtimestamp(general_info["last_event_time"]), timestamp, timestamp]]
-		new_data["yss"]           = [[y, y + count, y + count, y]]
-		# Assign the correct color to the box
-		new_data["colors"]        = [task_types[task]["color"]]
-		# Remember additional information about the task the box belongs to
-		new_data["tasktype"]      = task
-		new_data["running_tasks"] = str(count)
+	# The first row is the first remaining box, or the first box of the chunk if all rows were removed
+	rolled_off = queued_from if dropped == rows else rolled_off + dropped
+	unindex_boxes(rolled_off, True)
 
-		# Update the y coordinate for the next task
-		y += count
+	queued_from += len(chunk["left"])
 
-		# Send the new data to be drawn
-		source.stream(new_data)
+	return len(pending_boxes["left"]) > 0
 
-#		if focus == placeholder or task == focus:
-#			continue
-		
-		# Update the hilight
-#		new_data["colors"] = ["#FFFFFF" for c in new_data["colors"]]
-#		new_data.pop("tasktype")
-#		new_data.pop("running_tasks")
-#		hsource.stream(new_data)
+'''
+Creates the state of the poller for the events of a session, it is shared by all documents that display the session.
+The events of the largest time window of the live tail mode are kept in chronological order (times holds their timestamps),
+the older events are only kept as the task stack after them (base, see trim_events) and counted (trimmed).
+last_id is the ObjectId of the last event that arrived in the database, first_event_time and last_event_time the smallest and the greatest timestamp seen so far.
+'''
+def new_events_state(session_id):
+	return {"session_id": session_id, "last_id": None, "first_event_time": 0, "last_event_time": 0, "events": [], "times": [],
+			"base": concurrency.new_sweep(), "trimmed": 0}
 
 '''
-Retrieves the invocation lifecycle events (started, ok) from the database, in chronological order.
-Returns data in a format that is understood by the multiline and patches renderer and result in
-a visualization that displays the number of running tasks per task type as shaded (area-like) stacked step series.
+Inserts events (in chronological order) into a chronologically ordered list of events and the list of their timestamps.
+Events with the same timestamp are kept in the order in which they were inserted.
 '''
-def query_running_tasks_history_stacked(session_id):
+def insert_events(events, times, new_events):
+	for event in new_events:
+		position = bisect.bisect_right(times, event["timestamp"])
+		times.insert(position, event["timestamp"])
+		events.insert(position, event)
+
+'''
+Retrieves the invocation lifecycle events (started, ok) of a session that arrived in the database after the last retrieved event.
+Used as fetch function of the events poller, all events are also collected in the poller state to initialize documents that subscribe later.
+The events of a poll are sorted by their timestamp in the database, such that events that arrive out of order within a poll are drawn in order.
+Events that are older than an event of a previous poll are late, they are returned separately, such that the documents can redraw the boxes after them.
+The events are split while they are read from the cursor.
+Returns None if there are no new events, otherwise the events that are not late and the late events, both in chronological order.
+'''
+def query_events(state):
 
 	global datasource
-	global task_types
-	global current_order
 
-	global general_info
+	late    = []
+	on_time = []
 
-	# TODO: Query for late events and redraw if neccessary
+	# Query for all events that arrived after the last retrieved event, in chronological order
+	for doc in datasource.aggregate(queries.session_events_pipeline(state["session_id"], state["last_id"])):
 
-	# Query for all tasks that have a timestamp greater than last_event_time and order them by the timestamp
-	task_types_pipeline = [
-		{"$match": {"session.id": session_id, "timestamp": { "$gt" : general_info["last_event_time"] }}},
-		{"$sort": {"timestamp": 1}},
-		{"$project": {"task_type": 1, "timestamp": 1, "event": 1}}
-	]
+		if state["last_id"] is None or doc["_id"] > state["last_id"]:
+			state["last_id"] = doc["_id"]
 
-	l = list(datasource.aggregate(task_types_pipeline))
-	if len(l) == 0:
+		(late if doc["timestamp"] < state["last_event_time"] else on_time).append(doc)
+
+	if len(late) + len(on_time) == 0:
+		return None
+
+	# Late events before the kept events only change the task stack after the trimmed events
+	base_time = state["base"]["last_time"]
+	trimmed   = [doc for doc in late if base_time is not None and doc["timestamp"] <= base_time]
+	stack_events(state["base"], trimmed)
+
+	insert_events(state["events"], state["times"], late[len(trimmed):])
+	state["events"].extend(on_time)
+	state["times"].extend(doc["timestamp"] for doc in on_time)
+	if len(on_time) > 0:
+		state["last_event_time"] = on_time[-1]["timestamp"]
+	if state["first_event_time"] == 0 or (late + on_time)[0]["timestamp"] < state["first_event_time"]:
+		state["first_event_time"] = (late + on_time)[0]["timestamp"]
+
+	trim_events(state)
+
+	return on_time, late
+
+'''
+Removes the events that are older than the largest time window of the live tail mode (and one segment of it) from the state of the events poller,
+such that the memory of the poller does not grow with the length of the session.
+The task stack after the removed events is kept (base), such that documents in live tail mode can continue from it (see subscribe_session).
+Events are removed when they are at least half of the kept events, such that each event is moved only a constant number of times.
+'''
+def trim_events(state):
+
+	window = max(TAIL_WINDOWS.itervalues())
+	count  = bisect.bisect_left(state["times"], state["last_event_time"] - window - window / float(TAIL_SEGMENTS))
+
+	if count == 0 or 2 * count < len(state["times"]):
 		return
 
-	# Update the task type stack for the next task
+	times, types, delta = event_arrays(state["events"][:count])
+	concurrency.sweep(state["base"], times, types, delta)
+	state["base"]["open"]  = {}
+	state["base"]["boxes"] = 0
+
+	del state["events"][:count]
+	del state["times"][:count]
+	state["trimmed"] += count
+
+'''
+Applies events to a task stack (the counts and the order of a sweep) without computing boxes, used for late events that are older than the kept events.
+The task types that start running are put on top of the stack.
+'''
+def stack_events(stack, l):
 	for doc in l:
-		# Go through all events that were found
+		name  = doc["task_type"]
+		count = stack["counts"].get(name, 0) + (1 if doc["event"] == "invoc_start" else -1 if doc["event"] == "invoc_stop" else 0)
+		if count > 0:
+			stack["counts"][name] = count
+			if name not in stack["order"]:
+				stack["order"].append(name)
+		else:
+			stack["counts"].pop(name, None)
+			if name in stack["order"]:
+				stack["order"].remove(name)
 
-		# Update the general information of the current session
-		general_info["active_tasks"] += 1
-		if general_info["last_event_time"] != 0:
-			general_info["elapsed_time"] += doc["timestamp"] - general_info["last_event_time"]
+'''
+Reads the events of a session up to the last event retrieved by its poller from the database, in chronological order.
+Used by the documents that display the whole session, since the poller only keeps the events of the last time window (see trim_events).
+The document keeps the events it has drawn anyway (to redraw after late events), so they are returned as list.
+'''
+def query_history(state):
+	return list(datasource.aggregate(queries.session_events_pipeline(state["session_id"], until_id=state["last_id"])))
 
-		# Draw the boxes for the time elapsed
-		draw(datetime.fromtimestamp(doc["timestamp"])) 
+'''
+Processes invocation lifecycle events (started, ok) in chronological order.
+Adds data in a format that is understood by the quad renderer and result in
+a visualization that displays the number of running tasks per task type as shaded (area-like) stacked step series.
+In live tail mode, the events are processed segment by segment and the segments that left the time window are removed (see roll_window).
+The new boxes are sent to the client by stream_boxes.
+'''
+def query_running_tasks_history_stacked(l):
 
-		name = doc["task_type"]
+	global general_info
 
-		if doc["event"] == "invoc_start":
-			# The Event is a start event
+	if len(l) == 0:
+		return
 
-			if name in current_order:
-				# There is one more active task of this type (need to draw a bigger box)
-				current_order[name] += 1
-			else:
-				# If the task is currently not on the task stack, put it on top
-				current_order[name] = 1
+	# Update the general information of the current session
+	general_info["active_tasks"] += len(l)
+	if general_info["first_event_time"] == 0:
+		general_info["first_event_time"] = l[0]["timestamp"]
+	general_info["last_event_time"] = l[-1]["timestamp"]
+	general_info["elapsed_time"] = general_info["last_event_time"] - general_info["first_event_time"]
+
+	if not live_tail:
+		draw_events(l)
+	else:
+		segments = np.floor(np.array([doc["timestamp"] for doc in l], dtype=float) / segment_length())
+		starts   = np.concatenate(([0], np.flatnonzero(np.diff(segments)) + 1, [len(l)]))
+		for start, end in zip(starts[:-1], starts[1:]):
+			if sweep["last_time"] is not None and segments[start] > np.floor(sweep["last_time"] / segment_length()):
+				close_segment()
+			draw_events(l[start:end])
+
+	# Send the boxes of all events at once
+	stream_boxes(subscription)
 
-				# If the task has not been seen before, assign a new color
-				if not name in task_types:
-				#if not task_types.has_key(name):
+'''
+Draws events that are newer than the events that have been drawn.
+The task stack is computed by the sweep of the document (see shared/concurrency.py), 
+a task whose position and count on the stack did not change since the last event extends its previous box instead of adding a new one.
+The new boxes and extensions are queued for stream_boxes.
+'''
+def draw_events(l):
 
-					color = Paired12[len(task_types.keys()) % 12]
-					task_types[name] = {"color": color}
+	events.extend(l)
+	event_times.extend(doc["timestamp"] for doc in l)
 
-		elif doc["event"] == "invoc_stop":
-			# The Event is a stop event	
+	times, types, delta = event_arrays(l)
+	assign_colors(types, delta)
 
-			if current_order[name] == 1:
-				# The last task of this type is finished (need to remove it from the stack)
+	start = sweep["boxes"]
+	running, boxes, extended = concurrency.sweep(sweep, times, types, delta)
+	event_totals.extend(running.tolist())
+	add_checkpoint(len(events))
+	index_boxes(start, boxes["tasktype"])
 
-				del(current_order[name])
+	# Queue the new boxes
+	for column, values in box_columns(boxes).iteritems():
+		pending_boxes[column].extend(values)
 
-			else:
-				# There are still some tasks of this type running
+	# Move the right edges of the previous boxes that were extended, either in the queue or in the data source
+	for index, right in extended.iteritems():
+		if index >= queued_from:
+			pending_boxes["right"][index - queued_from] = datetime.fromtimestamp(right)
+		elif index >= keep_from:
+			pending_patches[index] = datetime.fromtimestamp(right)
 
-				current_order[name] -= 1
+'''
+Remembers the task stack after the first processed events, to redraw from there if late events arrive (see reconcile).
+The number of checkpoints is limited by dropping every second one, the first, the last and the ones at segment boundaries are always kept.
+'''
+def add_checkpoint(processed):
+	global checkpoints
+	checkpoints.append((sweep["last_time"], concurrency.copy_sweep(sweep), processed))
+	if len(checkpoints) > MAX_CHECKPOINTS:
+		checkpoints = checkpoints[:1] + [checkpoint for i, checkpoint in enumerate(checkpoints[1:-1]) if i % 2 == 1 or checkpoint[0] in breaks] + checkpoints[-1:]
 
-		else:
-			# The event type is unknown
-			continue
+'''
+The length of the segments in which the time window of the live tail mode is removed.
+'''
+def segment_length():
+	return tail_window / float(TAIL_SEGMENTS)
+
+'''
+Ends the boxes of the running tasks at the last event, such that no box reaches from one segment into the next one.
+The checkpoint of the last event is where the events and boxes before it can be removed (see roll_window).
+'''
+def close_segment():
+	sweep["open"] = {}
+	breaks.append(sweep["last_time"])
+	checkpoints[-1] = (sweep["last_time"], concurrency.copy_sweep(sweep), len(events))
+	roll_window()
+
+'''
+Live tail mode: removes the events, checkpoints and boxes that are older than the time window, segment by segment.
+The boxes that have not been sent yet are dropped from the queue, the rows in the data source are removed by the next stream message and then from the index of the boxes (see send_boxes).
+The removed events are added to the coarse summary series (see summarize), such that the memory of the document does not grow with the length of the session.
+'''
+def roll_window():
+
+	global breaks
+	global checkpoints
+	global keep_from
+	global queued_from
+
+	# The last segment boundary that is older than the time window
+	cutoff = sweep["last_time"] - tail_window
+	position = bisect.bisect_right(breaks, cutoff) - 1
+	if position < 0 or breaks[position] == checkpoints[0][0]:
+		return
 
-		# Update the timestamps
-		general_info["last_event_time"] = doc["timestamp"]
+	first = max(i for i, checkpoint in enumerate(checkpoints) if checkpoint[0] == breaks[position])
+	last_time, checkpoint, processed = checkpoints[first]
+
+	summarize(event_times[:processed], event_totals[:processed])
+	del events[:processed]
+	del event_times[:processed]
+	del event_totals[:processed]
+
+	checkpoints = [(t, state, count - processed) for t, state, count in checkpoints[first:]]
+	breaks = breaks[position:]
+
+	# Drop the boxes before the checkpoint
+	keep_from = checkpoint["boxes"]
+	queued = min(max(keep_from - queued_from, 0), len(pending_boxes["left"]))
+	for values in pending_boxes.itervalues():
+		del values[:queued]
+	queued_from += queued
+	for index in [index for index in pending_patches if index < keep_from]:
+		del pending_patches[index]
+
+'''
+Adds the total number of running tasks after the given events to the coarse summary series that replaces the boxes older than the time window.
+The series keeps the smallest and the largest value per bucket, the bucket width is doubled when the series gets longer than MAX_SUMMARY_POINTS.
+'''
+def summarize(times, totals):
+
+	global summary_width
+
+	if len(times) == 0:
+		return
+
+	xs, ys = downsampling.min_max(times, np.array(totals, dtype=float)[:, np.newaxis], summary_width)
+	summary_times.extend(xs[:, 0].tolist())
+	summary_totals.extend(ys[:, 0].tolist())
+
+	if len(summary_times) <= MAX_SUMMARY_POINTS:
+		summary_source.stream({"time": [datetime.fromtimestamp(t) for t in xs[:, 0]], "running_tasks": ys[:, 0].tolist()})
+		return
+
+	while len(summary_times) > MAX_SUMMARY_POINTS / 2:
+		summary_width *= 2
+		xs, ys = downsampling.min_max(summary_times, np.array(summary_totals)[:, np.newaxis], summary_width)
+		summary_times[:], summary_totals[:] = xs[:, 0].tolist(), ys[:, 0].tolist()
+
+	summary_source.data = {"time": [datetime.fromtimestamp(t) for t in summary_times], "running_tasks": list(summary_totals)}
+
+'''
+Converts invocation lifecycle events to the arrays of the sweep: the timestamps, the task types and the START/STOP deltas.
+'''
+def event_arrays(l):
+	times = np.array([doc["timestamp"] for doc in l], dtype=float)
+	types = np.array([doc["task_type"] for doc in l], dtype=object)
+	delta = np.array([concurrency.START if doc["event"] == "invoc_start" else concurrency.STOP if doc["event"] == "invoc_stop" else 0 for doc in l], dtype=int)
+	return times, types, delta
+
+'''
+If a task has not been seen before, assign a new color.
+'''
+def assign_colors(types, delta):
+
+	global task_types
+
+	for name in OrderedDict.fromkeys(types[delta == concurrency.START]):
+		if not name in task_types:
+			task_types[name] = {"color": Paired12[len(task_types.keys()) % 12]}
+
+'''
+Converts the boxes computed by the sweep to the columns of the data source.
+'''
+def box_columns(boxes):
+	return {
+		"left"         : [datetime.fromtimestamp(t) for t in boxes["left"]],
+		"right"        : [datetime.fromtimestamp(t) for t in boxes["right"]],
+		"bottom"       : boxes["bottom"].tolist(),
+		"top"          : boxes["top"].tolist(),
+		"colors"       : [task_types[name]["color"] for name in boxes["tasktype"]],
+		"alpha"        : [box_alpha(name) for name in boxes["tasktype"]],
+		"tasktype"     : boxes["tasktype"].tolist(),
+		"running_tasks": [str(count) for count in boxes["count"]],
+	}
+
+'''
+Merges late events (older than events that have been drawn already) into the events of the document.
+The sweep is continued from the last checkpoint before the oldest late event, all boxes created after the checkpoint are recomputed
+(segment by segment in live tail mode, the boxes do not reach across the segment boundaries).
+The recomputed boxes replace the boxes from the checkpoint on in one patch message (the boxes before the checkpoint are unchanged),
+additional boxes are streamed and boxes that are not needed anymore are collapsed to zero size at the end of the time axis.
+Late events that are older than the time window of the live tail mode are applied to the task stack at the start of the time window (see stack_events),
+and the time window is redrawn from there.
+'''
+def reconcile(late):
+
+	global sweep
+	global general_info
+
+	general_info["active_tasks"] += len(late)
+
+	# The late events before the time window only change the task stack of the first checkpoint
+	older = [doc for doc in late if checkpoints[0][0] is not None and doc["timestamp"] <= checkpoints[0][0]]
+	late  = late[len(older):]
+	if len(older) > 0:
+		assign_colors(*event_arrays(older)[1:])
+		stack_events(checkpoints[0][1], older)
+	elif len(late) == 0:
+		return
+
+	# Send all queued boxes first, the data source then contains all boxes created so far
+	send_boxes(len(pending_boxes["left"]))
+
+	insert_events(events, event_times, late)
+	general_info["first_event_time"] = min(general_info["first_event_time"], (older + late)[0]["timestamp"])
+	general_info["elapsed_time"] = general_info["last_event_time"] - general_info["first_event_time"]
+
+	# The last checkpoint before the oldest late event, the later ones are outdated
+	oldest = checkpoints[0][0] if len(older) > 0 else late[0]["timestamp"]
+	while len(checkpoints) > 1 and checkpoints[-1][0] is not None and checkpoints[-1][0] >= oldest:
+		checkpoints.pop()
+	last_time, checkpoint, processed = checkpoints[-1]
+	del event_totals[processed:]
+
+	# Redraw from the checkpoint, the segments end at the breaks after it
+	sweep = concurrency.copy_sweep(checkpoint)
+	ends = [bisect.bisect_right(event_times, end) for end in breaks if last_time is None or end > last_time] + [len(events)]
+	columns = new_boxes()
+	extended = {}
+	for start, end in zip([processed] + ends[:-1], ends):
+		if start == end:
+			continue
+		times, types, delta = event_arrays(events[start:end])
+		assign_colors(types, delta)
+		running, boxes, extensions = concurrency.sweep(sweep, times, types, delta)
+		event_totals.extend(running.tolist())
+		if sweep["last_time"] in breaks:
+			sweep["open"] = {}
+		add_checkpoint(end)
+		for column, values in box_columns(boxes).iteritems():
+			columns[column].extend(values)
+		extended.update(extensions)
+
+	first    = checkpoint["boxes"]
+	streamed = queued_from
+	added    = len(columns["left"])
+	replaced = min(added, streamed - first)
+
+	unindex_boxes(first, False)
+	index_boxes(first, columns["tasktype"])
+
+	# Replace the boxes after the checkpoint, add the additional ones and collapse the remaining ones
+	end = datetime.fromtimestamp(event_times[-1])
+	patches = dict((column, [(first + i - rolled_off, values[i]) for i in range(replaced)]) for column, values in columns.iteritems())
+	for index in range(first + added, streamed):
+		for column, value in (("left", end), ("right", end), ("bottom", 0), ("top", 0)):
+			patches[column].append((index - rolled_off, value))
+
+	# The boxes that were open at the checkpoint end at the checkpoint, unless the redrawn events extend them
+	for name, (index, bottom, top) in checkpoint["open"].iteritems():
+		if index >= rolled_off:
+			patches["right"].append((index - rolled_off, datetime.fromtimestamp(extended.get(index, last_time))))
+
+	source.patch(dict((column, values) for column, values in patches.iteritems() if len(values) > 0))
+	for column, values in columns.iteritems():
+		pending_boxes[column].extend(values[replaced:])
+
+	# The indices of the collapsed boxes are not reused
+	if sweep["boxes"] < streamed:
+		sweep["boxes"] = streamed
+		checkpoints[-1] = (sweep["last_time"], concurrency.copy_sweep(sweep), len(events))
+
+	stream_boxes(subscription)
 
 # =====================================================================================================================
 # User Interface Methods
@@ -244,56 +596,190 @@ def rem_prefix(session_str):
 	return session_str[2:] if session_str.startswith("s_") else session_str
 
 """
-Switch to another scientific workflow session. Also used to update the current view.
+Switch to another scientific workflow session, or redraw the current session (e.g., when switching the live tail mode on or off).
 """
-def select_session(session_id):
+def select_session(session_id, reload=False):
 
 	global source
 	global current_limit
 	global current_session
 	
 	global task_types
-	global current_order
-
-	global session_map
-	global dropdown
+	global sweep
+	global pending_boxes
+	global pending_patches
+	global events
+	global event_times
+	global event_totals
+	global checkpoints
+	global breaks
+	global rolled_off
+	global queued_from
+	global keep_from
+	global summary_width
+	global type_boxes
+	global focus
 
 	global general_info
 
-#	global select
-#	global placeholder
+	if session_id == current_session and not reload:
+		return
 
-	# Update session dropdown menu
-	session_map = query_sessions()
-	dropdown.menu = [(session_format(k, v['numLogEntries'], v['tstart']), add_prefix(k)) for k, v in session_map.iteritems() if v['tstart'] is not None]
+	task_types = {}
+	current_limit = None
+
+	# Reset the timer
+	general_info["first_event_time"] = 0
+	general_info["last_event_time"] = 0
+	# Remove all the rectangles from the previous session
+	source.data["left"]          = []
+	source.data["right"]         = []
+	source.data["bottom"]        = []
+	source.data["top"]           = []
+	source.data["colors"]        = []
+	source.data["alpha"]         = []
+	source.data["tasktype"]      = []
+	source.data["running_tasks"] = []
+	rolled_off, queued_from, keep_from = 0, 0, 0
+	# Forget the boxes that were not sent yet
+	pending_boxes   = new_boxes()
+	pending_patches = {}
+	# Stop highlighting, the task types of the new session are different
+	type_boxes = {}
+	focus = placeholder
+	select.value = placeholder
+	# Remove the summary of the history before the time window of the live tail mode
+	summary_source.data = {"time": [], "running_tasks": []}
+	summary_times[:], summary_totals[:] = [], []
+	summary_width = tail_window / float(SUMMARY_BUCKETS)
+	# Reset the task stack and the events that have been drawn
+	sweep = concurrency.new_sweep()
+	events, event_times, event_totals = [], [], []
+	checkpoints = [(None, concurrency.new_sweep(), 0)]
+	breaks = []
+
+	# Reset variables for new task
+	general_info["active_tasks"] = 0
+	general_info["elapsed_time"] = 0
+
+	subscribe_session(session_id)
+
+	update_info()
+
+"""
+Switches the live tail mode on or off and redraws the current session.
+"""
+def toggle_live_tail(active):
+
+	global live_tail
+
+	live_tail = active
+	follow_window()
+	select_session(current_session, reload=True)
+
+"""
+Changes the time window of the live tail mode, the current session is redrawn if the mode is on.
+"""
+def select_tail_window(attr, old, new):
+
+	global tail_window
+
+	tail_window = TAIL_WINDOWS[new]
+	follow_window()
+	if live_tail:
+		select_session(current_session, reload=True)
+
+"""
+In live tail mode, the x-axis follows the last event and shows the time window.
+"""
+def follow_window():
+	p.x_range.follow = "end" if live_tail else None
+	p.x_range.follow_interval = tail_window * 1000
 
-	if session_id != current_session:
-		task_types = {}
-		current_limit = None
-		current_session = session_id
+"""
+Subscribes the document to the poller of the events of a scientific workflow session (shared with all documents that display the session).
+Draws the events that the poller retrieved before, new events are delivered to update_session.
+"""
+def subscribe_session(session_id):
+
+	global current_session
+	global subscription
+
+	# Stop receiving the events of the previous session
+	polling.unsubscribe(bokeh_session_id, ("sessionboard", current_session))
+
+	current_session = session_id
 
-		# Reset the timer
-		general_info["last_event_time"] = 0
-		# Remove all the rectangles from the previous session
-		source.data["xss"]           = []
-		source.data["yss"]           = []
-		source.data["colors"]        = []
-		source.data["tasktype"]      = []
-		source.data["running_tasks"] = []
-		# Reset the current order
-		current_order.clear()
+	# Updates that were scheduled for a previous subscription are ignored
+	subscription += 1
 
-		# Reset variables for new task
-		general_info["active_tasks"] = 0
-		general_info["elapsed_time"] = 0
+	poller = polling.subscribe(("sessionboard", session_id), lambda: new_events_state(session_id), query_events,
+							   bokeh_session_id, document, partial(update_session, subscription), watch=session_id)
+	state  = poller.state
+
+	# The whole session is drawn from the database if the poller does not keep all events,
+	# in live tail mode the drawing continues from the task stack before the events that the poller keeps
+	if state["trimmed"] > 0 and not live_tail:
+		query_running_tasks_history_stacked(query_history(state))
+		return
+
+	start_from(state["base"], state["trimmed"], state["first_event_time"])
+	query_running_tasks_history_stacked(state["events"])
+
+"""
+Continues the drawing of a session from a task stack, the events before it are not drawn (see trim_events).
+"""
+def start_from(stack, count, first_event_time):
 
-	# query active tasks history data (poll for new data or switch session)
-	query_running_tasks_history_stacked(session_id)
+	global sweep
+	global checkpoints
 
-#	select.options = [placeholder] + task_types.keys()
+	sweep = concurrency.copy_sweep(stack)
+	checkpoints = [(sweep["last_time"], concurrency.copy_sweep(sweep), 0)]
+	assign_colors(np.array(sweep["order"], dtype=object), np.full(len(sweep["order"]), concurrency.START, dtype=int))
+	general_info["active_tasks"] = count
+	if count > 0:
+		general_info["first_event_time"] = first_event_time
+
+"""
+Draws the new events of the current session, called by the poller of the session.
+"""
+def update_session(session_subscription, new_events):
+
+	if session_subscription != subscription:
+		return
+
+	on_time, late = new_events
+
+	if len(late) > 0:
+		reconcile(late)
+
+	query_running_tasks_history_stacked(on_time)
+
+	update_info()
+
+"""
+Updates the session dropdown menu, called by the poller of the session list.
+"""
+def update_sessions(new_session_map):
+
+	global session_map
+	global dropdown
+
+	session_map = new_session_map
+	dropdown.menu = [(session_format(k, v['numLogEntries'], v['tstart']), add_prefix(k)) for k, v in session_map.iteritems() if v['tstart'] is not None]
+
+	update_info()
+
+"""
+Updates the plot title, the legend and the info boxes with the information about the current session.
+"""
+def update_info():
+
+	select.options = [placeholder] + task_types.keys()
 
 	# add session information to active tasks chart title
-	p.title.text = session_format_short(session_id, session_map[session_id]['tstart']) #"Session " + session_id
+	p.title.text = session_format_short(current_session, session_map[current_session]['tstart']) #"Session " + session_id
 
 	# update legend box
 	manualLegendBox.text = legendFormat(task_types)
@@ -337,33 +823,87 @@ def legendFormat(task_types):
 # the maximum number of log messages to retrieve from the database
 current_limit = None
 
-# the database connection
-db = MongoClient().scientificworkflowlogs
-datasource = db.test
+# the collection with the log entries (the connection pool is shared by all documents, see shared/database.py)
+datasource = database.get_log_collection()
+
+# the document and its bokeh session id, used to subscribe to the pollers that deliver new data to the document
+document = curdoc()
+bokeh_session_id = document.session_context.id
+subscription = 0
 
 # get a list of all scientific workflow sessions with id, number of log messages and start timestamp.
-session_map = query_sessions()
+# the list is polled once for all documents, changes are delivered to update_sessions
+# the poller is started when the server is loaded (see server_lifecycle.py), such that the list is available without querying
+key, create_state, fetch = queries.session_list_poller("sessionboard", datasource)
+session_map = polling.subscribe(key, create_state, fetch, bokeh_session_id, document, update_sessions, watch=polling.ALL_SESSIONS).state["session_map"]
 
 # select the latest session by default
 current_session = session_map.keys()[0]
 
-general_info = {"active_tasks": 0, "elapsed_time": 0, "last_event_time": 0}
+general_info = {"active_tasks": 0, "elapsed_time": 0, "first_event_time": 0, "last_event_time": 0}
 
 # a map from task type name to associated attributed, currently only rendering color (which is needed across several visualizations to be consistent)
 # e.g. task_type['diffit']['color'] = '#12ab3f'
 task_types = OrderedDict()
 
-# The current order of tasks together with the number of currently running tasks of this type
-current_order = OrderedDict()
+# The task stack (number of running tasks per task type in stack order) and the boxes that can be extended (see shared/concurrency.py)
+sweep = concurrency.new_sweep()
+
+# the events that have been drawn in chronological order, their timestamps and the total number of running tasks after them
+events = []
+event_times = []
+event_totals = []
+
+# the task stack after each batch of events: (time of the last event, copy of the sweep, number of events), the first one is the empty stack
+# late events are redrawn from the last checkpoint before them (see reconcile)
+checkpoints = [(None, concurrency.new_sweep(), 0)]
+MAX_CHECKPOINTS = 64
+
+# live tail mode: only the boxes of the last tail_window seconds are kept (in the document and the client), older ones are removed segment by segment
+# the boxes of a segment end at its last event (see close_segment), breaks holds the times of the segment boundaries
+live_tail = False
+TAIL_WINDOWS = OrderedDict([("15 minutes", 15 * 60), ("1 hour", 60 * 60), ("6 hours", 6 * 60 * 60), ("24 hours", 24 * 60 * 60)])
+tail_window = TAIL_WINDOWS["1 hour"]
+TAIL_SEGMENTS = 8
+breaks = []
+
+# the history before the time window is replaced by a coarse series of the total number of running tasks (see summarize)
+SUMMARY_BUCKETS = 50
+MAX_SUMMARY_POINTS = 2000
+summary_width = tail_window / float(SUMMARY_BUCKETS)
+summary_times = []
+summary_totals = []
+summary_source = ColumnDataSource({"time": [], "running_tasks": []})
 
 # active tasks history plot dimensions
 PLOT_WIDTH = 1400
 PLOT_HEIGHT = 600
 
+# the maximum number of boxes that are sent to the client in one stream message (per tick)
+STREAM_BUDGET = 5000
+
+# the highlighted task type (see highlight_task), the boxes of other task types are dimmed
+placeholder = "..."
+focus = placeholder
+ALPHA = 0.7
+DIMMED_ALPHA = 0.1
+
+# the indices of the boxes of each task type in ascending order (task type -> list of box indices), boxes that left the time window of the live tail mode are removed
+type_boxes = {}
+
+# the boxes that have not been sent to the client yet and the new right edges of boxes that have been sent (index -> right)
+pending_boxes = new_boxes()
+pending_patches = {}
+
+# the index of the box in the first row of the data source, of the first queued box and of the first box that is kept in live tail mode
+rolled_off = 0
+queued_from = 0
+keep_from = 0
+
 # the main data source for all visualizations.
-# xss, yss and colors belong the active tasks visualization
-source = ColumnDataSource({"xss": [], "yss": [], "colors": [], "tasktype": [], "running_tasks": []})
-query_running_tasks_history_stacked(current_session)
+# left, right, bottom, top and colors belong the active tasks visualization (one box per task type and interval between two events)
+source = ColumnDataSource(new_boxes())
+subscribe_session(current_session)
 
 # =====================================================================================================================
 # Controls
@@ -382,18 +922,16 @@ sessionID = Div(text=infoBoxFormat("Session", str(current_session)), width=200,
 # legend box that lists all task type names and their associated colors
 manualLegendBox = Div(text=legendFormat(task_types), width=PLOT_WIDTH, height=80)
 
-##########
+# switches the live tail mode on and off and selects its time window
+tail_toggle = Toggle(label="Live Tail", button_type="default", active=live_tail)
+tail_toggle.on_click(toggle_live_tail)
+tail_select = Select(title="Live tail window:", value="1 hour", options=TAIL_WINDOWS.keys())
+tail_select.on_change("value", select_tail_window)
 
-#placeholder = "..."
-#select_options = [placeholder] + task_types.keys()
-#select = Select(title="Highlight task:", value=select_options[0], options=select_options)
-#select.on_change("value", highlight_task)
-
-#hsource = ColumnDataSource({"xss": [], "yss": [], "colors": []})
-
-#focus = placeholder
-
-######
+# a select box to highlight the boxes of a task type
+select_options = [placeholder] + task_types.keys()
+select = Select(title="Highlight task:", value=select_options[0], options=select_options)
+select.on_change("value", highlight_task)
 
 # =====================================================================================================================
 # Plots
@@ -412,18 +950,17 @@ yaxis = LinearAxis(ticker=AdaptiveTicker(min_interval=1.0))
 p.add_layout(yaxis, 'right')
 p.yaxis.axis_label = "Number of Running Tasks"
 
-multiline = p.patches(xs="xss", ys="yss", color="colors", source=source, line_width=0, alpha=0.7)
+# flat numeric columns instead of one polygon (list of coordinates) per box, which keeps serialization and rendering cheap for many boxes
+multiline = p.quad(left="left", right="right", bottom="bottom", top="top", color="colors", source=source, line_width=0, fill_alpha="alpha")
 #multiline = p.patches(xs="xss", ys="yss", color="colors", source=source, line_width=2, alpha=0.7) # legend="legends" doesn't work, it's just one logical element
 # renderers['merge'] = p.line(x="time", y="merge", legend="merge", source=source)
 
-########
-
-#highlight = p.patches(xs="xss", ys="yss", color="colors", source=hsource, line_width=1, alpha=.9)
-
-########
+# the coarse summary of the history before the time window of the live tail mode
+summary = p.line(x="time", y="running_tasks", source=summary_source, color="#888888", line_width=1)
 
 hover = p.select_one(HoverTool)
 hover.point_policy = "follow_mouse"
+hover.renderers = [multiline]
 hover.tooltips = [
 	("task type", "@tasktype"),
 	("#tasks", "@running_tasks"),
@@ -435,18 +972,18 @@ hover.tooltips = [
 
 # prepare document
 layout = column(
-	row(WidgetBox(dropdown, width=405, height=100)),
+	row(WidgetBox(dropdown, width=405, height=100), WidgetBox(tail_toggle, width=150, height=100), WidgetBox(tail_select, width=200, height=100)),
 	row(sessionID, wallClockTime, numMessages), #cumulativeTime
 	p,
 	manualLegendBox,
-#	select,
+	select,
 	#progress,
 	#limit,
 )
+update_info()
 curdoc().add_root(layout)
 curdoc().title = "Session Dashboard"
 
-# add periodical polling of the database for new data (pushes to the client via websockets)
-#curdoc().add_periodic_callback(lambda: select_session(current_session), 150)
-curdoc().add_periodic_callback(lambda: select_session(current_session), 300)
+# new data is polled from the database by the pollers of the session list and the current session (see shared/polling.py)
+# and pushed to the client via websockets by update_sessions and update_session
 
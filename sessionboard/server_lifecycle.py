@@ -0,0 +1,35 @@
+"""
+Server lifecycle hooks of the session dashboard.
+When the server is loaded, the connection pool, the indexes (see shared/indexes.py) and the poller of the session list are created, such that opening a page does not query the database for them,
+and the change feed is started, which notifies the pollers about new log entries (see shared/changes.py).
+The poller of the session list also maintains the session catalog (see shared/catalog.py), the documents only read it.
+The documents of all browser sessions share one poller per workflow session and one for the session list (see shared/polling.py),
+a document stops receiving new events when its session is destroyed.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import changes, database, indexes, polling, queries
+
+def on_server_loaded(server_context):
+	''' If present, this function is called when the server first starts. '''
+	database.connect()
+	indexes.provision(database.get_log_collection())
+	polling.start(*queries.session_list_poller("sessionboard", database.get_log_collection(), maintain=True), watch=polling.ALL_SESSIONS)
+	# notify the pollers about new log entries instead of polling periodically
+	changes.start(database.get_log_collection())
+
+def on_server_unloaded(server_context):
+	''' If present, this function is called when the server shuts down. '''
+	changes.stop_all()
+	polling.stop_all()
+	database.close()
+
+def on_session_destroyed(session_context):
+	''' If present, this function is called when a session is closed. '''
+	polling.unsubscribe(session_context.id)
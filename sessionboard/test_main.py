@@ -0,0 +1,238 @@
+"""
+Tests of the drawing of the session dashboard: late events (see reconcile), the live tail mode (see roll_window) and the highlighting of task types.
+The functions of main.py are loaded without creating the Bokeh document, the data source and the document are replaced by the fakes below.
+The boxes of events that arrive in several polls and out of order must cover the time axis like the boxes of the same events drawn at once.
+Run with python -m unittest discover sessionboard from the repository root.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import ast
+import bisect
+import os
+import sys
+import unittest
+from collections import Counter, OrderedDict
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import concurrency, downsampling
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+# the settings of main.py that are used as they are
+SETTINGS = ("Paired12", "MAX_CHECKPOINTS", "TAIL_WINDOWS", "TAIL_SEGMENTS", "SUMMARY_BUCKETS", "MAX_SUMMARY_POINTS", "placeholder", "ALPHA", "DIMMED_ALPHA")
+
+class Source(object):
+	'''
+	Replaces the ColumnDataSource, stream and patch change the columns like they change them on the client.
+	'''
+	def __init__(self, data):
+		self.data = data
+
+	def stream(self, new_data, rollover=None):
+		for column, values in new_data.items():
+			self.data[column] = self.data[column] + list(values)
+			if rollover is not None:
+				self.data[column] = self.data[column][-rollover:]
+
+	def patch(self, patches):
+		for column, values in patches.items():
+			for row, value in values:
+				if not 0 <= row < len(self.data[column]):
+					raise IndexError("patch of row %d of %d" % (row, len(self.data[column])))
+				self.data[column][row] = value
+
+class Document(object):
+	'''
+	Replaces the Bokeh document, the next tick callbacks are run by run_callbacks.
+	'''
+	def __init__(self):
+		self.callbacks = []
+
+	def add_next_tick_callback(self, callback):
+		self.callbacks.append(callback)
+
+	def run_callbacks(self):
+		while len(self.callbacks) > 0:
+			self.callbacks.pop(0)()
+
+def load_dashboard(live_tail=False, tail_window=60.0, stream_budget=3):
+	'''
+	Executes the functions and settings of main.py in a new namespace, with the state of a document that has not drawn any events yet (see select_session).
+	'''
+	with open(MAIN) as main:
+		tree = ast.parse(main.read(), MAIN)
+
+	tree.body = [node for node in tree.body if isinstance(node, ast.FunctionDef) or
+				 isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id in SETTINGS for target in node.targets)]
+
+	dashboard = {"bisect": bisect, "np": np, "OrderedDict": OrderedDict, "datetime": datetime, "partial": partial,
+				 "concurrency": concurrency, "downsampling": downsampling}
+	exec(compile(tree, MAIN, "exec"), dashboard)
+
+	dashboard.update({
+		"source": Source(dashboard["new_boxes"]()), "document": Document(), "subscription": 1, "STREAM_BUDGET": stream_budget,
+		"live_tail": live_tail, "tail_window": tail_window, "breaks": [],
+		"general_info": {"active_tasks": 0, "elapsed_time": 0, "first_event_time": 0, "last_event_time": 0}, "task_types": OrderedDict(),
+		"sweep": concurrency.new_sweep(), "events": [], "event_times": [], "event_totals": [], "checkpoints": [(None, concurrency.new_sweep(), 0)],
+		"summary_source": Source({"time": [], "running_tasks": []}), "summary_width": tail_window / dashboard["SUMMARY_BUCKETS"],
+		"summary_times": [], "summary_totals": [], "focus": dashboard["placeholder"], "type_boxes": {},
+		"pending_boxes": dashboard["new_boxes"](), "pending_patches": {}, "rolled_off": 0, "queued_from": 0, "keep_from": 0,
+		"update_info": lambda: None,
+	})
+
+	return dashboard
+
+def event(timestamp, task_type, name):
+	return {"timestamp": float(timestamp), "task_type": task_type, "event": name}
+
+def start(timestamp, task_type):
+	return event(timestamp, task_type, "invoc_start")
+
+def stop(timestamp, task_type):
+	return event(timestamp, task_type, "invoc_stop")
+
+def deliver(dashboard, polls):
+	'''
+	Delivers the events of each poll like the poller of the session (see query_events): in chronological order and split into the events that are on time and the late ones.
+	'''
+	last_event_time = None
+
+	for poll in polls:
+		poll    = sorted(poll, key=lambda doc: doc["timestamp"])
+		late    = [doc for doc in poll if last_event_time is not None and doc["timestamp"] < last_event_time]
+		on_time = [doc for doc in poll if last_event_time is None or doc["timestamp"] >= last_event_time]
+		if len(on_time) > 0:
+			last_event_time = on_time[-1]["timestamp"]
+		dashboard["update_session"](dashboard["subscription"], (on_time, late))
+		dashboard["document"].run_callbacks()
+
+def draw_at_once(l):
+	'''
+	The dashboard after drawing all events in one call, in chronological order.
+	'''
+	dashboard = load_dashboard()
+	dashboard["query_running_tasks_history_stacked"](sorted(l, key=lambda doc: doc["timestamp"]))
+	dashboard["document"].run_callbacks()
+	return dashboard
+
+def picture(dashboard, l, since=None):
+	'''
+	The boxes that cover the middle of each interval between two distinct event times, as (interval start, task type, bottom, top) -> number of boxes.
+	:param since: only the intervals that start at this time or later
+	'''
+	data  = dashboard["source"].data
+	times = sorted(set(doc["timestamp"] for doc in l))
+	boxes = Counter()
+
+	for left, right in zip(times[:-1], times[1:]):
+		if since is not None and left < since:
+			continue
+		middle = datetime.fromtimestamp((left + right) / 2.0)
+		for row in range(len(data["left"])):
+			if data["left"][row] <= middle < data["right"][row] and data["top"][row] > data["bottom"][row]:
+				boxes[(left, data["tasktype"][row], data["bottom"][row], data["top"][row])] += 1
+
+	return boxes
+
+class ReconcileTest(unittest.TestCase):
+
+	def assertSamePicture(self, dashboard, l, since=None):
+		expected = picture(draw_at_once(l), l, since)
+		self.assertEqual(picture(dashboard, l, since), expected)
+		self.assertTrue(all(count == 1 for count in expected.values()))
+
+	def test_polls_in_order(self):
+		polls = [[start(0, "a"), start(1, "b")], [start(2, "a"), stop(3, "b")], [stop(4, "a"), stop(5, "a")]]
+		dashboard = load_dashboard()
+		deliver(dashboard, polls)
+		self.assertSamePicture(dashboard, sum(polls, []))
+
+	def test_late_start(self):
+		polls = [[start(0, "a"), start(2, "b"), stop(4, "a"), stop(6, "b")], [start(1, "c"), stop(3, "c")]]
+		dashboard = load_dashboard()
+		deliver(dashboard, polls)
+		self.assertSamePicture(dashboard, sum(polls, []))
+
+	def test_late_stop_collapses_boxes(self):
+		# the late stop ends the boxes of a early, the boxes of a that are not needed anymore have zero height
+		polls = [[start(0, "a"), start(1, "b"), start(3, "c"), stop(5, "b"), stop(7, "c")], [stop(2, "a")]]
+		dashboard = load_dashboard()
+		deliver(dashboard, polls)
+		self.assertSamePicture(dashboard, sum(polls, []))
+		self.assertEqual(dashboard["general_info"]["active_tasks"], 6)
+
+	def test_late_events_in_several_polls(self):
+		polls = [[start(t, "abc"[t % 3]) for t in range(0, 20, 2)],
+				 [stop(t, "abc"[t % 3]) for t in range(21, 40, 2)],
+				 [stop(t, "abc"[t % 3]) for t in range(1, 20, 4)],
+				 [start(t, "d") for t in range(3, 40, 8)] + [stop(41, "d")]]
+		dashboard = load_dashboard()
+		deliver(dashboard, polls)
+		self.assertSamePicture(dashboard, sum(polls, []))
+
+class LiveTailTest(unittest.TestCase):
+
+	def test_roll_window(self):
+		l = [start(t, "ab"[t % 2]) if t % 4 < 2 else stop(t, "ab"[t % 2]) for t in range(200)]
+		dashboard = load_dashboard(live_tail=True, tail_window=40.0)
+		deliver(dashboard, [l[i:i + 7] for i in range(0, len(l), 7)])
+
+		# only the boxes and events of the time window (and one segment) are kept, the older ones are summarized
+		since = dashboard["checkpoints"][0][0]
+		self.assertGreaterEqual(since, 199 - 40 - 40 / dashboard["TAIL_SEGMENTS"])
+		self.assertTrue(all(left >= datetime.fromtimestamp(since) for left in dashboard["source"].data["left"]))
+		self.assertTrue(all(t > since for t in dashboard["event_times"]))
+		self.assertGreater(len(dashboard["summary_times"]), 0)
+		self.assertEqual(picture(dashboard, l, since), picture(draw_at_once(l), l, since))
+
+	def test_late_stop_before_the_window(self):
+		# a is running all the time, until its stop event arrives late, after the time window has moved past it
+		l = [start(0, "a")] + [start(t, "b") if t % 2 == 0 else stop(t, "b") for t in range(2, 120)]
+		late_stop = stop(1, "a")
+		dashboard = load_dashboard(live_tail=True, tail_window=40.0)
+		deliver(dashboard, [l[i:i + 5] for i in range(0, len(l), 5)] + [[late_stop]])
+
+		since = dashboard["checkpoints"][0][0]
+		self.assertGreater(since, late_stop["timestamp"])
+		self.assertEqual(picture(dashboard, l, since), picture(draw_at_once(l + [late_stop]), l, since))
+		self.assertNotIn("a", dashboard["sweep"]["counts"])
+		self.assertEqual(dashboard["general_info"]["active_tasks"], len(l) + 1)
+
+class HighlightTest(unittest.TestCase):
+
+	def assertAlpha(self, dashboard):
+		data = dashboard["source"].data
+		self.assertEqual(data["alpha"], [dashboard["box_alpha"](name) for name in data["tasktype"]])
+
+	def test_highlight_after_roll_window(self):
+		# nothing is running when the window moves, the rows of the old boxes stay in the data source until the next stream message
+		polls = [[start(0, "a"), start(1, "b"), stop(2, "a"), stop(3, "b"), start(30, "a"), start(31, "b"), stop(32, "a"), stop(33, "b"), start(60, "c"), stop(90, "c")],
+				 [stop(150, "c")], [start(200, "a")], [stop(210, "a")]]
+		dashboard = load_dashboard(live_tail=True, tail_window=40.0)
+		deliver(dashboard, polls[:2])
+		self.assertGreater(dashboard["keep_from"], dashboard["rolled_off"])
+
+		for name in ["a", "b", "c", dashboard["placeholder"], "b"]:
+			dashboard["highlight_task"]("value", None, name)
+			self.assertAlpha(dashboard)
+
+		deliver(dashboard, polls[2:])
+		self.assertEqual(dashboard["source"].data["tasktype"], ["a"])
+		self.assertAlpha(dashboard)
+
+	def test_highlight_with_pending_boxes(self):
+		l = [start(t, "abc"[t % 3]) for t in range(12)]
+		dashboard = load_dashboard(stream_budget=2)
+		dashboard["query_running_tasks_history_stacked"](l)
+		dashboard["highlight_task"]("value", None, "b")
+		dashboard["document"].run_callbacks()
+		self.assertAlpha(dashboard)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,7 @@
+"""
+Modules shared by the dashboards (bokeh applications) of the analysis server.
+The dashboards add the top level directory of the repository to the python path to import them.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
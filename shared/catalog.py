@@ -0,0 +1,174 @@
+"""
+The session catalog: a summary of every workflow session in the sessions collection, maintained incrementally when log entries arrive.
+
+Listing the sessions used to run a $group over the entire log collection, which is a full collection scan that grows with all history
+and ran every 300 ms to refresh the session dropdown menus. The catalog contains one document per session of a log collection
+	{'_id': {'collection': 'test', 'session': '9985004919'}, 'collection': 'test', 'session_id': '9985004919',
+	 'tstart': 1472620731519, 'numLogEntries': 18, 'last_event_time': 1472620799.1, 'hosts': ['runs'],
+	 'hostLogEntries': [{'host': 'runs', 'numLogEntries': 18}], 'last_id': ObjectId(...)}
+and one watermark document per log collection {'_id': {'watermark': 'test'}, 'last_id': ObjectId(...)}.
+
+update reads the log entries that were inserted after the watermark (in _id order, so the cost is proportional to the number of new entries)
+and upserts the summaries of their sessions. It is called by the session list pollers that the dashboard servers start when they are loaded (see queries.poll_sessions),
+which poll on every insert if a change feed is running (see shared/changes.py). The first update of a collection processes its whole history.
+Reading the session list (query_sessions) does not write to the catalog.
+An ingest process can also call record directly after inserting log entries.
+
+Several processes (e.g., the servers of the session and the run dashboard) maintain the catalog concurrently.
+A summary is only updated with the log entries whose _id is larger than the last _id recorded for the session,
+and it is replaced only if the recorded last _id did not change since it was read (otherwise, the summary is read again and the update is retried).
+Each log entry is thus counted exactly once, even if the batches of two processes overlap.
+This assumes that the log entries of a session are inserted in _id order, as done by the single ingest server.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+from collections import OrderedDict
+
+from bson.son import SON
+from pymongo.errors import DuplicateKeyError
+
+# the name of the catalog collection
+CATALOG = "sessions"
+
+# the number of log entries that are summarized in one batch
+BATCH_SIZE = 10000
+
+# the fields of the log entries that are needed for the summaries
+PROJECTION = {"session.id": 1, "session.tstart": 1, "timestamp": 1, "data.host_name": 1}
+
+def get_catalog(collection):
+	return collection.database[CATALOG]
+
+def summary_key(collection, session_id):
+	'''
+	The _id of the summary of a session. The fields are ordered, since embedded documents only match if their field order is the same.
+	'''
+	return SON([("collection", collection.name), ("session", session_id)])
+
+def record(collection, log_entries):
+	'''
+	Updates the summaries of the sessions of the given log entries. Entries that have been recorded before (by any process) are skipped.
+	:param collection: the log collection that contains the entries
+	:param log_entries: the new log entries (at least with the fields in PROJECTION), in _id order
+	'''
+	pending = OrderedDict()
+
+	for log_entry in log_entries:
+		pending.setdefault(log_entry.get("session", {}).get("id"), []).append(log_entry)
+
+	catalog = get_catalog(collection)
+
+	while len(pending) > 0:
+
+		stored = dict((summary["session_id"], summary) for summary in catalog.find({"_id": {"$in": [summary_key(collection, session_id) for session_id in pending]}}))
+		retry  = OrderedDict()
+
+		for session_id, entries in pending.items():
+
+			summary = stored.get(session_id)
+			new     = [log_entry for log_entry in entries if summary is None or log_entry["_id"] > summary["last_id"]]
+
+			if len(new) == 0:
+				continue
+
+			# another process updated the summary since it was read, read it again and retry with the entries that are still new
+			try:
+				if summary is None:
+					catalog.insert_one(summarize(collection, session_id, None, new))
+				elif catalog.replace_one({"_id": summary_key(collection, session_id), "last_id": summary["last_id"]}, summarize(collection, session_id, summary, new)).matched_count == 0:
+					retry[session_id] = new
+			except DuplicateKeyError:
+				retry[session_id] = new
+
+		pending = retry
+
+def summarize(collection, session_id, summary, log_entries):
+	'''
+	Adds log entries to the summary of a session.
+	:param summary: the recorded summary of the session, None if the session has not been recorded yet
+	:param log_entries: the log entries of the session that are not contained in the summary, in _id order
+	:return: the new summary
+	'''
+	if summary is None:
+		summary = {"collection": collection.name, "session_id": session_id, "tstart": log_entries[0].get("session", {}).get("tstart"),
+				   "numLogEntries": 0, "last_event_time": None, "hosts": [], "hostLogEntries": []}
+	else:
+		summary = dict(summary)
+
+	summary["_id"] = summary_key(collection, session_id)
+
+	host_counts = OrderedDict((host["host"], host["numLogEntries"]) for host in summary.get("hostLogEntries", []))
+
+	for log_entry in log_entries:
+
+		summary["numLogEntries"] += 1
+
+		if log_entry.get("timestamp") is not None and (summary.get("last_event_time") is None or log_entry["timestamp"] > summary["last_event_time"]):
+			summary["last_event_time"] = log_entry["timestamp"]
+
+		host = log_entry.get("data", {}).get("host_name")
+		if host is not None:
+			host_counts[host] = host_counts.get(host, 0) + 1
+
+	summary["last_id"]        = log_entries[-1]["_id"]
+	summary["hosts"]          = list(OrderedDict.fromkeys(summary["hosts"] + list(host_counts)))
+	summary["hostLogEntries"] = [{"host": host, "numLogEntries": count} for host, count in host_counts.items()]
+
+	return summary
+
+def update(collection):
+	'''
+	Records the log entries that have been inserted since the last update.
+	:param collection: the log collection
+	'''
+	catalog   = get_catalog(collection)
+	watermark = catalog.find_one({"_id": {"watermark": collection.name}})
+	query     = {} if watermark is None else {"_id": {"$gt": watermark["last_id"]}}
+
+	batch = []
+
+	for log_entry in collection.find(query, PROJECTION).sort("_id", 1):
+
+		batch.append(log_entry)
+
+		if len(batch) == BATCH_SIZE:
+			commit(collection, batch)
+			batch = []
+
+	commit(collection, batch)
+
+def commit(collection, batch):
+	'''
+	Records a batch of log entries and advances the watermark of the log collection past them.
+	'''
+	if len(batch) == 0:
+		return
+
+	record(collection, batch)
+	get_catalog(collection).update_one({"_id": {"watermark": collection.name}}, {"$max": {"last_id": batch[-1]["_id"]}}, upsert=True)
+
+def query_sessions(collection, host=None):
+	'''
+	Reads the summaries of the sessions of a log collection from the catalog.
+	:param collection: the log collection
+	:param host: only list sessions with log entries from this host (see host_log_entries)
+	:return: the summaries, newest session first
+	'''
+	query = {"collection": collection.name}
+
+	if host is not None:
+		query["hosts"] = host
+
+	return get_catalog(collection).find(query).sort("tstart", -1)
+
+def host_log_entries(summary, host):
+	'''
+	The number of log entries of a session from a host.
+	Summaries recorded before the entries were counted per host only have the total number.
+	'''
+	if "hostLogEntries" not in summary:
+		return summary["numLogEntries"]
+
+	return sum(entry["numLogEntries"] for entry in summary["hostLogEntries"] if entry["host"] == host)
@@ -0,0 +1,145 @@
+"""
+Announces new log entries to the pollers (see shared/polling.py), such that the dashboards are updated when something happens
+instead of querying the database every 300 ms.
+
+The inserts into the log collection are read in a background thread, either from a MongoDB change stream
+(requires MongoDB 3.6 or newer running as replica set) or from a tailable cursor, if the log collection is a capped collection.
+The ids of the sessions of the new log entries are collected and handed to the server's IOLoop with add_callback,
+where polling.notify lets the pollers of these sessions fetch the new events and push them to their documents with add_next_tick_callback.
+A burst of inserts results in one poll per poller, because the session ids are collected until the IOLoop runs the callback.
+
+If neither is available, or the feed fails, the pollers fall back to periodic polling.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import logging
+import threading
+import time
+
+from pymongo import CursorType
+from pymongo.errors import PyMongoError
+from tornado.ioloop import IOLoop
+
+from shared import polling
+
+logger = logging.getLogger(__name__)
+
+# the time to wait before querying a capped collection again, if the tailable cursor died (e.g., because the collection was empty)
+TAIL_RETRY = 1.0
+
+class ChangeFeed(object):
+	'''
+	Reads the inserts into a log collection and notifies the pollers about them.
+	:param collection: the log collection
+	:param io_loop: the IOLoop of the server, on which the pollers run
+	'''
+
+	def __init__(self, collection, io_loop):
+		self.collection = collection
+		self.io_loop    = io_loop
+		# the session ids of the log entries that have not been announced yet
+		self.pending    = set()
+		self.lock       = threading.Lock()
+		self.stopped    = False
+		# the change stream or tailable cursor that is currently read
+		self.cursor     = None
+
+	def start(self):
+		thread = threading.Thread(target=self.run, name="change feed %s" % self.collection.name)
+		thread.daemon = True
+		thread.start()
+
+	def stop(self):
+		self.stopped = True
+		if self.cursor is not None:
+			self.cursor.close()
+
+	def run(self):
+		'''
+		Reads the new log entries until the feed is stopped, runs in the background thread.
+		'''
+		try:
+			for log_entry in self.log_entries():
+				self.announce(log_entry)
+		except PyMongoError as e:
+			if not self.stopped:
+				logger.warning("change feed on %s failed, falling back to polling: %s", self.collection.name, e)
+
+		self.io_loop.add_callback(polling.set_event_driven, False)
+
+	def log_entries(self):
+		'''
+		Generates the inserted log entries, from a change stream if possible and from a tailable cursor otherwise.
+		'''
+		try:
+			self.cursor = self.collection.watch([{"$match": {"operationType": "insert"}}])
+			entries     = (change["fullDocument"] for change in self.cursor)
+		except (PyMongoError, AttributeError) as e:
+			# change streams need a replica set (and pymongo 3.6)
+			if not self.collection.options().get("capped", False):
+				logger.warning("no change stream on %s and the collection is not capped, using polling: %s", self.collection.name, e)
+				return
+			entries = self.tail()
+
+		self.io_loop.add_callback(polling.set_event_driven, True)
+
+		for log_entry in entries:
+			if self.stopped:
+				return
+			yield log_entry
+
+	def tail(self):
+		'''
+		Generates the log entries that are inserted into a capped collection, starting with the next insert.
+		'''
+		last = self.collection.find_one(sort=[("$natural", -1)])
+		query = {} if last is None else {"_id": {"$gt": last["_id"]}}
+
+		while not self.stopped:
+			self.cursor = self.collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+			for log_entry in self.cursor:
+				query = {"_id": {"$gt": log_entry["_id"]}}
+				yield log_entry
+			time.sleep(TAIL_RETRY)
+
+	def announce(self, log_entry):
+		'''
+		Remembers the session of a new log entry and schedules the notification of the pollers, if it is not scheduled yet.
+		'''
+		with self.lock:
+			scheduled = len(self.pending) > 0
+			self.pending.add(log_entry.get("session", {}).get("id"))
+
+		if not scheduled:
+			self.io_loop.add_callback(self.flush)
+
+	def flush(self):
+		'''
+		Notifies the pollers about the sessions with new log entries, runs on the IOLoop.
+		'''
+		with self.lock:
+			session_ids  = self.pending
+			self.pending = set()
+
+		polling.notify(session_ids)
+
+# collection name => ChangeFeed
+feeds = {}
+
+def start(collection):
+	'''
+	Starts the change feed of a log collection, if it is not running yet. Called in on_server_loaded (on the server's IOLoop).
+	:return: the feed
+	'''
+	if collection.name not in feeds:
+		feeds[collection.name] = ChangeFeed(collection, IOLoop.current())
+		feeds[collection.name].start()
+
+	return feeds[collection.name]
+
+def stop_all():
+	for feed in feeds.values():
+		feed.stop()
+	feeds.clear()
@@ -0,0 +1,243 @@
+"""
+The number of running tasks over time, computed from the start and stop events of the task invocations.
+
+The dashboards display the number of running tasks as a stack of boxes: one box per task type and time interval between two events,
+the task types are stacked in the order in which they started running (a task type that stops running leaves the stack, the ones above move down).
+This used to be computed by a loop over the events in every dashboard. A sweep over the events is now done with array operations:
+the events are sorted once by time, the count of every task type after every event is a cumulative sum over +1 (start) and -1 (stop) deltas,
+and the stack positions are cumulative sums over the counts sorted by the time the task types entered the stack.
+
+The sweep is incremental: its state (see new_sweep) keeps the counts, the stack order and the boxes that can still be extended,
+such that the events of every poll continue where the previous poll stopped.
+Stop events of task types that are not running (e.g., because the start event was not recorded) are ignored.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import numpy as np
+
+# Deltas of the number of running tasks
+START = 1
+STOP  = -1
+
+def matched_deltas(starts, stops, ids, running):
+	'''
+	Computes how each event changes the number of running tasks: +1 for start events, -1 for stop events and 0 for other events.
+	A stop event only counts if it matches a start event of its invocation that has not been matched by another stop event
+	(earlier in the same events or in a previous poll), otherwise it gets 0, e.g., a duplicate or retried stop event is ignored.
+	:param starts: boolean array, True for start events
+	:param stops: boolean array, True for stop events
+	:param ids: the invocation id of each event
+	:param running: the set of the ids of the running invocations, it is updated
+	'''
+	# Number the distinct invocation ids
+	keys, inverse = np.unique(ids, return_inverse=True)
+	was_running   = np.in1d(keys, list(running))
+
+	# The events of each invocation in their order, the invocations one after another
+	by_id   = np.lexsort((np.arange(len(ids)), inverse))
+	group   = inverse[by_id]
+	steps   = np.where(starts[by_id], START, np.where(stops[by_id], STOP, 0))
+	first   = np.ones(len(ids), dtype=bool)
+	first[1:] = group[1:] != group[:-1]
+
+	# The number of unmatched start events of the invocation after each event, without ignoring stop events
+	walk = np.cumsum(steps)
+	walk = walk - np.repeat(walk[first] - steps[first], np.diff(np.append(np.flatnonzero(first), len(ids)))) + was_running[group]
+
+	# Every time the number would get negative, a stop event is ignored, i.e., the number is raised by the lowest value reached so far (per invocation).
+	# The walks of later invocations are shifted down, such that the running minimum does not carry over from one invocation to the next.
+	shift   = (2 * len(ids) + 2) * group
+	lowest  = np.minimum.accumulate(walk - shift) + shift if len(ids) > 0 else walk
+	balance = walk - np.minimum(lowest, 0)
+
+	# A stop event counts if it lowers the number of unmatched start events
+	before  = np.where(first, was_running[group], np.concatenate(([0], balance[:-1])))
+	delta   = np.zeros(len(ids), dtype=int)
+	delta[by_id] = np.where(steps == STOP, np.where(balance < before, STOP, 0), steps)
+
+	# Invocations are running after the events if they have unmatched start events (including the ones that were already running)
+	last = np.append(np.flatnonzero(first)[1:] - 1, len(ids) - 1) if len(ids) > 0 else np.zeros(0, dtype=int)
+	running.difference_update(keys[was_running].tolist())
+	running.update(keys[group[last][balance[last] > 0]].tolist())
+
+	return delta
+
+def type_counts(types, delta, initial):
+	'''
+	The number of running tasks of each task type after each event.
+	A stop event of a task type that is not running does not change the count (the counts never get negative).
+	:param types: the task type of each event
+	:param delta: START, STOP or 0 for each event
+	:param initial: dictionary task type -> number of running tasks before the events
+	:return: the task types (sorted) and the counts, one row per event and one column per task type
+	'''
+	names   = np.unique(np.concatenate((np.asarray(types, dtype=object), np.asarray(list(initial), dtype=object)))) if len(types) + len(initial) > 0 else np.zeros(0, dtype=object)
+	inverse = np.searchsorted(names, np.asarray(types, dtype=object)) if len(types) > 0 else np.zeros(0, dtype=int)
+
+	steps = np.zeros((len(types), len(names)), dtype=int)
+	steps[np.arange(len(types)), inverse] = delta
+
+	# The counts without ignoring stop events, starting with the initial counts
+	walk = np.cumsum(steps, axis=0) + np.array([initial.get(name, 0) for name in names], dtype=int)
+
+	# Every time the count would get negative, a stop event is ignored, i.e., the count is raised by the lowest value reached so far
+	return names, walk - np.minimum(np.minimum.accumulate(walk, axis=0), 0)
+
+def stack_bottoms(names, counts, order):
+	'''
+	The stack position (y coordinate of the bottom of the box) of each task type after each event.
+	Task types that are running are stacked in the order in which they started running, the first one at the bottom.
+	:param names: the task types (see type_counts)
+	:param counts: the number of running tasks per event and task type (see type_counts)
+	:param order: the running task types before the events, bottom first
+	:return: the bottoms (one row per event and one column per task type) and the order of the running task types after the events
+	'''
+	rows, columns = counts.shape
+	active = counts > 0
+
+	# The task types that are on the stack before the events enter it before the first event, in stack order
+	rank           = dict((name, position - len(order)) for position, name in enumerate(order))
+	initial_entry  = np.array([rank.get(name, -np.inf) for name in names], dtype=float)
+	initial_active = np.array([name in rank for name in names], dtype=bool)
+
+	# The event at which each task type entered the stack most recently
+	entered = active & ~np.vstack((initial_active[np.newaxis, :], active[:-1]))
+	entry   = np.maximum.accumulate(np.where(entered, np.arange(rows)[:, np.newaxis], -np.inf), axis=0)
+	entry   = np.maximum(entry, initial_entry)
+
+	# Sort the running task types of each event by entry, the bottom of a box is the sum of the counts below it
+	row     = np.arange(rows)[:, np.newaxis]
+	stacked = np.argsort(np.where(active, entry, np.inf), axis=1, kind="mergesort")
+	sizes   = np.where(active, counts, 0)[row, stacked]
+
+	bottoms = np.empty(counts.shape, dtype=int)
+	bottoms[row, stacked] = np.cumsum(sizes, axis=1) - sizes
+
+	if rows == 0:
+		return bottoms, list(order)
+
+	last = [column for column in stacked[-1] if active[-1, column]]
+	return bottoms, [names[column] for column in last]
+
+def new_sweep():
+	'''
+	Creates the state of a sweep, which is kept between two polls.
+	'''
+	return {
+		# The time of the last event, None if no event has been processed yet
+		"last_time": None,
+		# The number of running tasks of each task type
+		"counts"   : {},
+		# The running task types, bottom first
+		"order"    : [],
+		# The boxes of the last interval, which are extended if the next interval has a box with the same position and size: task type -> (index, bottom, top)
+		"open"     : {},
+		# The number of boxes created so far (the index of the next box)
+		"boxes"    : 0,
+	}
+
+def copy_sweep(state):
+	'''
+	Copies the state of a sweep, e.g., to continue the sweep from an earlier point when events arrive late.
+	'''
+	return {
+		"last_time": state["last_time"],
+		"counts"   : dict(state["counts"]),
+		"order"    : list(state["order"]),
+		"open"     : dict(state["open"]),
+		"boxes"    : state["boxes"],
+	}
+
+def sweep(state, times, types, delta):
+	'''
+	Advances the sweep over new events and computes the boxes for the time intervals between the events.
+	A task type whose position and count on the stack did not change since the previous interval extends its previous box instead of adding a new one.
+	Intervals of zero length (several events at the same time) do not get boxes.
+	:param state: the state of the sweep (see new_sweep), it is updated
+	:param times: the time of each event, after the last event of the previous call
+	:param types: the task type of each event
+	:param delta: START, STOP or 0 for each event (see matched_deltas)
+	:return:
+		the total number of running tasks after each event (in the order of the events, which are sorted stably by time),
+		the new boxes as dictionary of arrays (left, right, bottom, top, count and task type),
+		the new right edges of boxes that were created by previous calls (index -> right)
+	'''
+	times = np.asarray(times, dtype=float)
+	by_time = np.argsort(times, kind="mergesort")
+	times, types, delta = times[by_time], np.asarray(types, dtype=object)[by_time], np.asarray(delta, dtype=int)[by_time]
+
+	names, counts = type_counts(types, delta, state["counts"])
+	bottoms, order = stack_bottoms(names, counts, state["order"])
+
+	# The counts and bottoms before the first event (the stack of the previous call)
+	column = dict((name, i) for i, name in enumerate(names))
+	before = np.array([state["counts"].get(name, 0) for name in names], dtype=int)
+	first  = np.zeros(len(names), dtype=int)
+	y = 0
+	for name in state["order"]:
+		first[column[name]] = y
+		y += state["counts"][name]
+
+	# The interval before an event is displayed with the stack after the previous event
+	left   = np.concatenate(([state["last_time"] if state["last_time"] is not None else np.nan], times[:-1]))
+	right  = times
+	count  = np.vstack((before[np.newaxis, :], counts[:-1]))
+	bottom = np.vstack((first[np.newaxis, :], bottoms[:-1]))
+
+	# Skip the intervals of length zero and the interval before the first event of the sweep
+	keep = ~np.isnan(left) & (left < right)
+	left, right, count, bottom = left[keep], right[keep], count[keep], bottom[keep]
+
+	active = count > 0
+
+	# A box continues the box of the previous interval if the task type has the same position and count
+	previous_active = np.vstack((np.array([name in state["open"] for name in names], dtype=bool)[np.newaxis, :], active[:-1]))
+	previous_bottom = np.vstack((np.array([state["open"][name][1] if name in state["open"] else -1 for name in names])[np.newaxis, :], bottom[:-1]))
+	previous_top    = np.vstack((np.array([state["open"][name][2] if name in state["open"] else -1 for name in names])[np.newaxis, :], (bottom + count)[:-1]))
+
+	continues = active & previous_active & (previous_bottom == bottom) & (previous_top == bottom + count)
+	new       = active & ~continues
+
+	# Number the new boxes (row by row)
+	new_rows, new_columns = np.nonzero(new)
+	index = np.full(count.shape, -1, dtype=int)
+	index[new_rows, new_columns] = state["boxes"] + np.arange(len(new_rows))
+
+	# Every cell of a box gets the index of the box (the index of the cell where the box started), -1 for boxes of the previous call
+	started = np.maximum.accumulate(np.where(new, np.arange(len(count))[:, np.newaxis], -1), axis=0) if len(count) > 0 else np.zeros(count.shape, dtype=int)
+	owner   = np.where(started >= 0, index[np.maximum(started, 0), np.arange(len(names))], -1)
+	for column, name in enumerate(names):
+		if name in state["open"]:
+			owner[:, column] = np.where(started[:, column] < 0, state["open"][name][0], owner[:, column])
+
+	# The last cell of a box determines its right edge
+	ends = active & ~np.vstack((continues[1:], np.zeros((1, len(names)), dtype=bool)))
+	box_right = {}
+	for row, column in zip(*np.nonzero(ends)):
+		box_right[owner[row, column]] = right[row]
+
+	boxes = {
+		"left"    : left[new_rows],
+		"right"   : np.array([box_right[i] for i in index[new_rows, new_columns]], dtype=float),
+		"bottom"  : bottom[new_rows, new_columns],
+		"top"     : bottom[new_rows, new_columns] + count[new_rows, new_columns],
+		"count"   : count[new_rows, new_columns],
+		"tasktype": names[new_columns] if len(names) > 0 else np.zeros(0, dtype=object),
+	}
+	extended = dict((i, r) for i, r in box_right.items() if i < state["boxes"])
+
+	# The boxes of the last interval can be extended by the next call
+	if len(count) > 0:
+		state["open"] = dict((names[column], (owner[-1, column], bottom[-1, column], bottom[-1, column] + count[-1, column]))
+							 for column in np.flatnonzero(active[-1]))
+
+	# Remember the stack after the last event
+	if len(times) > 0:
+		state["last_time"] = times[-1]
+		state["counts"]    = dict((name, c) for name, c in zip(names, counts[-1]) if c > 0)
+		state["order"]     = order
+	state["boxes"] += len(new_rows)
+
+	return counts.sum(axis=1), boxes, extended
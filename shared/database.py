@@ -0,0 +1,54 @@
+"""
+The connection to the log database, shared by all documents of a server process.
+
+Under bokeh serve, the main.py of a dashboard runs again for every new browser session.
+Creating a MongoClient there means a new connection pool (and connection setup) per page load.
+MongoClient is thread safe and maintains a pool of connections, so the server lifecycle hooks of the dashboards
+create one client when the server is loaded and all documents use it (see connect and get_database).
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+from pymongo import MongoClient
+
+# the MongoDB server that stores the log entries
+MONGODB_URI = 'mongodb://localhost:27017/'
+
+# the maximum number of connections in the pool
+MAX_POOL_SIZE = 50
+
+# the database and the default collection that contain the log entries
+DATABASE       = "scientificworkflowlogs"
+LOG_COLLECTION = "test"
+
+client = None
+
+def connect(uri=MONGODB_URI, max_pool_size=MAX_POOL_SIZE):
+	'''
+	Creates the client of the server process, if it does not exist yet.
+	Called in on_server_loaded, but also lazily by get_database (e.g., if a dashboard is served as single file without lifecycle hooks).
+	:return: the client
+	'''
+	global client
+
+	if client is None:
+		client = MongoClient(uri, maxPoolSize=max_pool_size)
+
+	return client
+
+def get_database():
+	return connect()[DATABASE]
+
+def get_log_collection(name=LOG_COLLECTION):
+	return get_database()[name]
+
+def close():
+	'''
+	Closes all connections of the pool, called when the server shuts down.
+	'''
+	global client
+
+	if client is not None:
+		client.close()
+		client = None
@@ -0,0 +1,163 @@
+"""
+Reduction of time series to the resolution of the plots.
+
+A plot that is PLOT_WIDTH pixels wide cannot show more than a few points per pixel,
+but the resource attributes of a long run have hundreds of thousands of samples, all of which used to be sent to the browser.
+min_max divides the x-axis into buckets (e.g., one per pixel) and keeps the smallest and the largest value of every bucket,
+such that peaks remain visible while each series has at most two points per bucket.
+
+For zooming, the reduced points are precomputed for a sequence of bucket widths (a resolution pyramid, see new_pyramid),
+which is extended with the new points of every poll. The visible time window is taken from the level that matches its width,
+the rest of the series from a coarse level (see compose), such that only a few thousand points per series are sent,
+no matter whether the window covers the whole run or a few seconds of it.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import numpy as np
+
+def bucket_starts(x, width):
+	'''
+	The first index of every bucket of the given width that contains a point.
+	:param x: sorted x-coordinates
+	:param width: the width of the buckets, the buckets are aligned at x = 0, such that points that are added later fall into the same buckets
+	'''
+	bucket = np.floor(np.asarray(x) / width)
+	return np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+
+def min_max(x, values, width):
+	'''
+	Keeps the point with the smallest and the point with the largest value of every bucket, in the order of their x-coordinates.
+	Every series (column of values) is reduced separately, but all series have exactly two points per bucket,
+	such that the result can be stored in a single data source (with a separate x-coordinate column for every series).
+	:param x: sorted x-coordinates of the points, shared by all series, 
+		or one column per series if the points of a row are in the same bucket for all series (e.g., the output of min_max)
+	:param values: the values of the series, one column per series
+	:param width: the width of the buckets, e.g., the length of the visible time interval divided by the plot width
+	:return: x-coordinates and values of the remaining points, both as arrays with one column per series
+	'''
+	values = np.asarray(values, dtype=float)
+	x      = np.asarray(x, dtype=float)
+	x      = np.broadcast_to(x[:, np.newaxis] if x.ndim == 1 else x, values.shape)
+
+	if len(x) == 0:
+		return np.empty(values.shape), np.empty(values.shape)
+
+	starts = bucket_starts(x[:, 0], width)
+	ends   = np.append(starts[1:], len(x))
+	group  = np.repeat(np.arange(len(starts)), ends - starts)
+	rows   = np.arange(len(x))[:, np.newaxis]
+
+	# The smallest and largest value of every bucket and series (missing values are ignored)
+	minimum = np.fmin.reduceat(values, starts, axis=0)
+	maximum = np.fmax.reduceat(values, starts, axis=0)
+
+	# The first point of every bucket that has the smallest (largest) value, the last point of the bucket if all values are missing
+	last    = (ends - 1)[:, np.newaxis]
+	arg_min = np.minimum(np.minimum.reduceat(np.where(values == minimum[group], rows, len(x)), starts, axis=0), last)
+	arg_max = np.minimum(np.minimum.reduceat(np.where(values == maximum[group], rows, len(x)), starts, axis=0), last)
+
+	# Keep both points in the order of their x-coordinates
+	first  = np.minimum(arg_min, arg_max)
+	second = np.maximum(arg_min, arg_max)
+	column = np.arange(values.shape[1])
+
+	xs = np.empty((2 * len(starts), values.shape[1]))
+	ys = np.empty((2 * len(starts), values.shape[1]))
+
+	xs[0::2], xs[1::2] = x[first, column], x[second, column]
+	ys[0::2], ys[1::2] = values[first, column], values[second, column]
+
+	return xs, ys
+
+# the ratio of the bucket widths of two consecutive levels of a resolution pyramid
+LEVEL_FACTOR = 4
+
+def new_pyramid(base_width, levels):
+	'''
+	Creates an empty resolution pyramid. Level 0 contains all points, level k > 0 the points reduced to buckets of width base_width * LEVEL_FACTOR**(k-1).
+	The points of a level are stored as a list of chunks (one per call of extend_pyramid) that are concatenated when they are read.
+	'''
+	return {
+		"widths": [0] + [base_width * LEVEL_FACTOR ** level for level in range(levels)],
+		"xs"    : [[] for level in range(levels + 1)],
+		"ys"    : [[] for level in range(levels + 1)],
+	}
+
+def extend_pyramid(pyramid, x, values):
+	'''
+	Adds points to all levels of a resolution pyramid.
+	The last bucket of a level is reduced again together with the new points that fall into it,
+	such that the levels do not grow with the number of polls.
+	:param x: sorted x-coordinates of the new points (after the points that are already in the pyramid)
+	:param values: the values of the series, one column per series
+	'''
+	x      = np.asarray(x, dtype=float)
+	values = np.asarray(values, dtype=float)
+
+	if len(x) == 0:
+		return
+
+	pyramid["xs"][0].append(x)
+	pyramid["ys"][0].append(values)
+
+	for level in range(1, len(pyramid["widths"])):
+
+		width  = pyramid["widths"][level]
+		xs, ys = pyramid["xs"][level], pyramid["ys"][level]
+		new_xs, new_ys = np.broadcast_to(x[:, np.newaxis], values.shape), values
+
+		# Reduce the two points of the last bucket again if the first new point falls into it
+		if len(xs) > 0 and np.floor(xs[-1][-1, 0] / width) == np.floor(x[0] / width):
+			new_xs, new_ys = np.vstack((xs[-1][-2:], new_xs)), np.vstack((ys[-1][-2:], new_ys))
+			xs[-1], ys[-1] = xs[-1][:-2], ys[-1][:-2]
+
+			if len(xs[-1]) == 0:
+				xs.pop()
+				ys.pop()
+
+		reduced_xs, reduced_ys = min_max(new_xs, new_ys, width)
+		xs.append(reduced_xs)
+		ys.append(reduced_ys)
+
+def level_points(pyramid, level):
+	'''
+	The points of a level of a resolution pyramid, as x-coordinates (one column per series, except for level 0) and values.
+	'''
+	if len(pyramid["xs"][level]) == 0:
+		return np.empty((0, 0)), np.empty((0, 0))
+
+	for key in ["xs", "ys"]:
+		if len(pyramid[key][level]) > 1:
+			pyramid[key][level] = [np.concatenate(pyramid[key][level])]
+
+	return pyramid["xs"][level][0], pyramid["ys"][level][0]
+
+def select_level(pyramid, width):
+	'''
+	The coarsest level of a resolution pyramid whose buckets are not wider than the given width (e.g., the width of a pixel).
+	'''
+	return max(level for level, level_width in enumerate(pyramid["widths"]) if level_width <= width)
+
+def compose(pyramid, coarse, fine, start, end):
+	'''
+	Combines the points of the fine level between start and end with the points of the coarse level before start and after end.
+	:return: x-coordinates and values, both with one column per series
+	'''
+	parts = []
+
+	for level, keep in [(coarse, lambda key: key < start), (fine, lambda key: (key >= start) & (key <= end)), (coarse, lambda key: key > end)]:
+
+		xs, ys = level_points(pyramid, level)
+
+		if len(xs) == 0:
+			continue
+
+		rows = keep(xs if xs.ndim == 1 else xs[:, 0])
+		parts.append((np.broadcast_to((xs if xs.ndim == 2 else xs[:, np.newaxis])[rows], ys[rows].shape), ys[rows]))
+
+	if len(parts) == 0:
+		return np.empty((0, 0)), np.empty((0, 0))
+
+	return np.vstack([xs for xs, ys in parts]), np.vstack([ys for xs, ys in parts])
@@ -0,0 +1,112 @@
+"""
+The indexes of the log collections and an audit of the query plans of the dashboard pipelines.
+
+Without indexes, every poll of a run or session scans the whole log collection (all sessions ever recorded)
+and sorts the matching entries in memory. The server lifecycle hooks call provision when the server is loaded,
+which creates the missing indexes and logs a warning for each pipeline whose plan still contains a collection scan (COLLSCAN)
+or an in-memory sort (SORT), e.g., because a pipeline changed and no index supports it anymore.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from shared import catalog, queries
+
+logger = logging.getLogger(__name__)
+
+# the indexes of a log collection
+LOG_INDEXES = [
+	# the events of a run or a session in chronological order (run and session dashboard)
+	[("session.id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)],
+	# the events of a session in arrival order (progress monitor)
+	[("session.id", ASCENDING), ("_id", ASCENDING)],
+	# the invocations of a task type by status
+	[("data.lam_name", ASCENDING), ("data.status", ASCENDING)],
+	# the invocations with a duration (task type statistics)
+	[("data.info.tdur", ASCENDING)],
+]
+
+# the indexes of the session catalog
+CATALOG_INDEXES = [
+	# the session list of a log collection, newest first
+	[("collection", ASCENDING), ("tstart", DESCENDING)],
+]
+
+# the plan stages that indicate a missing index
+WARNING_STAGES = ("COLLSCAN", "SORT")
+
+def ensure(collection):
+	'''
+	Creates the indexes of a log collection and its session catalog, if they do not exist yet.
+	'''
+	for keys in LOG_INDEXES:
+		collection.create_index(keys, background=True)
+
+	for keys in CATALOG_INDEXES:
+		catalog.get_catalog(collection).create_index(keys, background=True)
+
+def pipelines(collection):
+	'''
+	The pipelines of the dashboards, instantiated for the newest session in the log collection.
+	:return: list of (name, pipeline)
+	'''
+	newest = collection.find_one({}, {"session.id": 1}, sort=[("_id", DESCENDING)])
+	session_id = newest.get("session", {}).get("id") if newest is not None else None
+
+	return [
+		("run events", queries.run_events_pipeline(session_id)),
+		("session events", queries.session_events_pipeline(session_id)),
+		("task type durations", queries.TASK_TYPE_DURATIONS_PIPELINE),
+	]
+
+def plan_stages(plan):
+	'''
+	Collects the stages of the winning plans in the output of explain (recursively, because the layout differs between server versions and sharding).
+	'''
+	stages = []
+
+	if isinstance(plan, dict):
+		if "stage" in plan:
+			stages.append(plan["stage"])
+		for key, value in plan.items():
+			if key != "rejectedPlans":
+				stages.extend(plan_stages(value))
+
+	elif isinstance(plan, list):
+		for value in plan:
+			stages.extend(plan_stages(value))
+
+	return stages
+
+def audit(collection):
+	'''
+	Explains the pipelines of the dashboards and the session list query and logs a warning for each one that scans the collection or sorts in memory.
+	:return: dictionary {name: list of problematic stages}
+	'''
+	plans = [(name, collection.database.command("aggregate", collection.name, pipeline=pipeline, explain=True))
+			 for name, pipeline in pipelines(collection)]
+	plans.append(("session list", catalog.query_sessions(collection).explain()))
+
+	problems = {}
+	for name, plan in plans:
+		stages = [stage for stage in plan_stages(plan) if stage in WARNING_STAGES]
+		if len(stages) > 0:
+			problems[name] = stages
+			logger.warning("query plan of %s on %s contains %s", name, collection.name, ", ".join(stages))
+
+	return problems
+
+def provision(collection):
+	'''
+	Creates the indexes and audits the query plans. Called in on_server_loaded, a failure does not prevent the server from starting.
+	'''
+	try:
+		ensure(collection)
+		return audit(collection)
+	except PyMongoError as e:
+		logger.warning("could not provision the indexes of %s: %s", collection.name, e)
@@ -0,0 +1,184 @@
+"""
+An index of the time intervals in which the task invocations of a run were running.
+
+The plots show how many invocations of each task type were running, but not which ones.
+Answering that used to require a scan over all events of the run.
+The index stores one interval (start, end) per invocation and answers which invocations were running at a point in time (stab)
+or during a time interval (overlapping) in O(log n + k) time per tree, where k is the number of reported invocations.
+
+The intervals are stored in centered interval trees (see build) over sorted endpoint arrays.
+The index grows with every poll: the intervals of a poll form a new tree, trees of similar size are merged
+(the logarithmic method), such that the index consists of O(log n) trees and every interval is rebuilt O(log n) times.
+Invocations that are still running (start event without stop event) are kept separately until they stop.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import numpy as np
+
+# subtrees with at most this many intervals are not divided further, they are searched with one vectorized comparison
+LEAF_SIZE = 64
+
+def new_index():
+	'''
+	Creates an empty index.
+	'''
+	return {
+		# the intervals of the invocations that stopped, one entry per invocation
+		"starts" : [],
+		"ends"   : [],
+		"ids"    : [],
+		"names"  : [],
+		# the trees over the rows of the intervals, from the largest to the smallest
+		"trees"  : [],
+		# the invocations that are running: invocation id -> (start, task type name)
+		"open"   : {},
+	}
+
+def record(index, times, ids, names, delta):
+	'''
+	Adds the invocations of new events to the index, the events have to be sorted by time.
+	:param times: the time of each event
+	:param ids: the invocation id of each event
+	:param names: the task type of each event
+	:param delta: +1 for start events, -1 for stop events and 0 for other events (see concurrency.matched_deltas)
+	'''
+	starts, ends, stopped, stopped_names = [], [], [], []
+
+	for position in np.flatnonzero(delta):
+		if delta[position] > 0:
+			index["open"][ids[position]] = (times[position], names[position])
+		elif ids[position] in index["open"]:
+			start, name = index["open"].pop(ids[position])
+			starts.append(start)
+			ends.append(times[position])
+			stopped.append(ids[position])
+			stopped_names.append(name)
+
+	add(index, starts, ends, stopped, stopped_names)
+
+def add(index, starts, ends, ids, names):
+	'''
+	Adds intervals to the index. The new intervals form a new tree, which is merged with the smallest trees of the index as long as they are not larger.
+	'''
+	if len(starts) == 0:
+		return
+
+	first = len(index["starts"])
+	index["starts"].extend(starts)
+	index["ends"].extend(ends)
+	index["ids"].extend(ids)
+	index["names"].extend(names)
+
+	rows = np.arange(first, len(index["starts"]))
+	while len(index["trees"]) > 0 and len(index["trees"][-1]["rows"]) <= len(rows):
+		rows = np.concatenate((index["trees"].pop()["rows"], rows))
+
+	index["trees"].append(build(rows, np.array([index["starts"][row] for row in rows], dtype=float), np.array([index["ends"][row] for row in rows], dtype=float)))
+
+def build(rows, starts, ends):
+	'''
+	Builds a centered interval tree over intervals. Every node has a center, the intervals that contain the center
+	are stored at the node, sorted by start and by end, the intervals before (after) the center are stored in the left (right) subtree.
+	The center is the median of the endpoints, such that the depth of the tree is O(log n).
+	Small subtrees are leaves (see LEAF_SIZE). The tree also stores all intervals sorted by start, to find the intervals that start within a time interval.
+	:param rows: the row of each interval in the index
+	:param starts: the start of each interval
+	:param ends: the end of each interval
+	'''
+	by_start = np.argsort(starts, kind="mergesort")
+	return {"root": node(rows, starts, ends), "rows": rows[by_start], "all_starts": starts[by_start]}
+
+def node(rows, starts, ends):
+	'''
+	Builds a node of a centered interval tree (see build), None if there are no intervals.
+	'''
+	if len(rows) == 0:
+		return None
+
+	if len(rows) <= LEAF_SIZE:
+		return {"leaf": True, "rows": rows, "starts": starts, "ends": ends}
+
+	center = np.median(np.concatenate((starts, ends)))
+	before = ends < center
+	after  = starts > center
+	here   = ~(before | after)
+
+	by_start = np.argsort(starts[here], kind="mergesort")
+	by_end   = np.argsort(-ends[here], kind="mergesort")
+
+	return {
+		"leaf"    : False,
+		"center"  : center,
+		# the intervals that contain the center, sorted by start (ascending) and by end (descending)
+		"starts"  : starts[here][by_start],
+		"by_start": rows[here][by_start],
+		"ends"    : -ends[here][by_end],
+		"by_end"  : rows[here][by_end],
+		"left"    : node(rows[before], starts[before], ends[before]),
+		"right"   : node(rows[after], starts[after], ends[after]),
+	}
+
+def stab_tree(tree, time):
+	'''
+	The rows of the intervals of a tree that contain a point in time.
+	'''
+	found = []
+	current = tree["root"]
+
+	while current is not None:
+		if current["leaf"]:
+			found.append(current["rows"][(current["starts"] <= time) & (time <= current["ends"])])
+			break
+		# All intervals of the node contain the center, so they contain the time if they start before it (end after it)
+		if time < current["center"]:
+			found.append(current["by_start"][:np.searchsorted(current["starts"], time, side="right")])
+			current = current["left"]
+		elif time > current["center"]:
+			found.append(current["by_end"][:np.searchsorted(current["ends"], -time, side="right")])
+			current = current["right"]
+		else:
+			found.append(current["by_start"])
+			break
+
+	return np.concatenate(found) if len(found) > 0 else np.zeros(0, dtype=int)
+
+def stab(index, time):
+	'''
+	The invocations that were running at a point in time (start <= time <= end), including the ones that are still running.
+	:return: the invocations as columns (see invocations)
+	'''
+	rows = [stab_tree(tree, time) for tree in index["trees"]]
+	return invocations(index, np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=int), lambda start: start <= time)
+
+def overlapping(index, start, end):
+	'''
+	The invocations that were running at some point in a time interval (the invocation starts before the end and ends after the start of the interval),
+	including the ones that are still running.
+	:return: the invocations as columns (see invocations)
+	'''
+	rows = []
+	for tree in index["trees"]:
+		# The intervals that contain the start and the ones that start within the interval
+		rows.append(stab_tree(tree, start))
+		rows.append(tree["rows"][np.searchsorted(tree["all_starts"], start, side="right"):np.searchsorted(tree["all_starts"], end, side="right")])
+
+	return invocations(index, np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=int), lambda started: started <= end)
+
+def invocations(index, rows, running):
+	'''
+	Converts the rows of the index and the running invocations for which running(start) is True to columns, sorted by start.
+	The end of running invocations is None.
+	'''
+	open_ids = [i for i, (start, name) in index["open"].iteritems() if running(start)]
+
+	columns = {
+		"id"   : [index["ids"][row] for row in rows] + open_ids,
+		"task" : [index["names"][row] for row in rows] + [index["open"][i][1] for i in open_ids],
+		"start": [index["starts"][row] for row in rows] + [index["open"][i][0] for i in open_ids],
+		"end"  : [index["ends"][row] for row in rows] + [None] * len(open_ids),
+	}
+
+	order = np.argsort(columns["start"], kind="mergesort")
+	return dict((column, [values[i] for i in order]) for column, values in columns.iteritems())
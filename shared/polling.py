@@ -0,0 +1,223 @@
+"""
+Polls the log database once per workflow session and delivers the new data to all documents that display the session.
+
+Under bokeh serve, every browser tab gets its own document and used to run its own periodic database query,
+although all tabs that display the same session need exactly the same new log entries.
+Instead, a document subscribes to a poller, which is identified by a key (e.g., the dashboard name and the session id).
+There is one poller per key in the server process, it queries the database in regular intervals on the server's IOLoop
+and hands the result to every subscribed document via add_next_tick_callback.
+
+The poller keeps a state (created by the dashboard) that is updated by each poll, e.g., the time stamp of the last event
+and the data that has been processed so far. A document that subscribes later initializes its plots from that state.
+Pollers without subscribers stop polling, the most recently used ones are kept to speed up switching back to a session.
+Pollers that are started by the server lifecycle hooks (see start) keep polling without subscribers,
+such that their state is up to date when a new document needs it, e.g., the list of sessions.
+
+The subscriptions of a document are removed when its session is destroyed, see the server_lifecycle.py of the dashboards.
+
+If a change feed announces new log entries (see shared/changes.py), the pollers that depend on log entries (see the watch parameter)
+do not poll periodically anymore but only when the feed notifies them about new log entries of their session.
+The server is then idle as long as nothing happens and new log entries reach the documents without waiting for the next poll.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+from collections import OrderedDict
+from functools import partial
+
+from tornado.ioloop import PeriodicCallback
+
+# the default time between two polls in milliseconds
+POLL_PERIOD = 300
+
+# the number of pollers without subscribers whose state is kept
+IDLE_POLLERS = 5
+
+# watch value of pollers that depend on the log entries of all sessions, e.g., a session list
+ALL_SESSIONS = "*"
+
+# whether a change feed notifies the pollers about new log entries (see set_event_driven)
+event_driven = False
+
+class Poller(object):
+	'''
+	Queries the database in regular intervals while there are subscribers and delivers the results to them.
+	:param key: identifies the poller, e.g., ("sessionboard", session_id)
+	:param state: the state of the poller, passed to fetch
+	:param fetch: function that takes the state, queries the new data, updates the state and returns the new data (None if there is nothing new)
+	:param period: time between two polls in milliseconds
+	:param pinned: whether to keep polling without subscribers
+	:param watch: the id of the workflow session whose log entries the poller depends on,
+		ALL_SESSIONS if it depends on all log entries and None if it does not depend on log entries (it then always polls periodically)
+	'''
+
+	def __init__(self, key, state, fetch, period=POLL_PERIOD, pinned=False, watch=None):
+		self.key         = key
+		self.state       = state
+		self.fetch       = fetch
+		self.period      = period
+		self.pinned      = pinned
+		self.watch       = watch
+		# session id => (document, callback)
+		self.subscribers = OrderedDict()
+		self.running     = False
+		self.callback    = None
+
+	def poll(self):
+		'''
+		Queries the new data and schedules the callbacks of all subscribers with it.
+		'''
+		new_data = self.fetch(self.state)
+
+		if new_data is None:
+			return
+
+		for document, callback in self.subscribers.values():
+			document.add_next_tick_callback(partial(callback, new_data))
+
+	def start(self):
+		self.running = True
+		self.schedule()
+
+	def stop(self):
+		self.running = False
+		self.schedule()
+
+	def schedule(self):
+		'''
+		Starts or stops polling periodically, depending on whether the poller is running and whether it is notified about new log entries.
+		'''
+		periodic = self.running and not (event_driven and self.watch is not None)
+
+		if periodic and self.callback is None:
+			self.callback = PeriodicCallback(self.poll, self.period)
+			self.callback.start()
+
+		if not periodic and self.callback is not None:
+			self.callback.stop()
+			self.callback = None
+
+	def depends_on(self, session_ids):
+		return self.watch == ALL_SESSIONS or self.watch in session_ids
+
+# key => Poller, the pollers without subscribers are ordered from least to most recently used
+pollers = OrderedDict()
+
+def subscribe(key, create_state, fetch, session_id, document, callback, period=POLL_PERIOD, watch=None):
+	'''
+	Subscribes a document to the poller with the given key, the poller is created if it does not exist.
+	If the poller is not running, it is polled once before returning, such that its state is up to date, e.g., to initialize the plots of the document from it.
+	:param key: identifies the poller, documents with the same key share the poller
+	:param create_state: function without parameters that creates the initial state of a new poller
+	:param fetch: see Poller
+	:param session_id: the id of the bokeh session of the document (curdoc().session_context.id)
+	:param document: the document to which the new data is delivered
+	:param callback: function that takes the new data, called in the context of the document
+	:param period: see Poller
+	:param watch: see Poller
+	:return: the poller
+	'''
+	if key in pollers:
+		poller = pollers.pop(key)
+	else:
+		poller = Poller(key, create_state(), fetch, period, watch=watch)
+
+	pollers[key] = poller
+
+	if not poller.running:
+		poller.poll()
+
+	poller.subscribers[session_id] = (document, callback)
+	poller.start()
+
+	return poller
+
+def start(key, create_state, fetch, period=POLL_PERIOD, watch=None):
+	'''
+	Starts a poller that keeps polling without subscribers, called in on_server_loaded to keep data warm that every new document needs.
+	The parameters are the same as for subscribe.
+	:return: the poller
+	'''
+	if key in pollers:
+		poller = pollers[key]
+	else:
+		poller = pollers[key] = Poller(key, create_state(), fetch, period, watch=watch)
+
+	poller.pinned = True
+	poller.poll()
+	poller.start()
+
+	return poller
+
+def current_state(key, create_state, fetch):
+	'''
+	The state of a poller, for documents that only need it when they are created (without subscribing).
+	If the poller is not running (e.g., if the server lifecycle hooks did not start it), it is polled once.
+	The parameters are the same as for subscribe.
+	'''
+	if key not in pollers:
+		pollers[key] = Poller(key, create_state(), fetch)
+
+	poller = pollers[key]
+
+	if not poller.running:
+		poller.poll()
+
+	return poller.state
+
+def unsubscribe(session_id, key=None):
+	'''
+	Removes the subscriptions of a document, e.g., when switching to another workflow session or when the bokeh session is destroyed.
+	:param session_id: the id of the bokeh session of the document
+	:param key: the poller to unsubscribe from, None to remove all subscriptions of the document
+	'''
+	for poller in list(pollers.values()):
+
+		if key is not None and poller.key != key:
+			continue
+
+		if poller.subscribers.pop(session_id, None) is None or len(poller.subscribers) > 0 or poller.pinned:
+			continue
+
+		# keep the state of the poller without subscribers, it becomes the most recently used one
+		poller.stop()
+		del pollers[poller.key]
+		pollers[poller.key] = poller
+
+	# discard the least recently used pollers without subscribers
+	idle = [poller for poller in pollers.values() if len(poller.subscribers) == 0 and not poller.pinned]
+	for poller in idle[:max(0, len(idle) - IDLE_POLLERS)]:
+		del pollers[poller.key]
+
+def notify(session_ids):
+	'''
+	Polls the running pollers that depend on the log entries of the given workflow sessions, called by the change feed.
+	'''
+	for poller in list(pollers.values()):
+		if poller.running and poller.depends_on(session_ids):
+			poller.poll()
+
+def set_event_driven(active):
+	'''
+	Switches between periodic polling and polling when notified, for all pollers that depend on log entries.
+	Called by the change feed when it starts and when it fails (the pollers then fall back to periodic polling).
+	'''
+	global event_driven
+
+	event_driven = active
+
+	for poller in list(pollers.values()):
+		poller.schedule()
+
+		# log entries might have been inserted between the last poll and the start of the feed
+		if poller.running and poller.watch is not None:
+			poller.poll()
+
+def stop_all():
+	'''
+	Stops all pollers, called when the server shuts down.
+	'''
+	for poller in pollers.values():
+		poller.stop()
+	pollers.clear()
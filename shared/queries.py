@@ -0,0 +1,146 @@
+"""
+Queries that are used by several dashboards or by their server lifecycle hooks.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+from collections import OrderedDict
+from functools import partial
+
+from shared import catalog
+
+# the host whose runs are displayed by the run dashboard (load-analysis)
+RUNS_HOST = "runs"
+
+def query_sessions(collection, host=None):
+	'''
+	Retrieves a list of all sessions with start time, number of messages and session id from the session catalog (see shared/catalog.py).
+	Only reads the catalog, it is maintained by the session list pollers of the servers (see poll_sessions).
+	:param collection: the collection that contains the log entries
+	:param host: only list the sessions with log entries from this host and count only these entries, e.g., RUNS_HOST
+	:return: ordered dictionary that allows to access the session information by session id
+		but maintains the chronological order (newest first) of the sessions.
+		{session_id: {'numLogEntries': 18, 'tstart': 1472620731519, 'last_event_time': 1472620799.1}}
+	'''
+	session_map = OrderedDict()
+	for session in catalog.query_sessions(collection, host):
+		session_map[session['session_id']] = dict(numLogEntries=session['numLogEntries'] if host is None else catalog.host_log_entries(session, host), tstart=session['tstart'],
+												  last_event_time=session.get('last_event_time'))
+
+	return session_map
+
+def poll_sessions(collection, host, maintain, state):
+	'''
+	Fetch function of a session list poller (see shared/polling.py).
+	:param maintain: whether to record the log entries that arrived since the last poll in the session catalog before reading it (see catalog.update)
+	:return: the new session map, or None if nothing changed since the last poll.
+	'''
+	if maintain:
+		catalog.update(collection)
+
+	session_map = query_sessions(collection, host)
+
+	if session_map == state["session_map"]:
+		return None
+
+	state["session_map"] = session_map
+	return session_map
+
+def session_list_poller(name, collection, host=None, maintain=False):
+	'''
+	The arguments for polling.start and polling.subscribe to poll the session list of a dashboard.
+	:param name: the name of the dashboard
+	:param maintain: whether the poller maintains the session catalog (see poll_sessions),
+		True for the poller that is started when the server is loaded, the documents subscribe to that poller
+	:return: key, create_state and fetch
+	'''
+	return (name, "sessions"), (lambda: {"session_map": None}), partial(poll_sessions, collection, host, maintain)
+
+def run_events_pipeline(run_id, watermark=None, fields=None):
+	'''
+	The events of a run that come after the watermark in (timestamp, ObjectId) order, used by the run dashboard.
+	Events that arrive late (with a timestamp before the watermark) are not considered, as in the session dashboard.
+	:param watermark: (timestamp, ObjectId) of the last event that has been processed, None to retrieve all events
+	:param fields: the fields of the log entries that are transferred (e.g., ["data.status", "min1"]), None to transfer whole log entries.
+		The _id is always included.
+	'''
+	match = {"session.id": run_id}
+
+	if watermark is not None:
+		timestamp, object_id = watermark
+		match["$or"] = [{"timestamp": {"$gt": timestamp}},
+						{"timestamp": timestamp, "_id": {"$gt": object_id}}]
+
+	pipeline = [
+		{"$match": match},
+		{"$sort": {"timestamp": 1, "_id": 1}},
+	]
+
+	if fields is not None:
+		pipeline.append({"$project": dict((field, 1) for field in fields)})
+
+	return pipeline
+
+def session_events_pipeline(session_id, last_id=None, until_id=None):
+	'''
+	The invocation lifecycle events of a session that arrived after the event with the ObjectId last_id, in chronological order, used by the session dashboard.
+	The watermark is the arrival order (and not the timestamp), such that events with an older timestamp that arrive late are not missed.
+	The next watermark is the greatest ObjectId of the retrieved events.
+	:param last_id: the ObjectId of the last event that has been retrieved, None to retrieve all events
+	:param until_id: the ObjectId of the last event to retrieve, None to retrieve all events that arrived so far
+	'''
+	match = {"session.id": session_id}
+
+	if last_id is not None:
+		match["_id"] = {"$gt": last_id}
+
+	if until_id is not None:
+		match.setdefault("_id", {})["$lte"] = until_id
+
+	return [
+		{"$match": match},
+		{"$sort": {"timestamp": 1, "_id": 1}},
+		{"$project": {"task_type": 1, "timestamp": 1, "event": 1}}
+	]
+
+# the invocation durations of all task types with more than one invocation, ordered by task type name
+TASK_TYPE_DURATIONS_PIPELINE = [
+	{"$match": {
+		# "session.id":{"$in":["20160831T051239+0000", "20160831T050311+0000"]},
+		"data.info.tdur":{"$exists":True}
+		}},
+	{"$group": {
+		"_id": "$data.lam_name",
+		"count": {"$sum": 1},
+		"mean_duration": {"$avg": "$data.info.tdur"},
+		"sd_duration": {"$stdDevSamp":"$data.info.tdur"},
+		"data": { "$push": {
+			"session_id":"$session.id",
+			"duration":{"$divide": ["$data.info.tdur", 1000]},
+		 }},
+	 }},
+	{"$sort": {"_id":1}},
+	{"$match": {"count": {"$gt":1}}},
+	# {"$limit": 15}
+]
+
+def query_task_type_durations(collection):
+	'''
+	Retrieves the invocation durations (in seconds) of all task types with more than one invocation, ordered by task type name.
+	:return: list of {'_id': task type, 'count': int, 'mean_duration': ms, 'sd_duration': ms, 'data': [{'session_id': .., 'duration': s}, ...]}
+	'''
+	return list(collection.aggregate(TASK_TYPE_DURATIONS_PIPELINE))
+
+def poll_task_type_durations(collection, state):
+	'''
+	Fetch function of the task type statistics poller, the documents read the statistics from the state when they are created.
+	'''
+	state["task_stats"] = query_task_type_durations(collection)
+
+def task_type_durations_poller(collection):
+	'''
+	The arguments for polling.start and polling.current_state to poll the task type duration statistics.
+	:return: key, create_state and fetch
+	'''
+	return ("task-type-statistics", "durations"), (lambda: {"task_stats": None}), partial(poll_task_type_durations, collection)
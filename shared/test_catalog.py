@@ -0,0 +1,120 @@
+"""
+Tests of the session catalog (see catalog.record): every log entry is counted exactly once, also when several processes record overlapping batches at the same time.
+The catalog collection is replaced by an in-memory collection that supports the operations used by record.
+Run with python -m unittest shared.test_catalog from the repository root.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import unittest
+from collections import OrderedDict
+
+from pymongo.errors import DuplicateKeyError
+
+from shared import catalog
+
+def key(_id):
+	return tuple(_id.items())
+
+class Result(object):
+	def __init__(self, matched_count):
+		self.matched_count = matched_count
+
+class CatalogCollection(object):
+	'''
+	An in-memory collection with the operations that catalog.record uses.
+	before_write is called before every write, e.g., to let another process write first.
+	'''
+	def __init__(self):
+		self.documents    = OrderedDict()
+		self.before_write = lambda: None
+
+	def find(self, query):
+		return [dict(self.documents[key(_id)]) for _id in query["_id"]["$in"] if key(_id) in self.documents]
+
+	def insert_one(self, document):
+		self.before_write()
+		if key(document["_id"]) in self.documents:
+			raise DuplicateKeyError("duplicate key")
+		self.documents[key(document["_id"])] = dict(document)
+
+	def replace_one(self, query, document):
+		self.before_write()
+		stored = self.documents.get(key(query["_id"]))
+		if stored is None or stored["last_id"] != query["last_id"]:
+			return Result(0)
+		self.documents[key(query["_id"])] = dict(document)
+		return Result(1)
+
+class LogCollection(object):
+	def __init__(self, name, catalog_collection):
+		self.name     = name
+		self.database = {catalog.CATALOG: catalog_collection}
+
+def log_entries(first, last, session_id="s", hosts=("runs", "other")):
+	return [{"_id": i, "session": {"id": session_id, "tstart": 100}, "timestamp": float(i), "data": {"host_name": hosts[i % len(hosts)]}}
+			for i in range(first, last)]
+
+class RecordTest(unittest.TestCase):
+
+	def setUp(self):
+		self.sessions = CatalogCollection()
+		self.log      = LogCollection("test", self.sessions)
+
+	def summary(self, session_id="s"):
+		return self.sessions.documents[key(catalog.summary_key(self.log, session_id))]
+
+	def test_record(self):
+		catalog.record(self.log, log_entries(0, 10) + log_entries(0, 3, "t"))
+		catalog.record(self.log, log_entries(10, 15))
+
+		summary = self.summary()
+		self.assertEqual(summary["numLogEntries"], 15)
+		self.assertEqual(summary["last_id"], 14)
+		self.assertEqual(summary["last_event_time"], 14.0)
+		self.assertEqual(summary["hosts"], ["runs", "other"])
+		self.assertEqual(catalog.host_log_entries(summary, "runs"), 8)
+		self.assertEqual(catalog.host_log_entries(summary, "other"), 7)
+		self.assertEqual(self.summary("t")["numLogEntries"], 3)
+
+	def test_recorded_entries_are_skipped(self):
+		catalog.record(self.log, log_entries(0, 10))
+		catalog.record(self.log, log_entries(5, 12))
+		self.assertEqual(self.summary()["numLogEntries"], 12)
+
+	def test_retry_after_concurrent_replace(self):
+		# another process records an overlapping batch between the read and the replace of this process
+		catalog.record(self.log, log_entries(0, 5))
+		other = [log_entries(3, 9)]
+
+		def write_other():
+			if len(other) > 0:
+				catalog.record(self.log, other.pop())
+
+		self.sessions.before_write = write_other
+		catalog.record(self.log, log_entries(3, 12))
+
+		summary = self.summary()
+		self.assertEqual(summary["numLogEntries"], 12)
+		self.assertEqual(summary["last_id"], 11)
+		self.assertEqual(catalog.host_log_entries(summary, "runs") + catalog.host_log_entries(summary, "other"), 12)
+
+	def test_retry_after_concurrent_insert(self):
+		# both processes see a new session, the insert of this process fails and it updates the summary of the other one
+		other = [log_entries(0, 6)]
+
+		def write_other():
+			if len(other) > 0:
+				catalog.record(self.log, other.pop())
+
+		self.sessions.before_write = write_other
+		catalog.record(self.log, log_entries(0, 8))
+
+		self.assertEqual(self.summary()["numLogEntries"], 8)
+
+	def test_summary_without_host_counts(self):
+		self.assertEqual(catalog.host_log_entries({"numLogEntries": 7, "hosts": ["runs"]}, "runs"), 7)
+
+if __name__ == '__main__':
+	unittest.main()
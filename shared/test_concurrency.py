@@ -0,0 +1,51 @@
+"""
+Tests of the matching of start and stop events (see concurrency.matched_deltas).
+Run with python -m unittest shared.test_concurrency from the repository root.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import unittest
+
+import numpy as np
+
+from shared import concurrency
+
+def deltas(events, running=None):
+	'''
+	Matches events given as (status, invocation id) pairs, status is "started", "ok" or something else.
+	:return: the deltas as list and the running invocations after the events
+	'''
+	running = set() if running is None else running
+	delta = concurrency.matched_deltas(np.array([status == "started" for status, _ in events], dtype=bool),
+									   np.array([status == "ok" for status, _ in events], dtype=bool),
+									   np.array([i for _, i in events], dtype=object), running)
+	return delta.tolist(), running
+
+class MatchedDeltasTest(unittest.TestCase):
+
+	def test_start_and_stop(self):
+		self.assertEqual(deltas([("started", "a"), ("started", "b"), ("ok", "a")]), ([1, 1, -1], {"b"}))
+
+	def test_duplicate_stop_is_ignored(self):
+		self.assertEqual(deltas([("started", "a"), ("ok", "a"), ("ok", "a")]), ([1, -1, 0], set()))
+
+	def test_duplicate_stop_in_a_later_poll_is_ignored(self):
+		running = set()
+		self.assertEqual(deltas([("started", "a"), ("ok", "a")], running), ([1, -1], set()))
+		self.assertEqual(deltas([("ok", "a"), ("started", "b")], running), ([0, 1], {"b"}))
+
+	def test_stop_of_a_running_invocation(self):
+		self.assertEqual(deltas([("ok", "a"), ("ok", "a")], {"a"}), ([-1, 0], set()))
+
+	def test_stop_before_start_is_ignored(self):
+		self.assertEqual(deltas([("ok", "a"), ("started", "a"), ("other", "a")]), ([0, 1, 0], {"a"}))
+
+	def test_profile_does_not_drift(self):
+		# a retried stop event must not lower the number of running tasks below zero
+		delta, running = deltas([("started", "a"), ("ok", "a"), ("ok", "a"), ("started", "b"), ("ok", "b"), ("ok", "b")])
+		self.assertEqual(np.cumsum(delta).tolist(), [1, 0, 0, 1, 0, 0])
+
+if __name__ == '__main__':
+	unittest.main()
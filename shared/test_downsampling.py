@@ -0,0 +1,99 @@
+"""
+Tests of the reduction of time series to the resolution of the plots (see downsampling.min_max) and of the resolution pyramids (see downsampling.extend_pyramid).
+Run with python -m unittest shared.test_downsampling from the repository root.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import random
+import unittest
+
+import numpy as np
+
+from shared import downsampling
+
+def random_series(generator, points, series):
+	'''
+	Sorted x-coordinates with repeated values and series with missing values, one column per series.
+	'''
+	x = np.cumsum([generator.choice([0, 0.25, 1, 3, 7]) for _ in range(points)])
+	values = np.array([[generator.choice([np.nan, generator.randint(0, 5)]) if column > 0 else generator.randint(0, 5) for column in range(series)] for _ in range(points)], dtype=float)
+	return x, values
+
+def bucket_extremes(x, values, width):
+	'''
+	The smallest and the largest value of each bucket and series, computed point by point.
+	'''
+	extremes = {}
+	for row in range(len(x)):
+		for column in range(values.shape[1]):
+			if not np.isnan(values[row, column]):
+				low, high = extremes.get((np.floor(x[row] / width), column), (np.inf, -np.inf))
+				extremes[(np.floor(x[row] / width), column)] = (min(low, values[row, column]), max(high, values[row, column]))
+	return extremes
+
+class MinMaxTest(unittest.TestCase):
+
+	def test_two_points_per_bucket(self):
+		generator = random.Random(1)
+		for width in [1, 2.5, 10, 1000]:
+			x, values = random_series(generator, 300, 3)
+			xs, ys = downsampling.min_max(x, values, width)
+
+			buckets = np.unique(np.floor(x / width))
+			self.assertEqual(xs.shape, (2 * len(buckets), 3))
+			self.assertTrue(np.all(np.floor(xs[0::2] / width) == buckets[:, np.newaxis]))
+			self.assertTrue(np.all(np.floor(xs[1::2] / width) == buckets[:, np.newaxis]))
+			self.assertTrue(np.all(xs[0::2] <= xs[1::2]))
+
+			# the kept points are points of the series with the smallest and the largest value of their bucket
+			for (bucket, column), (low, high) in bucket_extremes(x, values, width).items():
+				row = 2 * int(np.searchsorted(buckets, bucket))
+				self.assertEqual(sorted(ys[row:row + 2, column]), [low, high])
+				for point in (row, row + 1):
+					self.assertIn((xs[point, column], ys[point, column]), list(zip(x, values[:, column])))
+
+	def test_empty(self):
+		xs, ys = downsampling.min_max([], np.zeros((0, 2)), 1.0)
+		self.assertEqual(xs.shape, (0, 2))
+		self.assertEqual(ys.shape, (0, 2))
+
+class PyramidTest(unittest.TestCase):
+
+	def test_extend_in_polls(self):
+		# the levels of a pyramid that is extended poll by poll are the points of one reduction of all points
+		generator = random.Random(2)
+		x, values = random_series(generator, 500, 2)
+		pyramid = downsampling.new_pyramid(0.5, 5)
+
+		cuts = sorted(generator.sample(range(1, len(x)), 40))
+		for start, end in zip([0] + cuts, cuts + [len(x)]):
+			downsampling.extend_pyramid(pyramid, x[start:end], values[start:end])
+
+		xs, ys = downsampling.level_points(pyramid, 0)
+		self.assertTrue(np.array_equal(xs, x))
+		self.assertTrue(np.allclose(ys, values, equal_nan=True))
+
+		for level in range(1, len(pyramid["widths"])):
+			expected_xs, expected_ys = downsampling.min_max(x, values, pyramid["widths"][level])
+			xs, ys = downsampling.level_points(pyramid, level)
+			self.assertTrue(np.array_equal(xs, expected_xs))
+			self.assertTrue(np.allclose(ys, expected_ys, equal_nan=True))
+
+	def test_compose(self):
+		x, values = random_series(random.Random(3), 200, 1)
+		pyramid = downsampling.new_pyramid(1.0, 3)
+		downsampling.extend_pyramid(pyramid, x, values)
+
+		start, end = x[50], x[120]
+		xs, ys = downsampling.compose(pyramid, 3, 0, start, end)
+		coarse_xs, coarse_ys = downsampling.level_points(pyramid, 3)
+
+		self.assertTrue(np.all(np.diff(xs[:, 0]) >= 0))
+		self.assertTrue(np.array_equal(xs[(xs[:, 0] >= start) & (xs[:, 0] <= end), 0], x[(x >= start) & (x <= end)]))
+		self.assertTrue(np.array_equal(xs[xs[:, 0] < start, 0], coarse_xs[coarse_xs[:, 0] < start, 0]))
+		self.assertTrue(np.array_equal(xs[xs[:, 0] > end, 0], coarse_xs[coarse_xs[:, 0] > end, 0]))
+
+if __name__ == '__main__':
+	unittest.main()
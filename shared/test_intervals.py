@@ -0,0 +1,84 @@
+"""
+Tests of the index of the invocation intervals of a run (see intervals.stab and intervals.overlapping), compared with a scan over all intervals.
+Run with python -m unittest shared.test_intervals from the repository root.
+"""
+
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import random
+import unittest
+
+import numpy as np
+
+from shared import intervals
+
+def random_polls(generator, invocations, polls):
+	'''
+	Start and stop events of invocations with random intervals, sorted by time and split into polls. Some invocations do not stop.
+	:return: the events of each poll as (time, invocation id, task type, delta) and the intervals as invocation id -> (start, end), end None if still running
+	'''
+	events = []
+	spans  = {}
+	for i in range(invocations):
+		start = generator.randint(0, 1000)
+		end   = start + generator.randint(0, 200) if generator.random() < 0.9 else None
+		name  = generator.choice("abc")
+		events.append((start, i, name, 1))
+		if end is not None:
+			events.append((end, i, name, -1))
+		spans[i] = (start, end)
+
+	events.sort(key=lambda event: (event[0], -event[3]))
+	cuts = sorted(generator.sample(range(1, len(events)), polls - 1))
+	return [events[a:b] for a, b in zip([0] + cuts, cuts + [len(events)])], spans
+
+def build_index(polls):
+	index = intervals.new_index()
+	for poll in polls:
+		times, ids, names, delta = zip(*poll)
+		intervals.record(index, np.array(times, dtype=float), list(ids), list(names), np.array(delta, dtype=int))
+	return index
+
+class IntervalIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		# small leaves, such that the trees have inner nodes
+		self.leaf_size, intervals.LEAF_SIZE = intervals.LEAF_SIZE, 4
+
+	def tearDown(self):
+		intervals.LEAF_SIZE = self.leaf_size
+
+	def assertInvocations(self, found, expected, spans):
+		self.assertEqual(sorted(found["id"]), sorted(expected))
+		self.assertEqual(found["start"], sorted(found["start"]))
+		self.assertEqual([(start, end) for start, end in zip(found["start"], found["end"])], [spans[i] for i in found["id"]])
+
+	def test_stab(self):
+		generator = random.Random(1)
+		polls, spans = random_polls(generator, 300, 12)
+		index = build_index(polls)
+		self.assertGreater(len(index["trees"]), 1)
+
+		for time in [generator.randint(-10, 1300) for _ in range(200)] + [0, 1000]:
+			expected = [i for i, (start, end) in spans.items() if start <= time and (end is None or time <= end)]
+			self.assertInvocations(intervals.stab(index, time), expected, spans)
+
+	def test_overlapping(self):
+		generator = random.Random(2)
+		polls, spans = random_polls(generator, 300, 7)
+		index = build_index(polls)
+
+		for _ in range(200):
+			start = generator.randint(-10, 1300)
+			end   = start + generator.choice([0, 1, 10, 300])
+			expected = [i for i, (s, e) in spans.items() if s <= end and (e is None or start <= e)]
+			self.assertInvocations(intervals.overlapping(index, start, end), expected, spans)
+
+	def test_empty_index(self):
+		index = intervals.new_index()
+		self.assertEqual(intervals.stab(index, 5)["id"], [])
+		self.assertEqual(intervals.overlapping(index, 0, 10)["id"], [])
+
+if __name__ == '__main__':
+	unittest.main()
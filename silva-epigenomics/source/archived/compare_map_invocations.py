@@ -42,17 +42,9 @@ def compare_map_tasks(transformation):
 		wf_id = working_dir.split("/")[-1]
 		dax_file = "genome.dax"  # is the same for all of rafaels epigenomics workflows
 
-		# parse the input and output files for each task
-		job_file_map = base.parse_input_output_files(base.abs_path(working_dir, dax_file))
-
-		# get the XML file names of the invocations of a given task
-		invocation_files = base.find_invocation_files_stampede(working_dir, transformation)
-
-		# extract the invocation and file information from the XML files and update the job_file_map with it
-		jobs = []
-		for invocation_file in invocation_files:
-			job_id = base.parse_invocation_metrics(base.abs_path(working_dir, invocation_file), job_file_map)
-			jobs.append(job_id)
+		# parse the input and output files and the invocation files of the given task
+		job_file_map, jobs_by_transformation = base.extract_run(working_dir, dax_file, [transformation])
+		jobs = jobs_by_transformation[transformation]
 
 		# print("jobs: {0}".format(jobs))
 		# print("job_file_map: {0}".format(job_file_map))
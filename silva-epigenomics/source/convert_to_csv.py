@@ -80,42 +80,40 @@ def write_csv(invocations, job_information, out_file, null_string ="NA"):
 #			data = [job_info["transformation"], job_info['mainjob_started_ts']] + file_sizes + usage_values + machine_values + [out_size, job_info['total_time'], peak_mem]
 			spamwriter.writerow(data)
 
-def write_csvs():
+def write_csvs(workers = 1, chunk_size = 16, cache_file = "../derived_data/extraction_cache.db"):
 	"""
-
+	Writes one csv file per task type and run.
+	:param workers: the number of processes that parse the invocation files, 1 to parse them in this process, None for the number of processors (see extract_invocation_data.read_invocations)
+	:param chunk_size: the number of invocation files that are sent to a process at once
+	:param cache_file: the cache of parsed dax and invocation files, only new or changed files are parsed (see extract_invocation_data.open_cache), None to parse all files
 	:return:
 	"""
-	for wf_class, working_dir in data.working_dirs:
-
-		transformations = base.find_transformations_stampede('%s/genome-dax-0.stampede.db' % working_dir, main_jobs_only=True)
-
-		wf_id    = working_dir.split("/")[-1]
-		dax_file = "genome.dax"  # is the same for all of rafaels epigenomics workflows
+	cache = base.open_cache(cache_file) if cache_file is not None else None
 
-		for transformation in transformations:
+	try:
+		for wf_class, working_dir in data.working_dirs:
 
 			print("working_dir: {0}".format(working_dir))
 
-			# parse the input and output files for each task
-			job_file_map = base.parse_input_output_files(base.abs_path(working_dir, dax_file))
+			wf_id    = working_dir.split("/")[-1]
+			dax_file = "genome.dax"  # is the same for all of rafaels epigenomics workflows
 
-			# get the XML file names of the invocations of a given task
-			invocation_files = base.find_invocation_files_stampede(working_dir, transformation)
+			# parse the dax file and the invocation files of all task types of the run
+			job_file_map, jobs_by_transformation = base.extract_run(working_dir, dax_file, workers=workers, chunk_size=chunk_size, cache=cache)
 
-			# extract the invocation and file information from the XML files and update the job_file_map with it
-			jobs = []
-			for invocation_file in invocation_files:
-				job_id = base.parse_invocation_metrics(base.abs_path(working_dir, invocation_file), job_file_map)
-				jobs.append(job_id)
-
-#->			# Add information about run goup and run to job info
+			# Add information about run goup and run to job info
 			job_file_map["run_group"] = working_dir.split("/")[2]
 			job_file_map["run"]       = wf_id
 
-			# write the data to csv
-			transformation_short = transformation.split(":")[-2]
-			output_file = "../derived_data/%s_%s_%s.csv" % (wf_class, wf_id, transformation_short)
-			write_csv(jobs, job_file_map, output_file)
+			for transformation, jobs in jobs_by_transformation.items():
+
+				# write the data to csv
+				transformation_short = transformation.split(":")[-2]
+				output_file = "../derived_data/%s_%s_%s.csv" % (wf_class, wf_id, transformation_short)
+				write_csv(jobs, job_file_map, output_file)
+	finally:
+		if cache is not None:
+			cache.close()
 
 def merge(header, h):
 
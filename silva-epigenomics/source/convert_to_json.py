@@ -76,41 +76,39 @@ def as_cf20(job_information, workflow_id, jobs = None):
 	return jsonarray
 
 
-def write_json(working_dirs, dax_file = "genome.dax"):
+def write_json(working_dirs, dax_file = "genome.dax", workers = 1, chunk_size = 16, cache_file = "../derived_data/extraction_cache.db"):
 	"""
     Generates a json array of log entries, one for the start and one for the end of each invocation.
     :param dax_file
+    :param workers: the number of processes that parse the invocation files, 1 to parse them in this process, None for the number of processors (see extract_invocation_data.read_invocations)
+    :param chunk_size: the number of invocation files that are sent to a process at once
+    :param cache_file: the cache of parsed dax and invocation files, only new or changed files are parsed (see extract_invocation_data.open_cache), None to parse all files
 	"""
-	log_entries = []
-	for wf_class, working_dir in working_dirs:
-
-		# find all transformations in the workflow
-		transformations = base.find_transformations_stampede('%s/genome-dax-0.stampede.db' % working_dir, main_jobs_only=True)
-
-		# use the directory name to distinguish between several runs of the same workflow, e.g. 20160831T122313+0000
-		wf_id = working_dir.split("/")[-1]
-		jobs = []
+	cache = base.open_cache(cache_file) if cache_file is not None else None
 
-		# parse the input and output files for each task
-		job_file_map = base.parse_input_output_files(base.abs_path(working_dir, dax_file))
-
-		for transformation in transformations:
+	log_entries = []
+	try:
+		for wf_class, working_dir in working_dirs:
 
-			# get the XML file names of the invocations of a given task
-			invocation_files = base.find_invocation_files_stampede(working_dir, transformation)
+			# use the directory name to distinguish between several runs of the same workflow, e.g. 20160831T122313+0000
+			wf_id = working_dir.split("/")[-1]
 
-			# extract the invocation and file information from the XML files and update the job_file_map with it
+			# parse the dax file and the invocation files of all transformations in the workflow
 			# record every job's id for which this was done
-			for invocation_file in invocation_files:
-				job_id = base.parse_invocation_metrics(base.abs_path(working_dir, invocation_file), job_file_map)
-				jobs.append(job_id)
+			job_file_map, jobs_by_transformation = base.extract_run(working_dir, dax_file, workers=workers, chunk_size=chunk_size, cache=cache)
+			jobs = [job_id for transformation_jobs in jobs_by_transformation.values() for job_id in transformation_jobs]
 
-		# write the data to json
-		log_entries.extend(as_cf20(job_file_map, wf_id, jobs))
+			# write the data to json
+			log_entries.extend(as_cf20(job_file_map, wf_id, jobs))
+	finally:
+		if cache is not None:
+			cache.close()
 
 	output_file = "../derived_data/rafael.json"
 	with open(output_file, 'w', newline='') as textfile:
 		textfile.write(json.dumps(log_entries))
 
 
-write_json(data.working_dirs)
+# the worker processes import this module, they must not start another conversion
+if __name__ == '__main__':
+	write_json(data.working_dirs)
@@ -12,6 +12,9 @@
 			- see #find_invocation_files_stampede to relate the two
 			- see #parse_invocation_metrics for extracting the information from a single invocation xml file (as generated by their kickstart tool)
 	Uses the dax file of a workflow to identify input and output files of an invocation, see #parse_input_output_files
+	All information about a run is collected by #extract_run, which parses the dax file once and queries the invocation files of all task types at once
+		- the invocation files can be parsed by several processes, see #read_invocations
+		- the parsed dax and invocation files can be cached on disk, such that only new or changed files are parsed, see #open_cache
 
 	The information collection process proceeds in two steps, this is not optimal, but simple and safe
 	1. find the ordered input/output files of each job from the DAX file (the relationship is not clear from the .out files)
@@ -30,9 +33,36 @@
 __author__ = 'Carl Witt'
 __email__ = 'wittcarl@deneb.uberspace.de'
 
+import bisect
 import xml.etree.ElementTree
 import dateutil.parser
 import sqlite3
+import os
+import pickle
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# the elements of an invocation file that contain program behavior metrics, as path of namespaced tags below the invocation element
+INVOCATION_NAMESPACE = '{http://pegasus.isi.edu/schema/invocation}'
+INVOCATION_ELEMENTS = dict((tuple(INVOCATION_NAMESPACE + tag for tag in path.split("/")), name) for path, name in [
+	("mainjob", 'mainjob'),
+	("mainjob/usage", 'usage'),
+	("machine/uname", 'uname'),
+	("machine/linux/load", 'load'),
+	("machine/linux/procs", 'procs'),
+	("machine/linux/task", 'task'),
+	("machine/linux/ram", 'ram'),
+	("machine/linux/swap", 'swap'),
+])
+FILE_TAG = INVOCATION_NAMESPACE + 'file'
+
+# the number of parsed invocation files after which the cache is written to disk
+CACHE_COMMIT_INTERVAL = 256
+
+# the version of the parse results in the cache, to be increased when read_invocation or parse_input_output_files change their results
+# a cache with another version is cleared when it is opened (see open_cache)
+CACHE_VERSION = 1
 
 
 ''' ====================================================================================================================
@@ -120,6 +150,24 @@ def find_invocation_files_stampede(dir, transformation):
 	return file_names
 
 
+def find_invocation_files_by_transformation_stampede(dir):
+	'''
+	retrieves the names of the files that contain detailed information about the invocations of all task types (here called transformations) in a single query
+	uses the stampede.db SQlite database, which is not always available
+	:param dir: the directory containing the SQlite database (stampede.db) and the XML files describing the invocations
+	:return: dictionary from fully qualified transformation name (e.g., "genome::map:1.0") to the list of file names, relative to the given directory
+	'''
+	sqlite_query = "select invocation.transformation, stdout_file from invocation, job_instance where invocation.job_instance_id = job_instance.job_instance_id "
+
+	file_names = OrderedDict()
+	conn = sqlite3.connect('%s/genome-dax-0.stampede.db' % dir)
+	for row in conn.execute(sqlite_query):
+		file_names.setdefault(row[0], []).append(row[1])
+	conn.close()
+
+	return file_names
+
+
 def find_transformations_stampede(stampede_db, main_jobs_only = False):
 	'''
 	Retrieves the task types from the workflow run
@@ -169,82 +217,289 @@ def parse_invocation_metrics(file_name, job_file_map):
          	{'total': '933', 'running': '35', 'sleeping': '897', 'waiting': '1'}
 
 	'''
-	invocation_element = xml.etree.ElementTree.parse(file_name).getroot()
-
-	job_id         = invocation_element.get("derivation")
-	transformation = invocation_element.get("transformation")
-
-	job_file_map[job_id]['transformation'] = transformation
+	job_id, record = read_invocation(file_name)
+	merge_invocation(job_id, record, job_file_map)
+	return job_id
 
-	# extract program behavior metrics and update the input dictionary
-	mainjob = '{http://pegasus.isi.edu/schema/invocation}mainjob'
-	usage   = '{http://pegasus.isi.edu/schema/invocation}usage'
-	machine = '{http://pegasus.isi.edu/schema/invocation}machine'
-	uname   = '{http://pegasus.isi.edu/schema/invocation}uname'
-	linux   = '{http://pegasus.isi.edu/schema/invocation}linux'
-	load    = '{http://pegasus.isi.edu/schema/invocation}load'
 
-	procs   = '{http://pegasus.isi.edu/schema/invocation}procs'
-	task    = '{http://pegasus.isi.edu/schema/invocation}task'
-	ram     = '{http://pegasus.isi.edu/schema/invocation}ram'
-	swap    = '{http://pegasus.isi.edu/schema/invocation}swap'
+def read_invocation(file_name):
+	'''
+	Extracts the information from the XML file describing an invocation, without relating it to the dax file (see merge_invocation).
+	The file is read in a single pass without building the element tree, such that large captured program outputs do not need to be kept in memory.
+	The result consists of plain dictionaries, lists and strings, such that it can be returned from another process (see read_invocations).
+	:param file_name: The file to parse
+	:return: the job id and a dictionary with the transformation, the program behavior metrics (see parse_invocation_metrics) and
+		the attributes of all file elements (key 'files'), the file names are absolute paths
+	'''
+	# the attributes of the elements that contain the program behavior metrics (path -> attributes), see INVOCATION_ELEMENTS
+	elements = {}
+	files    = []
+
+	# single pass over the file: the attributes of the relevant elements are copied when the element starts, elements are cleared when they end
+	# an element is selected if it is the first child of its parent with its tag and its parent is selected (as with ElementTree.find chains)
+	path     = []
+	selected = []
+	seen     = set()
+	root     = None
+
+	for event, element in xml.etree.ElementTree.iterparse(file_name, events=("start", "end")):
+		if event == "start":
+			if root is None:
+				root = element
+				job_id = element.get("derivation")
+				record = {'transformation': element.get("transformation")}
+				path.append(element.tag)
+				selected.append(True)
+				continue
+
+			path.append(element.tag)
+			key = tuple(path[1:])
+			selected.append(selected[-1] and key not in seen)
+			if selected[-1]:
+				seen.add(key)
+				if key in INVOCATION_ELEMENTS:
+					elements[INVOCATION_ELEMENTS[key]] = dict(element.attrib)
+
+			# get information about all files
+			if element.tag == FILE_TAG:
+				files.append(dict(element.attrib))
+		else:
+			path.pop()
+			selected.pop()
+			element.clear()
+			# the cleared children of the root are removed as well
+			if len(path) == 1:
+				del root[:]
 
 	# wrap parse steps in lambdas for deferred evaluation (to be able to wrap them in try catch in a loop)
-	parse_steps = [('usage', lambda: invocation_element.find(mainjob).find(usage).attrib),
-				   ('mainjob_started_ts', lambda: dateutil.parser.parse(invocation_element.find(mainjob).get("start")).timestamp()),
-				   ('mainjob_duration', lambda: invocation_element.find(mainjob).get("duration")),
-				   ('procs', lambda: invocation_element.find(machine).find(linux).find(procs).attrib),
-				   ('task', lambda: invocation_element.find(machine).find(linux).find(task).attrib),
-				   ('load', lambda: invocation_element.find(machine).find(linux).find(load).attrib),
-				   ('ram', lambda: invocation_element.find(machine).find(linux).find(ram).attrib),
-				   ('swap', lambda: invocation_element.find(machine).find(linux).find(swap).attrib),
-				   ('host_name', lambda: invocation_element.find(machine).find(uname).get("nodename")), ]
+	parse_steps = [('usage', lambda: elements['usage']),
+				   ('mainjob_started_ts', lambda: dateutil.parser.parse(elements['mainjob']["start"]).timestamp()),
+				   ('mainjob_duration', lambda: elements['mainjob'].get("duration")),
+				   ('procs', lambda: elements['procs']),
+				   ('task', lambda: elements['task']),
+				   ('load', lambda: elements['load']),
+				   ('ram', lambda: elements['ram']),
+				   ('swap', lambda: elements['swap']),
+				   ('host_name', lambda: elements['uname'].get("nodename")), ]
 
 	# perform the parse steps
 	for target_attribute, expression in parse_steps:
 		try:
-			job_file_map[job_id][target_attribute] = expression()
-		except AttributeError as e:
-			print("{0} for {1}".format(e, file_name))
-			job_file_map[job_id][target_attribute] = "Not Parseable"
+			record[target_attribute] = expression()
+		except KeyError as e:
+			print("no {0} element or attribute for {1}".format(e, file_name))
+			record[target_attribute] = "Not Parseable"
 
-	# compute total time
-	job_file_map[job_id]['total_time'] = float(job_file_map[job_id]['usage']['utime']) + float(job_file_map[job_id]['usage']['stime'])
+	record['files'] = files
 
-	# get information about all files
-	file_selector = './/{http://pegasus.isi.edu/schema/invocation}file'
-	files = invocation_element.findall(file_selector)
+	return job_id, record
 
-	# enrich the information about input files
-	input_file_information = []
-	for input_file in job_file_map[job_id]['input_files']:
-		for file in files:
-			# the file names here are absolute paths, the file names when passed as argument are relative file names
-			if file.get("name").endswith(input_file):
-				extended_file_information = file.attrib
-				extended_file_information['name'] = input_file
-				input_file_information.append(extended_file_information)
-				break
 
-	# enrich the information output files
-	output_file_information = []
+def merge_invocation(job_id, record, job_file_map):
+	'''
+	Adds the information extracted from an invocation file (see read_invocation) to the job file map.
+	The input and output files of the job (from the dax file) are enriched with the information about the files of the invocation.
+	:param job_id: the job id of the invocation
+	:param record: the information extracted from the invocation file
+	:param job_file_map: Output of the parse_input_output_files function, this is updated to contain the additional information
+	'''
+	index = index_files(record['files'])
 
-	for output_file in job_file_map[job_id]['output_files']:
-		for file in files:
+	for target_attribute, value in record.items():
+		if target_attribute != 'files':
+			job_file_map[job_id][target_attribute] = value
 
-			# the file names here are absolute paths, the file names when passed as argument are relative file names
-			if file.get("name").endswith(output_file):
+	# compute total time
+	job_file_map[job_id]['total_time'] = float(job_file_map[job_id]['usage']['utime']) + float(job_file_map[job_id]['usage']['stime'])
 
-				extended_file_information = file.attrib
-				extended_file_information['name'] = output_file
-				output_file_information.append(extended_file_information)
-				break
+	# enrich the information about input and output files
+	input_file_information  = enrich_files(job_file_map[job_id]['input_files'], index)
+	output_file_information = enrich_files(job_file_map[job_id]['output_files'], index)
 
 	# return values by changing the input parameter
 	job_file_map[job_id]['input_files'] = input_file_information
 	job_file_map[job_id]['output_files'] = output_file_information
 
-	return job_id
+
+def index_files(files):
+	'''
+	Indexes the files of an invocation, such that the files used by a job can be looked up without scanning all files (see find_file).
+	:param files: the attributes of the file elements of an invocation (see read_invocation)
+	:return: dictionary with the files by base name (in document order) and the files sorted by reversed name (built on first use, see find_file)
+	'''
+	names = {}
+	for file in files:
+		names.setdefault(file.get("name", "").split("/")[-1], []).append(file)
+	return {"names": names, "files": files, "suffixes": None}
+
+
+def find_file(file_name, index):
+	'''
+	Finds the file of an invocation that corresponds to a file name from the dax file.
+	The file names of the invocation are absolute paths, the file names when passed as argument are relative file names.
+	The first file (in document order) whose path ends with the file name as a whole path component is used.
+	Only if there is no such file, the first file whose path ends with the file name in any way is used (e.g., /data/xa.map for a.map).
+	These files are found by binary search in the reversed file names, where the reversed file name is a prefix.
+	:param file_name: the relative file name
+	:param index: the files of the invocation (see index_files)
+	:return: the attributes of the file, None if there is no matching file
+	'''
+	for file in index["names"].get(file_name.split("/")[-1], []):
+		if file["name"] == file_name or file["name"].endswith("/" + file_name):
+			return file
+
+	if index["suffixes"] is None:
+		index["suffixes"] = sorted((file.get("name", "")[::-1], position) for position, file in enumerate(index["files"]))
+
+	suffixes = index["suffixes"]
+	reversed_name = file_name[::-1]
+	matches = []
+	for position in range(bisect.bisect_left(suffixes, (reversed_name,)), len(suffixes)):
+		if not suffixes[position][0].startswith(reversed_name):
+			break
+		matches.append(suffixes[position][1])
+
+	return index["files"][min(matches)] if len(matches) > 0 else None
+
+
+def enrich_files(file_names, index):
+	'''
+	Replaces the file names from the dax file with the information about the files of an invocation, files without information are omitted.
+	:param file_names: the relative file names
+	:param index: the files of the invocation (see index_files)
+	:return: the attributes of the found files, where the name is the relative file name
+	'''
+	file_information = []
+	for file_name in file_names:
+		file = find_file(file_name, index)
+		if file is not None:
+			extended_file_information = dict(file)
+			extended_file_information['name'] = file_name
+			file_information.append(extended_file_information)
+	return file_information
+
+
+def read_invocations(file_names, workers = 1, chunk_size = 16, cache = None):
+	'''
+	Extracts the information from several invocation files (see read_invocation).
+	:param file_names: the invocation files to parse
+	:param workers: the number of processes that parse the files, 1 to parse them in this process, None for the number of processors
+	:param chunk_size: the number of files that are sent to a process at once
+	:param cache: the cache of parsed files (see open_cache), None to parse all files
+	:return: the job id and record of each invocation file, in the order of the files
+	'''
+	# the files are identified before they are parsed, such that a file that changes during parsing is parsed again next time
+	keys    = [file_key(file_name) for file_name in file_names] if cache is not None else []
+	results = [cache_lookup(cache, key) for key in keys] if cache is not None else [None] * len(file_names)
+	missing = [i for i, result in enumerate(results) if result is None]
+
+	def collect(parsed):
+		# the results are written to the cache as they arrive, such that an interrupted extraction resumes where it stopped
+		try:
+			for count, (i, result) in enumerate(zip(missing, parsed)):
+				results[i] = result
+				if cache is not None:
+					cache_store(cache, keys[i], result)
+					if count % CACHE_COMMIT_INTERVAL == CACHE_COMMIT_INTERVAL - 1:
+						cache.commit()
+		finally:
+			if cache is not None:
+				cache.commit()
+
+	if workers == 1 or len(missing) < 2:
+		collect(read_invocation(file_names[i]) for i in missing)
+	else:
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			collect(executor.map(read_invocation, [file_names[i] for i in missing], chunksize=chunk_size))
+
+	return results
+
+
+def open_cache(cache_file):
+	'''
+	Opens the cache of parsed dax and invocation files, the cache file is created if it does not exist.
+	The cache is an SQlite database with one row per parsed file, containing the parse result as compressed pickle.
+	A parse result is used as long as the path, size and modification time of the file are the same (see file_key).
+	The version of the parse results is stored as user version of the database, the results of other versions are removed (see CACHE_VERSION).
+	:param cache_file: the SQlite database file
+	:return: the connection to the cache, to be closed by the caller
+	'''
+	cache = sqlite3.connect(cache_file)
+
+	if cache.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+		cache.execute("DROP TABLE IF EXISTS parsed")
+		cache.execute("PRAGMA user_version = %d" % CACHE_VERSION)
+
+	cache.execute("CREATE TABLE IF NOT EXISTS parsed (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, result BLOB)")
+	cache.commit()
+	return cache
+
+
+def file_key(file_name):
+	'''
+	Identifies the version of a file by its absolute path, its size and its modification time (in nanoseconds).
+	'''
+	stat = os.stat(file_name)
+	return os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns
+
+
+def cache_lookup(cache, key):
+	'''
+	:param key: the version of the file (see file_key)
+	:return: the cached parse result of the file, None if the file has not been parsed in this version
+	'''
+	row = cache.execute("SELECT result FROM parsed WHERE path = ? AND size = ? AND mtime = ?", key).fetchone()
+	return pickle.loads(zlib.decompress(row[0])) if row is not None else None
+
+
+def cache_store(cache, key, result):
+	'''
+	Stores the parse result of a file, replacing the result of previous versions of the file. The change is written to disk by the next commit.
+	:param key: the version of the file (see file_key)
+	'''
+	cache.execute("INSERT OR REPLACE INTO parsed VALUES (?, ?, ?, ?)", key + (zlib.compress(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)),))
+
+
+def extract_run(working_dir, dax_file = "genome.dax", transformations = None, workers = 1, chunk_size = 16, cache = None):
+	'''
+	Collects the information about the invocations of a workflow run.
+	The dax file is parsed once and the invocation files of all task types are retrieved with one query, such that the work is shared by all task types.
+	:param working_dir: the directory containing the dax file, the SQlite database (stampede.db) and the XML files describing the invocations
+	:param dax_file: the abstract DAG file, relative to the working directory
+	:param transformations: the fully qualified names of the task types to extract, None for all task types (without pegasus and dagman overhead)
+	:param workers: the number of processes that parse the invocation files, see read_invocations
+	:param chunk_size: the number of invocation files that are sent to a process at once
+	:param cache: the cache of parsed files (see open_cache), None to parse all files
+	:return: the job file map (see parse_input_output_files and parse_invocation_metrics) and a dictionary from transformation name to the ids of its jobs
+	'''
+	if transformations is None:
+		transformations = find_transformations_stampede('%s/genome-dax-0.stampede.db' % working_dir, main_jobs_only=True)
+
+	# parse the input and output files for each task
+	dax_key      = file_key(abs_path(working_dir, dax_file)) if cache is not None else None
+	job_file_map = cache_lookup(cache, dax_key) if cache is not None else None
+	if job_file_map is None:
+		job_file_map = parse_input_output_files(abs_path(working_dir, dax_file))
+		if cache is not None:
+			cache_store(cache, dax_key, job_file_map)
+			cache.commit()
+
+	# get the XML file names of the invocations of all task types
+	invocation_files = find_invocation_files_by_transformation_stampede(working_dir)
+
+	# extract the invocation and file information from the XML files (possibly in parallel) and update the job_file_map with it
+	file_names = [abs_path(working_dir, invocation_file) for transformation in transformations for invocation_file in invocation_files.get(transformation, [])]
+	records = iter(read_invocations(file_names, workers, chunk_size, cache))
+
+	jobs = OrderedDict()
+	for transformation in transformations:
+		jobs[transformation] = []
+		for _ in invocation_files.get(transformation, []):
+			job_id, record = next(records)
+			merge_invocation(job_id, record, job_file_map)
+			jobs[transformation].append(job_id)
+
+	return job_file_map, jobs
 
 
 def abs_path(working_dir, filename):
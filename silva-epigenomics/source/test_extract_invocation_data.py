@@ -0,0 +1,112 @@
+"""
+Tests of the lookup of the files of an invocation (see extract_invocation_data.find_file) and of the cache of parsed files (see extract_invocation_data.open_cache).
+Run with python -m unittest test_extract_invocation_data from the source directory.
+"""
+__author__ = 'Carl Witt'
+__email__ = 'wittcarl@deneb.uberspace.de'
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import extract_invocation_data as base
+
+
+def scan(file_name, files):
+	'''
+	Finds the file of a file name by scanning all files: the first file whose path ends with the file name as a whole path component,
+	otherwise the first file whose path ends with the file name.
+	'''
+	for file in files:
+		if file["name"] == file_name or file["name"].endswith("/" + file_name):
+			return file
+	for file in files:
+		if file["name"].endswith(file_name):
+			return file
+	return None
+
+
+class FindFileTest(unittest.TestCase):
+
+	def find(self, file_name, names):
+		files = [{"name": name, "size": str(size)} for size, name in enumerate(names)]
+		file = base.find_file(file_name, base.index_files(files))
+		return file["name"] if file is not None else None
+
+	def test_whole_path_component(self):
+		self.assertEqual(self.find("a.map", ["/data/xa.map", "/data/a.map"]), "/data/a.map")
+		self.assertEqual(self.find("chr21/a.map", ["/data/chr1/a.map", "/data/chr21/a.map"]), "/data/chr21/a.map")
+
+	def test_suffix(self):
+		self.assertEqual(self.find("a.map", ["/data/b.map", "/data/xa.map", "/data/ya.map"]), "/data/xa.map")
+		self.assertEqual(self.find("a.map", ["/data/ya.map", "/data/a.mapx", "/data/xa.map"]), "/data/ya.map")
+
+	def test_no_match(self):
+		self.assertIsNone(self.find("a.map", ["/data/a.fastq", "/data/b.map"]))
+		self.assertIsNone(self.find("a.map", []))
+
+	def test_same_as_scan(self):
+		generator = random.Random(1)
+		parts = ["a", "b", "ab", "ba", "a.map", "b.map", "x"]
+		for _ in range(300):
+			names = ["/" + "/".join(generator.choice(parts) for _ in range(generator.randint(1, 3))) for _ in range(generator.randint(0, 8))]
+			files = [{"name": name} for name in names]
+			index = base.index_files(files)
+			for file_name in parts + ["a/b", "b/a.map", "map"]:
+				self.assertIs(base.find_file(file_name, index), scan(file_name, files), (file_name, names))
+
+
+class CacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory  = tempfile.mkdtemp()
+		self.cache_file = os.path.join(self.directory, "cache.db")
+		self.parsed     = os.path.join(self.directory, "job.out")
+		with open(self.parsed, "w") as parsed:
+			parsed.write("<invocation/>")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def store(self, result):
+		cache = base.open_cache(self.cache_file)
+		try:
+			base.cache_store(cache, base.file_key(self.parsed), result)
+			cache.commit()
+		finally:
+			cache.close()
+
+	def lookup(self):
+		cache = base.open_cache(self.cache_file)
+		try:
+			return base.cache_lookup(cache, base.file_key(self.parsed))
+		finally:
+			cache.close()
+
+	def test_results_are_kept(self):
+		self.store(("job1", {"total_time": 3.5}))
+		self.assertEqual(self.lookup(), ("job1", {"total_time": 3.5}))
+
+	def test_changed_file_is_parsed_again(self):
+		self.store(("job1", {}))
+		with open(self.parsed, "a") as parsed:
+			parsed.write("\n")
+		self.assertIsNone(self.lookup())
+
+	def test_results_of_another_version_are_removed(self):
+		self.store(("job1", {}))
+		version = base.CACHE_VERSION
+		base.CACHE_VERSION = version + 1
+		try:
+			self.assertIsNone(self.lookup())
+			self.store(("job1", {"total_time": 1.0}))
+			self.assertEqual(self.lookup(), ("job1", {"total_time": 1.0}))
+		finally:
+			base.CACHE_VERSION = version
+		self.assertIsNone(self.lookup())
+
+
+if __name__ == '__main__':
+	unittest.main()
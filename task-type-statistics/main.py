@@ -11,11 +11,16 @@ from bokeh.models import ColumnDataSource, Slider, Div, Dropdown, SingleInterval
 from bokeh.models.axes import LinearAxis
 from bokeh.models.layouts import WidgetBox
 from bokeh.plotting import curdoc, figure
-from pymongo import MongoClient
 from scipy.stats import norm
 from scipy.stats import expon
 from scipy.stats import lognorm
 
+# the modules shared by the dashboards are located in the top level directory of the repository
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import database, polling, queries
+
 # brewer palette "paired"
 Paired12 = ['#a6cee3', '#1f78b4', '#b2df8a', '#33a02c', '#fb9a99', '#e31a1c', '#fdbf6f', '#ff7f00', '#cab2d6',
 			'#6a3d9a', '#ffff99', '#b15928']
@@ -36,8 +41,8 @@ TimeScaleColors = {'hours': '#e41a1c','minutes': '#377eb8', 'seconds': '#4daf4a'
 # Globals and Configuration
 # =====================================================================================================================
 
-# the database connection
-db = MongoClient().scientificworkflowlogs
+# the database connection (the connection pool is shared by all documents, see shared/database.py)
+db = database.get_database()
 
 
 # =====================================================================================================================
@@ -63,30 +68,12 @@ from bokeh.sampledata.daylight import daylight_warsaw_2013
 from bokeh.plotting import figure, show, output_file
 from bokeh.models import Span
 
-db = MongoClient().scientificworkflowlogs
-
-pipeline = [
-    {"$match": {
-        # "session.id":{"$in":["20160831T051239+0000", "20160831T050311+0000"]},
-        "data.info.tdur":{"$exists":True}
-        }},
-    {"$group": {
-        "_id": "$data.lam_name",
-        "count": {"$sum": 1},
-        "mean_duration": {"$avg": "$data.info.tdur"},
-        "sd_duration": {"$stdDevSamp":"$data.info.tdur"},
-        "data": { "$push": {
-            "session_id":"$session.id",
-            "duration":{"$divide": ["$data.info.tdur", 1000]},
-         }},
-     }},
-    {"$sort": {"_id":1}},
-    {"$match": {"count": {"$gt":1}}},
-	# {"$limit": 15}
-]
+# the duration statistics are refreshed by a poller that is started when the server is loaded (see server_lifecycle.py)
+# such that opening the page does not run the aggregation over all log entries
+key, create_state, fetch = queries.task_type_durations_poller(db.raw)
 
 plots = []
-for task_stats in db.raw.aggregate(pipeline):
+for task_stats in polling.current_state(key, create_state, fetch)["task_stats"]:
 
 	# sort by duration
 	sorted_data = sorted(task_stats['data'], key=lambda d: d['duration'])
@@ -1,10 +1,33 @@
 """
-
+Server lifecycle hooks of the task type statistics.
+When the server is loaded, the connection pool and the indexes are created and the duration statistics are computed,
+such that opening a page only builds the plots (see shared/database.py and shared/polling.py).
 """
 
 __author__ = 'Carl Witt'
 __email__ = 'wittcarl@deneb.uberspace.de'
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shared import database, indexes, polling, queries
+
+# the time between two updates of the duration statistics in milliseconds
+STATISTICS_PERIOD = 60000
+
+def on_server_loaded(server_context):
+    ''' If present, this function is called when the server first starts. '''
+    database.connect()
+    indexes.provision(database.get_database().raw)
+    key, create_state, fetch = queries.task_type_durations_poller(database.get_database().raw)
+    polling.start(key, create_state, fetch, STATISTICS_PERIOD)
+
+def on_server_unloaded(server_context):
+    ''' If present, this function is called when the server shuts down. '''
+    polling.stop_all()
+    database.close()
+
 def on_session_destroyed(session_context):
     ''' If present, this function is called when a session is closed. '''
-    print("session destroyed")
\ No newline at end of file
+    print("session destroyed")